@@ -0,0 +1,220 @@
+# core/announce_bridge.py - Ponte locale degli announce tra monitor e messenger
+#
+# Il monitor di rns_manager.py risolve già aspect, hop e dati radio di ogni
+# announce: l'AnnouncePublisher li ripubblica (solo lxmf.delivery) come righe
+# JSON su un socket locale, e il Messenger di lxmf_chat.py si iscrive con
+# AnnounceSubscriber invece di rifare lo stesso lavoro. Socket UNIX su
+# Linux, TCP su localhost su Windows (come il socket del monitor).
+import os
+import sys
+import json
+import time
+import queue
+import socket
+import threading
+
+IS_WINDOWS = sys.platform == 'win32'
+
+BRIDGE_PATH = os.path.expanduser("~/.rns_manager/announce_bridge.sock")
+BRIDGE_HOST = '127.0.0.1'
+BRIDGE_PORT = 5012
+
+# Announce in attesa di invio; oltre si scartano i più nuovi (i peer si riannunciano)
+PUBLISH_QUEUE_SIZE = 1000
+SEND_TIMEOUT = 1.0
+RECONNECT_DELAY = 5.0
+
+
+def _new_socket():
+    family = socket.AF_INET if IS_WINDOWS else socket.AF_UNIX
+    return socket.socket(family, socket.SOCK_STREAM)
+
+
+def _address():
+    return (BRIDGE_HOST, BRIDGE_PORT) if IS_WINDOWS else BRIDGE_PATH
+
+
+class AnnouncePublisher:
+    """Lato monitor: accetta iscritti e invia loro gli announce"""
+
+    def __init__(self):
+        self.server = None
+        self.subscribers = []
+        self.lock = threading.Lock()
+        self.queue = queue.Queue(maxsize=PUBLISH_QUEUE_SIZE)
+        self.running = False
+        self.published = 0
+        self.dropped = 0
+
+    def start(self):
+        try:
+            server = _new_socket()
+            if IS_WINDOWS:
+                server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            else:
+                try:
+                    os.unlink(BRIDGE_PATH)
+                except OSError:
+                    pass
+            server.bind(_address())
+            server.listen(4)
+        except OSError as e:
+            print(f"[AnnounceBridge] ⚠️ Ponte announce non disponibile: {e}")
+            return False
+
+        self.server = server
+        self.running = True
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+        threading.Thread(target=self._send_loop, daemon=True).start()
+        print(f"[AnnounceBridge] ✅ In ascolto su {_address()}")
+        return True
+
+    def publish(self, announce):
+        """Accoda un announce (non blocca il listener del monitor)"""
+        if not self.running:
+            return
+        with self.lock:
+            if not self.subscribers:
+                return
+        try:
+            self.queue.put_nowait(announce)
+        except queue.Full:
+            self.dropped += 1
+
+    def _accept_loop(self):
+        while self.running:
+            try:
+                conn, _ = self.server.accept()
+            except OSError:
+                break
+            conn.settimeout(SEND_TIMEOUT)
+            with self.lock:
+                self.subscribers.append(conn)
+            print("[AnnounceBridge] Nuovo iscritto")
+
+    def _send_loop(self):
+        while self.running:
+            try:
+                announce = self.queue.get(timeout=1)
+            except queue.Empty:
+                continue
+            # Serializzato una volta per tutti gli iscritti
+            line = (json.dumps(announce) + "\n").encode('utf-8')
+            with self.lock:
+                subscribers = list(self.subscribers)
+            for conn in subscribers:
+                try:
+                    conn.sendall(line)
+                except OSError:
+                    # Iscritto chiuso o bloccato: lo si scollega, si riconnetterà
+                    with self.lock:
+                        if conn in self.subscribers:
+                            self.subscribers.remove(conn)
+                    try:
+                        conn.close()
+                    except OSError:
+                        pass
+            self.published += 1
+
+    def stop(self):
+        self.running = False
+        if self.server:
+            try:
+                self.server.close()
+            except OSError:
+                pass
+        with self.lock:
+            for conn in self.subscribers:
+                try:
+                    conn.close()
+                except OSError:
+                    pass
+            self.subscribers = []
+        if not IS_WINDOWS:
+            try:
+                os.unlink(BRIDGE_PATH)
+            except OSError:
+                pass
+
+    def get_stats(self):
+        with self.lock:
+            subscribers = len(self.subscribers)
+        return {
+            'subscribers': subscribers,
+            'published': self.published,
+            'dropped': self.dropped,
+            'queued': self.queue.qsize()
+        }
+
+
+class AnnounceSubscriber:
+    """Lato messenger: si collega al monitor e passa ogni announce al callback"""
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.connected = False
+        self.running = False
+        self.received = 0
+        self.sock = None
+
+    def start(self):
+        self.running = True
+        threading.Thread(target=self._loop, daemon=True).start()
+
+    def _loop(self):
+        while self.running:
+            sock = _new_socket()
+            try:
+                sock.settimeout(5)
+                sock.connect(_address())
+                sock.settimeout(None)
+            except OSError:
+                # Monitor non avviato: riprova più tardi
+                sock.close()
+                time.sleep(RECONNECT_DELAY)
+                continue
+
+            self.sock = sock
+            self.connected = True
+            print("📡 Collegato al ponte announce del monitor")
+            try:
+                self._read(sock)
+            except OSError:
+                pass
+            finally:
+                self.connected = False
+                self.sock = None
+                sock.close()
+            if self.running:
+                print("📡 Ponte announce scollegato, riprovo...")
+                time.sleep(RECONNECT_DELAY)
+
+    def _read(self, sock):
+        buffer = b''
+        while self.running:
+            data = sock.recv(16384)
+            if not data:
+                return
+            buffer += data
+            *lines, buffer = buffer.split(b'\n')
+            for line in lines:
+                if not line.strip():
+                    continue
+                try:
+                    announce = json.loads(line)
+                except ValueError:
+                    continue
+                self.received += 1
+                try:
+                    self.callback(announce)
+                except Exception as e:
+                    print(f"⚠️ Errore announce dal ponte: {e}")
+
+    def stop(self):
+        self.running = False
+        sock = self.sock
+        if sock:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
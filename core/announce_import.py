@@ -0,0 +1,176 @@
+# core/announce_import.py - Import incrementale da announces.db (monitor RNS)
+#
+# Legge solo le righe lxmf.delivery con id oltre l'ultimo importato (il
+# watermark sta in peers.db, tabella import_state), le raggruppa per
+# destinazione e le scrive a blocchi con executemany. Un announce più vecchio
+# di quanto già noto non sovrascrive il peer. Volendo gira in background.
+import os
+import time
+import sqlite3
+import threading
+from functools import lru_cache
+
+import LXMF
+
+from core.db import sort_name
+
+# Righe di announces.db lette per transazione
+IMPORT_BATCH = 5000
+
+SOURCE_NAME = 'announces.db'
+
+IDENTITY_UPSERT = '''
+    INSERT INTO identities (identity_hash, display_name, sort_name, first_seen, last_seen)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(identity_hash) DO UPDATE SET
+        display_name = excluded.display_name,
+        sort_name = excluded.sort_name,
+        last_seen = excluded.last_seen
+    WHERE excluded.last_seen >= COALESCE(identities.last_seen, 0)
+'''
+
+DESTINATION_UPSERT = '''
+    INSERT INTO destinations (destination_hash, identity_hash, aspect, last_seen, hops, rssi, snr, q, app_data)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(destination_hash) DO UPDATE SET
+        identity_hash = excluded.identity_hash,
+        last_seen = excluded.last_seen,
+        hops = excluded.hops,
+        rssi = excluded.rssi,
+        snr = excluded.snr,
+        q = excluded.q,
+        app_data = excluded.app_data
+    WHERE excluded.last_seen >= COALESCE(destinations.last_seen, 0)
+'''
+
+
+@lru_cache(maxsize=4096)
+def display_name_from_hex(data_hex):
+    """Nome annunciato dall'app_data salvato dal monitor (hex, o testo per i dati vecchi)"""
+    if not data_hex:
+        return None
+    try:
+        app_data = bytes.fromhex(data_hex)
+    except ValueError:
+        app_data = data_hex.encode('utf-8')
+    try:
+        return LXMF.display_name_from_app_data(app_data)
+    except Exception:
+        return None
+
+
+class AnnounceImporter:
+    def __init__(self, db, source_path):
+        self.db = db
+        self.source_path = source_path
+        self.lock = threading.Lock()
+        self.thread = None
+        self.running = False
+
+    def init_schema(self):
+        with self.db.write() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS import_state (
+                    source TEXT PRIMARY KEY,
+                    last_id INTEGER DEFAULT 0,
+                    last_timestamp REAL,
+                    updated_at REAL
+                )
+            ''')
+
+    def last_id(self):
+        row = self.db.query_one('SELECT last_id FROM import_state WHERE source = ?', (SOURCE_NAME,))
+        return row[0] if row else 0
+
+    def run(self, full=False):
+        """
+        Importa gli announce nuovi (tutti con full=True).
+        Restituisce il numero di destinazioni aggiornate.
+        """
+        if not os.path.exists(self.source_path):
+            return 0
+        with self.lock:
+            return self._run(full)
+
+    def _run(self, full):
+        last_id = 0 if full else self.last_id()
+        # Sola lettura: il monitor continua a scrivere in WAL
+        src = sqlite3.connect(f'file:{self.source_path}?mode=ro', uri=True, timeout=10)
+        imported = 0
+        try:
+            # announces.db ricreato (id ripartiti da capo): si ricomincia dall'inizio
+            max_id = src.execute('SELECT MAX(id) FROM announces').fetchone()[0] or 0
+            if max_id < last_id:
+                last_id = 0
+
+            while True:
+                rows = src.execute('''
+                    SELECT id, dest_hash, timestamp, hops, data, identity_hash, rssi, snr, q
+                    FROM announces
+                    WHERE id > ? AND aspect = 'lxmf.delivery'
+                    ORDER BY id
+                    LIMIT ?
+                ''', (last_id, IMPORT_BATCH)).fetchall()
+                if not rows:
+                    break
+
+                # Ultimo announce di ogni destinazione nel blocco
+                latest = {}
+                for row in rows:
+                    current = latest.get(row[1])
+                    if current is None or (row[2] or 0) >= (current[2] or 0):
+                        latest[row[1]] = row
+                last_id = rows[-1][0]
+                self._write(latest.values(), last_id, max(row[2] or 0 for row in rows))
+                imported += len(latest)
+        finally:
+            src.close()
+        return imported
+
+    def _write(self, rows, last_id, last_timestamp):
+        identities = []
+        destinations = []
+        for _, dest_hash, ts, hops, data_hex, identity_hash, rssi, snr, q in sorted(rows, key=lambda r: r[2] or 0):
+            display_name = display_name_from_hex(data_hex) or dest_hash[:8]
+            if identity_hash:
+                identities.append((identity_hash, display_name, sort_name(display_name), ts, ts))
+            destinations.append((dest_hash, identity_hash, 'lxmf.delivery', ts, hops, rssi, snr, q, data_hex))
+
+        with self.db.write() as conn:
+            if identities:
+                conn.executemany(IDENTITY_UPSERT, identities)
+            conn.executemany(DESTINATION_UPSERT, destinations)
+            # Watermark nella stessa transazione: un'interruzione non salta righe
+            conn.execute('''
+                INSERT INTO import_state (source, last_id, last_timestamp, updated_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(source) DO UPDATE SET
+                    last_id = excluded.last_id,
+                    last_timestamp = MAX(COALESCE(import_state.last_timestamp, 0), excluded.last_timestamp),
+                    updated_at = excluded.updated_at
+            ''', (SOURCE_NAME, last_id, last_timestamp, time.time()))
+
+    # ============================================
+    # BACKGROUND
+    # ============================================
+
+    def start(self, interval):
+        """Import continuo ogni `interval` secondi"""
+        if self.running or not interval or interval <= 0:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._loop, args=(interval,), daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+
+    def _loop(self, interval):
+        while self.running:
+            try:
+                imported = self.run()
+                if imported:
+                    print(f"📢 Import announce: {imported} peer aggiornati")
+            except Exception as e:
+                print(f"⚠️ Errore import announce: {e}")
+            time.sleep(interval)
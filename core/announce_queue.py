@@ -0,0 +1,125 @@
+# core/announce_queue.py - Coda degli announce con scrittura in background
+#
+# Il callback degli announce gira sul thread di trasporto di Reticulum: lì
+# si mette solo lo stato in memoria, una voce per destinazione (conta solo
+# l'ultimo announce). Un thread scrittore svuota la coda a blocchi, con una
+# transazione e due executemany, così le scritture lente su SD non rallentano
+# l'elaborazione degli announce di RNS.
+import time
+import threading
+
+from core.db import sort_name
+
+# Attesa massima prima di scrivere (secondi) e voci che forzano la scrittura
+FLUSH_INTERVAL = 2.0
+FLUSH_SIZE = 200
+
+IDENTITY_UPSERT = '''
+    INSERT INTO identities (identity_hash, display_name, sort_name, first_seen, last_seen)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(identity_hash) DO UPDATE SET
+        display_name = excluded.display_name,
+        sort_name = excluded.sort_name,
+        last_seen = excluded.last_seen
+'''
+
+DESTINATION_UPSERT = '''
+    INSERT INTO destinations (destination_hash, identity_hash, aspect, last_seen, hops, rssi, snr, q, app_data)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(destination_hash) DO UPDATE SET
+        identity_hash = excluded.identity_hash,
+        last_seen = excluded.last_seen,
+        hops = excluded.hops,
+        rssi = COALESCE(excluded.rssi, destinations.rssi),
+        snr = COALESCE(excluded.snr, destinations.snr),
+        q = COALESCE(excluded.q, destinations.q),
+        app_data = excluded.app_data
+'''
+
+
+class AnnounceQueue:
+    def __init__(self, db, interval=FLUSH_INTERVAL, batch_size=FLUSH_SIZE):
+        self.db = db
+        self.interval = interval
+        self.batch_size = batch_size
+        # destination_hash -> ultimo stato annunciato
+        self.pending = {}
+        self.cond = threading.Condition()
+        self.running = True
+        self.received = 0
+        self.written = 0
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def put(self, destination_hash, identity_hash, display_name, hops, app_data_hex,
+            aspect='lxmf.delivery', timestamp=None, rssi=None, snr=None, q=None):
+        """Accoda un announce (nessun I/O: chiamabile dal thread di Reticulum)"""
+        with self.cond:
+            self.pending[destination_hash] = (
+                identity_hash, display_name, hops, app_data_hex, aspect, timestamp or time.time(),
+                rssi, snr, q
+            )
+            self.received += 1
+            if len(self.pending) >= self.batch_size:
+                self.cond.notify()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                if self.running and len(self.pending) < self.batch_size:
+                    self.cond.wait(self.interval)
+                if not self.running and not self.pending:
+                    return
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"⚠️ Errore scrittura announce: {e}")
+                time.sleep(self.interval)
+
+    def flush(self):
+        """Scrive subito le voci in coda (una transazione). Restituisce quante."""
+        with self.cond:
+            if not self.pending:
+                return 0
+            batch, self.pending = self.pending, {}
+
+        identities = []
+        destinations = []
+        # In ordine di tempo: su identità condivise vince l'announce più recente
+        for dest_hash, (identity_hash, name, hops, app_data_hex, aspect, ts, rssi, snr, q) in sorted(
+                batch.items(), key=lambda item: item[1][5]):
+            if identity_hash:
+                identities.append((identity_hash, name, sort_name(name), ts, ts))
+            destinations.append((dest_hash, identity_hash, aspect, ts, hops, rssi, snr, q, app_data_hex))
+
+        try:
+            with self.db.write() as conn:
+                if identities:
+                    conn.executemany(IDENTITY_UPSERT, identities)
+                conn.executemany(DESTINATION_UPSERT, destinations)
+        except Exception:
+            # Rimette in coda ciò che non è stato scritto (senza coprire announce più nuovi)
+            with self.cond:
+                for dest_hash, entry in batch.items():
+                    self.pending.setdefault(dest_hash, entry)
+            raise
+
+        self.written += len(destinations)
+        return len(destinations)
+
+    def stop(self, timeout=5.0):
+        """Ferma lo scrittore dopo aver scritto le voci rimaste"""
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        self.thread.join(timeout)
+
+    def get_stats(self):
+        with self.cond:
+            pending = len(self.pending)
+        return {
+            'pending': pending,
+            'received': self.received,
+            'written': self.written,
+            'coalesced': self.received - self.written - pending
+        }
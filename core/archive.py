@@ -0,0 +1,236 @@
+# core/archive.py - Archivio dei messaggi vecchi in segmenti compressi
+#
+# I messaggi più vecchi di N giorni escono da peers.db e finiscono in file
+# di segmento mensili (archive/messages-AAAA-MM.seg), solo in append: ogni
+# record è [lunghezza 4 byte][JSON compresso con zlib] con il messaggio e il
+# suo pacchetto raw. In SQLite resta solo archive_index (hash → segmento,
+# offset) con conversazione e timestamp, così le API delle conversazioni e
+# degli allegati trovano i messaggi archiviati senza scandire i file. La
+# ricerca full-text non li copre: l'indice segue solo la tabella messages.
+import os
+import json
+import time
+import zlib
+import base64
+import struct
+import threading
+
+# Messaggi archiviati per transazione
+ARCHIVE_BATCH = 500
+
+# Età di default prima dell'archiviazione (giorni)
+DEFAULT_ARCHIVE_DAYS = 180
+
+RECORD_HEADER = struct.Struct('>I')
+
+# Colonne di messages conservate nei record
+ARCHIVE_COLUMNS = (
+    'hash', 'source_hash', 'destination_hash', 'conversation_hash', 'content', 'title',
+    'timestamp', 'method', 'packed_size', 'rssi', 'snr', 'q', 'hops', 'incoming', 'attachments'
+)
+
+
+def segment_name(timestamp):
+    """Segmento mensile (UTC) di un messaggio"""
+    return time.strftime('messages-%Y-%m.seg', time.gmtime(timestamp or 0))
+
+
+def encode_record(message, raw=None):
+    record = dict(message)
+    record['raw'] = base64.b64encode(raw).decode('ascii') if raw else None
+    payload = zlib.compress(json.dumps(record, separators=(',', ':')).encode('utf-8'), 9)
+    return RECORD_HEADER.pack(len(payload)) + payload
+
+
+def decode_record(payload):
+    record = json.loads(zlib.decompress(payload).decode('utf-8'))
+    raw = record.get('raw')
+    record['raw'] = base64.b64decode(raw) if raw else None
+    return record
+
+
+class MessageArchive:
+    def __init__(self, db, archive_dir):
+        self.db = db
+        self.archive_dir = archive_dir
+        # Un solo job di archiviazione alla volta (timer e richiesta manuale)
+        self.lock = threading.Lock()
+        os.makedirs(self.archive_dir, exist_ok=True)
+
+    def init_schema(self):
+        with self.db.write() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS archive_index (
+                    hash TEXT PRIMARY KEY,
+                    conversation_hash TEXT,
+                    timestamp REAL,
+                    incoming INTEGER,
+                    segment TEXT NOT NULL,
+                    offset INTEGER NOT NULL,
+                    length INTEGER NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_archive_conversation ON archive_index(conversation_hash, timestamp)')
+
+    def _segment_path(self, segment):
+        return os.path.join(self.archive_dir, segment)
+
+    # ============================================
+    # ARCHIVIAZIONE
+    # ============================================
+
+    def archive_older_than(self, days=DEFAULT_ARCHIVE_DAYS):
+        """Archivia i messaggi con più di `days` giorni. Restituisce quanti."""
+        if not days or days <= 0:
+            return 0
+        return self.archive_before(time.time() - days * 86400)
+
+    def archive_before(self, cutoff):
+        """
+        Sposta nei segmenti i messaggi con timestamp < cutoff, a blocchi: prima
+        append + fsync dei record, poi indice e DELETE in una transazione.
+        Un'interruzione a metà lascia al massimo record orfani in coda ai segmenti.
+        """
+        with self.lock:
+            archived = self._archive_before(cutoff)
+        if archived:
+            # Restituisce al filesystem le pagine liberate, a piccoli passi
+            self.db.reclaim()
+        return archived
+
+    def _archive_before(self, cutoff):
+        columns = ', '.join(f'm.{name}' for name in ARCHIVE_COLUMNS)
+        archived = 0
+        while True:
+            rows = self.db.query(f'''
+                SELECT {columns}, r.data, r.compressed
+                FROM messages m
+                LEFT JOIN raw_packets r ON r.hash = m.hash
+                WHERE m.timestamp < ?
+                ORDER BY m.timestamp
+                LIMIT ?
+            ''', (cutoff, ARCHIVE_BATCH))
+            if not rows:
+                break
+
+            index_rows = self._append(rows)
+            hashes = [(row[0],) for row in index_rows]
+            with self.db.write() as conn:
+                conn.executemany('''
+                    INSERT OR REPLACE INTO archive_index
+                    (hash, conversation_hash, timestamp, incoming, segment, offset, length)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', index_rows)
+                conn.executemany('DELETE FROM messages WHERE hash = ?', hashes)
+                conn.executemany('DELETE FROM raw_packets WHERE hash = ?', hashes)
+            archived += len(index_rows)
+        return archived
+
+    def _append(self, rows):
+        """Scrive i record nei segmenti mensili; restituisce le righe di archive_index"""
+        by_segment = {}
+        for row in rows:
+            message = dict(zip(ARCHIVE_COLUMNS, row[:len(ARCHIVE_COLUMNS)]))
+            data, compressed = row[len(ARCHIVE_COLUMNS):]
+            raw = None
+            if data is not None:
+                raw = zlib.decompress(data) if compressed else bytes(data)
+            by_segment.setdefault(segment_name(message['timestamp']), []).append((message, raw))
+
+        index_rows = []
+        for segment, records in by_segment.items():
+            with open(self._segment_path(segment), 'ab') as f:
+                for message, raw in records:
+                    offset = f.tell()
+                    record = encode_record(message, raw)
+                    f.write(record)
+                    index_rows.append((
+                        message['hash'], message['conversation_hash'], message['timestamp'],
+                        message['incoming'], segment,
+                        offset + RECORD_HEADER.size, len(record) - RECORD_HEADER.size
+                    ))
+                f.flush()
+                os.fsync(f.fileno())
+        return index_rows
+
+    # ============================================
+    # LETTURA
+    # ============================================
+
+    def load(self, hashes):
+        """Record archiviati {hash: messaggio}, una lettura per segmento in ordine di offset"""
+        hashes = list(hashes)
+        if not hashes:
+            return {}
+        marks = ', '.join('?' for _ in hashes)
+        rows = self.db.query(f'''
+            SELECT hash, segment, offset, length FROM archive_index
+            WHERE hash IN ({marks})
+            ORDER BY segment, offset
+        ''', hashes)
+
+        records = {}
+        current, f = None, None
+        try:
+            for msg_hash, segment, offset, length in rows:
+                if segment != current:
+                    if f:
+                        f.close()
+                    f = open(self._segment_path(segment), 'rb')
+                    current = segment
+                f.seek(offset)
+                records[msg_hash] = decode_record(f.read(length))
+        finally:
+            if f:
+                f.close()
+        return records
+
+    def get(self, msg_hash):
+        return self.load([msg_hash]).get(msg_hash)
+
+    def get_raw(self, msg_hash):
+        """Pacchetto raw di un messaggio archiviato (sorgente di riserva per RawStore)"""
+        record = self.get(msg_hash)
+        return record['raw'] if record else None
+
+    def timestamp_of(self, msg_hash):
+        row = self.db.query_one('SELECT timestamp FROM archive_index WHERE hash = ?', (msg_hash,))
+        return row[0] if row else None
+
+    def conversation_keys(self, conversation_hash, limit, before=None, after=None):
+        """
+        Chiavi (timestamp, hash) dei messaggi archiviati di una chat, con lo stesso
+        ordinamento e cursore di /api/conversation (before/after = (timestamp, hash))
+        """
+        sql = 'SELECT timestamp, hash FROM archive_index WHERE conversation_hash = ?'
+        params = [conversation_hash]
+        if before:
+            sql += ' AND (timestamp < ? OR (timestamp = ? AND hash < ?))'
+            params += [before[0], before[0], before[1]]
+            order = 'DESC'
+        elif after:
+            sql += ' AND (timestamp > ? OR (timestamp = ? AND hash > ?))'
+            params += [after[0], after[0], after[1]]
+            order = 'ASC'
+        else:
+            order = 'DESC'
+        sql += f' ORDER BY timestamp {order}, hash {order} LIMIT ?'
+        params.append(int(limit))
+        return self.db.query(sql, params)
+
+    def get_stats(self):
+        row = self.db.query_one('SELECT COUNT(*), MIN(timestamp), MAX(timestamp) FROM archive_index')
+        segments = []
+        for name in sorted(os.listdir(self.archive_dir)):
+            if name.endswith('.seg'):
+                segments.append({
+                    'name': name,
+                    'size': os.path.getsize(self._segment_path(name))
+                })
+        return {
+            'messages': row[0],
+            'oldest': row[1],
+            'newest': row[2],
+            'segments': segments,
+            'total_bytes': sum(s['size'] for s in segments)
+        }
@@ -0,0 +1,167 @@
+# core/blob_store.py - Archivio allegati indirizzato per contenuto
+#
+# Ogni allegato è salvato una sola volta come file <root>/<aa>/<sha256>:
+# in messages.attachments restano solo i metadati (tipo, formato, dimensione,
+# sha256). Lo stesso contenuto ricevuto più volte occupa spazio una volta sola.
+import os
+import json
+import hashlib
+import tempfile
+
+SHA256_HEX_LENGTH = 64
+
+# Righe migrate per transazione
+MIGRATION_BATCH = 50
+
+
+class BlobStore:
+    def __init__(self, root_dir):
+        self.root_dir = root_dir
+        os.makedirs(self.root_dir, exist_ok=True)
+
+    @staticmethod
+    def is_valid_key(key):
+        return isinstance(key, str) and len(key) == SHA256_HEX_LENGTH and all(c in '0123456789abcdef' for c in key)
+
+    def path(self, key):
+        if not self.is_valid_key(key):
+            raise ValueError(f"Chiave blob non valida: {key}")
+        return os.path.join(self.root_dir, key[:2], key)
+
+    def exists(self, key):
+        try:
+            return os.path.isfile(self.path(key))
+        except ValueError:
+            return False
+
+    def put(self, data):
+        """Salva i bytes (se non già presenti) e restituisce lo sha256 hex"""
+        key = hashlib.sha256(data).hexdigest()
+        dest = self.path(key)
+        if os.path.isfile(dest):
+            return key
+
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        # Scrittura atomica: un lettore non vede mai un file parziale
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(dest), prefix='.tmp_')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, dest)
+        except Exception:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+        return key
+
+    def get(self, key):
+        with open(self.path(key), 'rb') as f:
+            return f.read()
+
+    def delete(self, key):
+        try:
+            os.unlink(self.path(key))
+            return True
+        except (OSError, ValueError):
+            return False
+
+    def get_stats(self):
+        count = 0
+        total = 0
+        for dirpath, _, filenames in os.walk(self.root_dir):
+            for name in filenames:
+                if name.startswith('.tmp_'):
+                    continue
+                count += 1
+                total += os.path.getsize(os.path.join(dirpath, name))
+        return {'blobs': count, 'bytes': total}
+
+
+def describe_attachment(att):
+    """
+    Normalizza un allegato salvato in messages.attachments (dict nuovo o
+    vecchio formato [tipo, dati]) in (tipo, dati) oppure (None, None)
+    """
+    if isinstance(att, dict):
+        return att.get('type'), att
+    if isinstance(att, list) and len(att) == 2 and isinstance(att[1], dict):
+        return att[0], att[1]
+    return None, None
+
+
+def attachment_media(att_type, meta):
+    """Restituisce (mime_type, filename, inline) per un allegato"""
+    if att_type == 'image':
+        img_format = meta.get('format', 'jpg')
+        return f"image/{img_format}", f"image.{img_format}", True
+    if att_type == 'audio':
+        mode = meta.get('mode', 16)
+        if mode < 16:
+            return "application/octet-stream", f"audio_c2_{mode}.c2", False
+        return "audio/ogg", "audio.opus", True
+    if att_type == 'file':
+        return "application/octet-stream", meta.get('name', 'file.bin'), False
+    return None, None, False
+
+
+def migrate_hex_attachments(db, store):
+    """
+    Sposta nel blob store gli allegati ancora salvati come hex dentro
+    messages.attachments. Restituisce il numero di messaggi migrati.
+    """
+    if not db.table_exists('messages'):
+        return 0
+
+    migrated = 0
+    last_rowid = 0
+    while True:
+        rows = db.query('''
+            SELECT rowid, attachments FROM messages
+            WHERE rowid > ? AND attachments LIKE '%"bytes"%'
+            ORDER BY rowid LIMIT ?
+        ''', (last_rowid, MIGRATION_BATCH))
+        if not rows:
+            break
+
+        updates = []
+        for rowid, attachments_json in rows:
+            last_rowid = rowid
+            try:
+                attachments = json.loads(attachments_json)
+            except Exception:
+                continue
+
+            new_list = []
+            changed = False
+            for att in attachments:
+                att_type, meta = describe_attachment(att)
+                if meta is None or 'bytes' not in meta:
+                    new_list.append(att)
+                    continue
+                try:
+                    data = bytes.fromhex(meta['bytes'])
+                except (TypeError, ValueError) as e:
+                    # Hex illeggibile: resta com'è, il resto della migrazione prosegue
+                    print(f"⚠️ Allegato non migrabile nel messaggio {rowid}: {e}")
+                    new_list.append(att)
+                    continue
+                entry = {k: v for k, v in meta.items() if k != 'bytes'}
+                entry['type'] = att_type
+                entry['size'] = len(data)
+                entry['sha256'] = store.put(data)
+                new_list.append(entry)
+                changed = True
+            if changed:
+                updates.append((json.dumps(new_list), rowid))
+
+        if updates:
+            db.executemany('UPDATE messages SET attachments = ? WHERE rowid = ?', updates)
+            migrated += len(updates)
+
+    if migrated:
+        # Recupera lo spazio occupato dagli hex (VACUUM non può stare in una transazione)
+        db.vacuum()
+
+    return migrated
@@ -0,0 +1,229 @@
+# core/conversations.py - Riepilogo delle conversazioni
+#
+# Una riga per peer nella tabella conversations: ultimo messaggio, contatori
+# e watermark di lettura. Viene aggiornata nella stessa transazione in cui
+# il Messenger salva il messaggio (o ne registra la consegna), così la lista
+# delle chat è una sola query sull'indice last_timestamp, qualunque sia la
+# lunghezza della cronologia.
+
+# Caratteri dell'anteprima dell'ultimo messaggio
+PREVIEW_CHARS = 120
+ATTACHMENT_PREVIEW = '📎'
+
+# Anteprima calcolata in SQL per la ricostruzione (stessa regola di message_preview)
+PREVIEW_SQL = f'''
+    COALESCE(
+        NULLIF(substr(m.content, 1, {PREVIEW_CHARS}), ''),
+        NULLIF(substr(m.title, 1, {PREVIEW_CHARS}), ''),
+        CASE WHEN m.attachments IS NOT NULL THEN '{ATTACHMENT_PREVIEW}' ELSE '' END
+    )
+'''
+
+CONVERSATION_COLUMNS = (
+    'peer_hash', 'last_message_hash', 'last_timestamp', 'last_preview',
+    'last_incoming', 'last_status', 'message_count', 'sent_count',
+    'received_count', 'unread_count', 'last_read_timestamp'
+)
+
+
+def message_preview(content, title=None, has_attachments=False):
+    """Testo breve dell'ultimo messaggio: contenuto, poi titolo, poi 📎 per i soli allegati"""
+    text = (content or '')[:PREVIEW_CHARS] or (title or '')[:PREVIEW_CHARS]
+    if not text and has_attachments:
+        return ATTACHMENT_PREVIEW
+    return text
+
+
+class ConversationIndex:
+    def __init__(self, db):
+        self.db = db
+
+    def init_schema(self):
+        """Crea la tabella; al primo avvio la ricostruisce dai messaggi esistenti"""
+        created = not self.db.table_exists('conversations')
+        with self.db.write() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS conversations (
+                    peer_hash TEXT PRIMARY KEY,
+                    last_message_hash TEXT,
+                    last_timestamp REAL,
+                    last_preview TEXT,
+                    last_incoming INTEGER,
+                    last_status TEXT,
+                    message_count INTEGER DEFAULT 0,
+                    sent_count INTEGER DEFAULT 0,
+                    received_count INTEGER DEFAULT 0,
+                    unread_count INTEGER DEFAULT 0,
+                    last_read_timestamp REAL DEFAULT 0
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_conversations_activity ON conversations(last_timestamp)')
+            if created:
+                self.rebuild(conn)
+
+    def rebuild(self, conn):
+        """
+        Ricalcola il riepilogo da messages (la cronologia esistente conta come letta)
+        e riallinea i contatori messages_sent / messages_received di destinations
+        """
+        conn.execute('DELETE FROM conversations')
+        conn.execute('''
+            INSERT INTO conversations
+                (peer_hash, last_timestamp, message_count, sent_count, received_count,
+                 unread_count, last_read_timestamp)
+            SELECT conversation_hash, MAX(timestamp), COUNT(*),
+                   SUM(incoming = 0), SUM(incoming = 1), 0, MAX(timestamp)
+            FROM messages
+            WHERE conversation_hash IS NOT NULL
+            GROUP BY conversation_hash
+        ''')
+        conn.execute(f'''
+            UPDATE conversations SET
+                (last_message_hash, last_preview, last_incoming, last_status) = (
+                    SELECT m.hash, {PREVIEW_SQL}, m.incoming,
+                           CASE WHEN m.incoming = 1 THEN 'delivered'
+                                ELSE COALESCE(s.status, 'sent') END
+                    FROM messages m
+                    LEFT JOIN sent_messages s ON s.hash = m.hash
+                    WHERE m.conversation_hash = conversations.peer_hash
+                    ORDER BY m.timestamp DESC, m.hash DESC
+                    LIMIT 1
+                )
+        ''')
+        conn.execute('''
+            UPDATE destinations SET
+                (messages_sent, messages_received, last_message_time) = (
+                    SELECT sent_count, received_count, last_timestamp
+                    FROM conversations WHERE peer_hash = destinations.destination_hash
+                )
+            WHERE destination_hash IN (SELECT peer_hash FROM conversations)
+        ''')
+
+    # ============================================
+    # AGGIORNAMENTI (dentro la transazione del chiamante)
+    # ============================================
+
+    def record_message(self, conn, peer_hash, msg_hash, timestamp, preview, incoming, status=None):
+        """
+        Aggiunge un messaggio nuovo al riepilogo del peer. Va chiamato una sola volta
+        per messaggio, con la connessione della transazione che lo salva.
+        """
+        timestamp = timestamp or 0
+        conn.execute('''
+            INSERT INTO conversations
+                (peer_hash, last_message_hash, last_timestamp, last_preview, last_incoming,
+                 last_status, message_count, sent_count, received_count, unread_count)
+            VALUES (?, ?, ?, ?, ?, ?, 1, ?, ?, ?)
+            ON CONFLICT(peer_hash) DO UPDATE SET
+                message_count = message_count + 1,
+                sent_count = sent_count + excluded.sent_count,
+                received_count = received_count + excluded.received_count,
+                unread_count = unread_count + CASE
+                    WHEN excluded.last_incoming = 1 AND excluded.last_timestamp > last_read_timestamp
+                    THEN 1 ELSE 0 END,
+                last_message_hash = CASE WHEN excluded.last_timestamp >= COALESCE(last_timestamp, 0)
+                    THEN excluded.last_message_hash ELSE last_message_hash END,
+                last_preview = CASE WHEN excluded.last_timestamp >= COALESCE(last_timestamp, 0)
+                    THEN excluded.last_preview ELSE last_preview END,
+                last_incoming = CASE WHEN excluded.last_timestamp >= COALESCE(last_timestamp, 0)
+                    THEN excluded.last_incoming ELSE last_incoming END,
+                last_status = CASE WHEN excluded.last_timestamp >= COALESCE(last_timestamp, 0)
+                    THEN excluded.last_status ELSE last_status END,
+                last_timestamp = MAX(COALESCE(last_timestamp, 0), excluded.last_timestamp)
+        ''', (
+            peer_hash, msg_hash, timestamp, preview, 1 if incoming else 0, status,
+            0 if incoming else 1,
+            1 if incoming else 0,
+            1 if incoming else 0
+        ))
+
+        # Contatori per destinazione (letti da /api/peers)
+        counter = 'messages_received' if incoming else 'messages_sent'
+        conn.execute(f'''
+            UPDATE destinations SET
+                {counter} = COALESCE({counter}, 0) + 1,
+                last_message_time = MAX(COALESCE(last_message_time, 0), ?)
+            WHERE destination_hash = ?
+        ''', (timestamp, peer_hash))
+
+    def set_status(self, conn, msg_hash, status):
+        """Stato di consegna dell'ultimo messaggio (se msg_hash è l'ultimo della sua chat)"""
+        conn.execute('UPDATE conversations SET last_status = ? WHERE last_message_hash = ?', (status, msg_hash))
+
+    # ============================================
+    # LETTURA E WATERMARK
+    # ============================================
+
+    def mark_read(self, peer_hash, until=None):
+        """
+        Sposta il watermark di lettura: fino all'ultimo messaggio, o fino al timestamp
+        until (i messaggi ricevuti dopo restano non letti). Restituisce il riepilogo.
+        """
+        with self.db.write() as conn:
+            if until is None:
+                conn.execute('''
+                    UPDATE conversations
+                    SET last_read_timestamp = MAX(last_read_timestamp, COALESCE(last_timestamp, 0)),
+                        unread_count = 0
+                    WHERE peer_hash = ?
+                ''', (peer_hash,))
+            else:
+                # Conteggio sull'indice (conversation_hash, timestamp)
+                conn.execute('''
+                    UPDATE conversations
+                    SET last_read_timestamp = MAX(last_read_timestamp, ?),
+                        unread_count = (
+                            SELECT COUNT(*) FROM messages
+                            WHERE conversation_hash = conversations.peer_hash
+                              AND incoming = 1 AND timestamp > MAX(conversations.last_read_timestamp, ?)
+                        )
+                    WHERE peer_hash = ?
+                ''', (float(until), float(until), peer_hash))
+        return self.get(peer_hash)
+
+    def get(self, peer_hash):
+        row = self.db.query_one(
+            f"SELECT {', '.join(CONVERSATION_COLUMNS)} FROM conversations WHERE peer_hash = ?",
+            (peer_hash,)
+        )
+        return self._from_row(row + (None, None)) if row else None
+
+    def list(self, limit=None, unread_only=False):
+        """Conversazioni dalla più recente, con il nome del peer (una query sull'indice)"""
+        columns = ', '.join(f'c.{name}' for name in CONVERSATION_COLUMNS)
+        sql = f'''
+            SELECT {columns}, COALESCE(i.display_name, d.display_name), d.identity_hash
+            FROM conversations c
+            LEFT JOIN destinations d ON d.destination_hash = c.peer_hash
+            LEFT JOIN identities i ON i.identity_hash = d.identity_hash
+        '''
+        params = []
+        if unread_only:
+            sql += ' WHERE c.unread_count > 0'
+        sql += ' ORDER BY c.last_timestamp DESC'
+        if limit:
+            sql += ' LIMIT ?'
+            params.append(int(limit))
+        return [self._from_row(row) for row in self.db.query(sql, params)]
+
+    @staticmethod
+    def _from_row(row):
+        (peer_hash, last_hash, last_ts, preview, last_incoming, last_status, count,
+         sent, received, unread, read_ts, name, identity_hash) = row
+        return {
+            'peer_hash': peer_hash,
+            'identity_hash': identity_hash,
+            'name': name,
+            'last_message': {
+                'hash': last_hash,
+                'time': last_ts,
+                'preview': preview or '',
+                'incoming': bool(last_incoming),
+                'status': last_status
+            } if last_hash else None,
+            'message_count': count or 0,
+            'sent': sent or 0,
+            'received': received or 0,
+            'unread': unread or 0,
+            'last_read': read_ts or 0
+        }
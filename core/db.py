@@ -0,0 +1,191 @@
+# core/db.py - Accesso a peers.db
+#
+# Una sola connessione di scrittura (serializzata da un lock) e un pool di
+# connessioni di sola lettura in modalità WAL: le letture non aspettano mai
+# le scritture e le query ripetute riusano gli statement già preparati.
+import os
+import re
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# Statement preparati tenuti in cache per ogni connessione
+CACHED_STATEMENTS = 256
+
+# Pagine restituite per ogni passo di incremental_vacuum (lock di scrittura breve)
+RECLAIM_STEP = 1000
+
+# Senza auto_vacuum incrementale si fa un VACUUM completo solo oltre questa
+# frazione di pagine libere
+VACUUM_FREE_RATIO = 0.25
+
+SORT_NAME_PATTERN = re.compile(r'^[^a-zA-Z0-9]+')
+
+
+def sort_name(name):
+    """Chiave di ordinamento dei peer: nome senza simboli/emoji iniziali, minuscolo"""
+    return SORT_NAME_PATTERN.sub('', name or '').lower()
+
+
+# Approssimazione in SQL puro di sort_name() per i trigger (toglie solo
+# spazi e punteggiatura ASCII iniziali): vale anche per connessioni esterne
+SORT_NAME_SQL = "lower(ltrim(NEW.display_name, ' !\"#$%&''()*+,-./:;<=>?@[\\]^_`{|}~'))"
+
+
+class PeersDatabase:
+    def __init__(self, db_path, readers=4, timeout=10):
+        self.db_path = db_path
+        self.timeout = timeout
+        self.max_readers = readers
+
+        self.write_lock = threading.RLock()
+        self._writer = self._connect()
+        # Vale subito per un database nuovo, per uno esistente dal prossimo VACUUM
+        self._writer.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        self._writer.execute('PRAGMA journal_mode=WAL')
+        self._writer.execute('PRAGMA synchronous=NORMAL')
+
+        self._readers = queue.LifoQueue()
+        self._reader_count = 0
+        self._reader_lock = threading.Lock()
+
+    def _connect(self, readonly=False):
+        if readonly:
+            uri = 'file:' + os.path.abspath(self.db_path) + '?mode=ro'
+            conn = sqlite3.connect(uri, uri=True, timeout=self.timeout,
+                                   check_same_thread=False, cached_statements=CACHED_STATEMENTS)
+        else:
+            conn = sqlite3.connect(self.db_path, timeout=self.timeout,
+                                   check_same_thread=False, cached_statements=CACHED_STATEMENTS)
+        conn.execute(f'PRAGMA busy_timeout={int(self.timeout * 1000)}')
+        # Usata dai trigger che mantengono identities.sort_name
+        conn.create_function('sort_name', 1, sort_name, deterministic=True)
+        return conn
+
+    # ============================================
+    # SCRITTURA
+    # ============================================
+
+    @contextmanager
+    def write(self):
+        """Transazione sulla connessione di scrittura: commit all'uscita, rollback su errore"""
+        with self.write_lock:
+            conn = self._writer
+            try:
+                yield conn
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+    def execute(self, sql, params=()):
+        """Singola scrittura, restituisce rowcount"""
+        with self.write() as conn:
+            return conn.execute(sql, params).rowcount
+
+    def executemany(self, sql, seq):
+        with self.write() as conn:
+            return conn.executemany(sql, seq).rowcount
+
+    def vacuum(self):
+        """Compatta il file (VACUUM non può girare dentro una transazione)"""
+        with self.write_lock:
+            self._writer.execute('VACUUM')
+
+    def _pragma(self, name):
+        return self._writer.execute(f'PRAGMA {name}').fetchone()[0]
+
+    def reclaim(self, step=RECLAIM_STEP, min_free=VACUUM_FREE_RATIO):
+        """
+        Restituisce al filesystem le pagine libere senza tenere a lungo il lock
+        di scrittura: con auto_vacuum=INCREMENTAL a passi di `step` pagine,
+        altrimenti con un VACUUM completo solo se le pagine libere superano
+        `min_free` del file. Restituisce le pagine liberate.
+        """
+        with self.write_lock:
+            mode = self._pragma('auto_vacuum')
+            free = self._pragma('freelist_count')
+            pages = self._pragma('page_count')
+        if not free:
+            return 0
+
+        if mode == 2:
+            left = free
+            while left:
+                with self.write_lock:
+                    self._writer.execute(f'PRAGMA incremental_vacuum({int(step)})').fetchall()
+                    remaining = self._pragma('freelist_count')
+                if remaining >= left:
+                    break
+                left = remaining
+            return free - left
+
+        if free < pages * min_free:
+            return 0
+        self.vacuum()
+        return free
+
+    # ============================================
+    # LETTURA
+    # ============================================
+
+    def _acquire_reader(self):
+        try:
+            return self._readers.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._reader_lock:
+            if self._reader_count < self.max_readers:
+                self._reader_count += 1
+                try:
+                    return self._connect(readonly=True)
+                except Exception:
+                    self._reader_count -= 1
+                    raise
+
+        return self._readers.get(timeout=self.timeout)
+
+    @contextmanager
+    def read(self, row_factory=None):
+        """Connessione di sola lettura dal pool (nessun lock globale)"""
+        conn = self._acquire_reader()
+        conn.row_factory = row_factory
+        try:
+            yield conn
+        finally:
+            # Chiude eventuali transazioni di lettura implicite
+            if conn.in_transaction:
+                conn.rollback()
+            conn.row_factory = None
+            self._readers.put(conn)
+
+    def query(self, sql, params=(), row_factory=None):
+        with self.read(row_factory) as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def query_one(self, sql, params=(), row_factory=None):
+        with self.read(row_factory) as conn:
+            return conn.execute(sql, params).fetchone()
+
+    @staticmethod
+    def column_exists(conn, table, column):
+        return any(row[1] == column for row in conn.execute(f'PRAGMA table_info({table})'))
+
+    def table_exists(self, name):
+        return self.query_one("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (name,)) is not None
+
+    def close(self):
+        with self.write_lock:
+            try:
+                self._writer.close()
+            except Exception:
+                pass
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except queue.Empty:
+                break
+            except Exception:
+                pass
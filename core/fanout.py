@@ -0,0 +1,278 @@
+# core/fanout.py - Invio a un gruppo di peer
+#
+# Ogni invio di gruppo prepara contenuto e allegati una volta sola (letti e
+# codificati da prepare()) e li riusa per tutti i destinatari: cambiano solo cifratura e
+# pacchetto. I path mancanti si chiedono tutti subito tramite la pipeline di
+# uscita e ogni membro prosegue quando il suo path si risolve, senza tenere
+# occupato un worker; i messaggi si impacchettano in parallelo su un pool
+# limitato e le consegne sono distanziate per interfaccia in base al bitrate
+# (un solo thread temporizzatore), così una radio lenta non riceve tutto il
+# gruppo in un colpo. Avanzamento aggregato ed esito per membro arrivano a
+# on_update.
+import time
+import uuid
+import heapq
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import RNS
+
+# Destinatari impacchettati/inviati in parallelo
+FANOUT_CONCURRENCY = 4
+
+# Distanza minima tra due invii sulla stessa interfaccia (secondi) e massimo
+# calcolato dal bitrate (tempo in onda del messaggio precedente)
+MIN_INTERFACE_GAP = 0.05
+MAX_INTERFACE_GAP = 30.0
+
+# Invii di gruppo conservati per /api/groups/sends/<job>
+MAX_JOBS = 50
+
+
+def payload_size(value):
+    """Byte approssimativi di contenuto e fields (per il distanziamento)"""
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, str):
+        return len(value.encode('utf-8'))
+    if isinstance(value, dict):
+        return sum(payload_size(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(payload_size(v) for v in value)
+    return 8
+
+
+class InterfacePacer:
+    """Distanzia gli invii per interfaccia: il successivo parte dopo il tempo in onda del precedente"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.next_slot = {}
+
+    @staticmethod
+    def interface_for(dest_hash):
+        try:
+            return RNS.Transport.next_hop_interface(bytes.fromhex(dest_hash))
+        except Exception:
+            return None
+
+    def reserve(self, interface, size):
+        """Prenota lo slot sull'interfaccia; restituisce quanto attendere prima di inviare"""
+        key = str(interface) if interface is not None else None
+        bitrate = getattr(interface, 'bitrate', None)
+        airtime = (size * 8 / bitrate) if bitrate and size else 0
+        gap = min(max(airtime, MIN_INTERFACE_GAP), MAX_INTERFACE_GAP)
+        with self.lock:
+            now = time.time()
+            start = max(now, self.next_slot.get(key, 0))
+            self.next_slot[key] = start + gap
+        return start - now
+
+
+class FanoutEngine:
+    def __init__(self, outbound, send_prepared, on_update=None, concurrency=FANOUT_CONCURRENCY):
+        """
+        outbound: OutboundPipeline (path e destinazioni in cache)
+        send_prepared(dest_hash, dest, content, title, fields, callbacks) -> risultato di Messenger
+        """
+        self.outbound = outbound
+        self.send_prepared = send_prepared
+        self.on_update = on_update
+        self.pacer = InterfacePacer()
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='fanout')
+        self.lock = threading.Lock()
+        self.jobs = OrderedDict()
+        # Invii distanziati dal pacer: (quando, seq, funzione) su un solo thread
+        self.delayed = []
+        self.delayed_seq = 0
+        self.delayed_cond = threading.Condition()
+        self.running = True
+        self.timer = threading.Thread(target=self._delayed_loop, daemon=True)
+        self.timer.start()
+
+    def start(self, group, members, prepare):
+        """
+        Avvia l'invio a `members` [(dest_hash, nome)]. prepare() restituisce
+        (content, title, fields) ed è chiamata una volta sola. Restituisce lo stato iniziale.
+        """
+        job_id = uuid.uuid4().hex[:16]
+        member_states = OrderedDict(
+            (dest_hash, {'name': name, 'status': 'queued', 'hash': None, 'error': None})
+            for dest_hash, name in members
+        )
+        job = {
+            'job': job_id,
+            'group': group,
+            'status': 'preparing',
+            'created': time.time(),
+            # Dopo la deduplica: un destinatario ripetuto riceve un solo messaggio
+            'total': len(member_states),
+            'members': member_states
+        }
+        with self.lock:
+            self.jobs[job_id] = job
+            while len(self.jobs) > MAX_JOBS:
+                self.jobs.popitem(last=False)
+
+        threading.Thread(target=self._run, args=(job, prepare), daemon=True).start()
+        return self.get(job_id)
+
+    def _run(self, job, prepare):
+        try:
+            # Path richiesti tutti insieme, prima di impacchettare
+            futures = {}
+            for dest_hash in job['members']:
+                try:
+                    futures[dest_hash] = self.outbound.resolve(dest_hash)
+                except Exception:
+                    self._member(job, dest_hash, status='failed', error='Hash di destinazione non valido')
+
+            try:
+                content, title, fields = prepare()
+            except Exception as e:
+                for dest_hash in futures:
+                    self._member(job, dest_hash, status='failed', error=str(e))
+                self._set(job, status='failed', error=str(e))
+                return
+
+            size = payload_size([content, title, fields])
+            self._set(job, status='sending', size=size)
+            # Nessun worker resta in attesa del path: si prosegue quando il Future si risolve
+            # (PathUnavailable dopo il timeout della pipeline)
+            for dest_hash, future in futures.items():
+                self._member(job, dest_hash, status='resolving')
+                future.add_done_callback(
+                    lambda f, dest_hash=dest_hash: self._on_resolved(job, dest_hash, f, content, title, fields, size))
+        except Exception as e:
+            print(f"❌ Errore invio di gruppo {job['job']}: {e}")
+            for dest_hash in job['members']:
+                self._member(job, dest_hash, status='failed', error=str(e))
+            self._set(job, status='failed', error=str(e))
+
+    def _on_resolved(self, job, dest_hash, future, content, title, fields, size):
+        """Path risolto (o fallito): prenota lo slot sull'interfaccia senza bloccare"""
+        error = future.exception()
+        if error:
+            self._member(job, dest_hash, status='failed', error=str(error))
+            return
+
+        send = lambda: self.executor.submit(
+            self._send_member, job, dest_hash, future.result(), content, title, fields)
+        try:
+            delay = self.pacer.reserve(self.pacer.interface_for(dest_hash), size)
+            if delay > 0:
+                self._later(delay, send)
+            else:
+                send()
+        except Exception as e:
+            self._member(job, dest_hash, status='failed', error=str(e))
+
+    def _send_member(self, job, dest_hash, dest, content, title, fields):
+        callbacks = {
+            'delivery': lambda info: self._member(job, dest_hash, status='delivered'),
+            'failed': lambda info: self._member(job, dest_hash, status='failed', error='Consegna fallita')
+        }
+        self._member(job, dest_hash, status='packing')
+        try:
+            result = self.send_prepared(dest_hash, dest, content, title, fields, callbacks)
+        except Exception as e:
+            result = {'success': False, 'error': str(e)}
+
+        if result.get('success'):
+            self._member(job, dest_hash, status='sending', hash=result.get('hash'))
+        else:
+            self._member(job, dest_hash, status='failed', error=result.get('error'))
+
+    # ============================================
+    # DISTANZIAMENTO
+    # ============================================
+
+    def _later(self, delay, fn):
+        with self.delayed_cond:
+            self.delayed_seq += 1
+            heapq.heappush(self.delayed, (time.time() + delay, self.delayed_seq, fn))
+            self.delayed_cond.notify()
+
+    def _delayed_loop(self):
+        while True:
+            with self.delayed_cond:
+                while self.running:
+                    if not self.delayed:
+                        self.delayed_cond.wait()
+                        continue
+                    wait = self.delayed[0][0] - time.time()
+                    if wait <= 0:
+                        break
+                    self.delayed_cond.wait(wait)
+                if not self.running:
+                    return
+                _, _, fn = heapq.heappop(self.delayed)
+            try:
+                fn()
+            except Exception as e:
+                print(f"⚠️ Errore invio distanziato: {e}")
+
+    # ============================================
+    # STATO
+    # ============================================
+
+    def _member(self, job, dest_hash, **changes):
+        with self.lock:
+            member = job['members'][dest_hash]
+            # Una consegna già conclusa non torna indietro (callback in ritardo)
+            if member['status'] in ('delivered', 'failed') and changes.get('status') != 'delivered':
+                return
+            member.update(changes)
+            self._check_done(job)
+        self._notify(job)
+
+    def _set(self, job, **changes):
+        with self.lock:
+            job.update(changes)
+            self._check_done(job)
+        self._notify(job)
+
+    def _check_done(self, job):
+        if job['status'] == 'sending' and all(
+                m['status'] in ('delivered', 'failed') for m in job['members'].values()):
+            job['status'] = 'completed'
+            job['finished'] = time.time()
+
+    def _snapshot(self, job):
+        counts = {}
+        for member in job['members'].values():
+            counts[member['status']] = counts.get(member['status'], 0) + 1
+        done = counts.get('delivered', 0) + counts.get('failed', 0)
+        snapshot = {key: value for key, value in job.items() if key != 'members'}
+        snapshot.update({
+            'counts': counts,
+            'progress': round(done * 100 / job['total'], 1) if job['total'] else 100.0,
+            'members': [dict(member, destination=dest_hash) for dest_hash, member in job['members'].items()]
+        })
+        return snapshot
+
+    def _notify(self, job):
+        if not self.on_update:
+            return
+        with self.lock:
+            snapshot = self._snapshot(job)
+        try:
+            self.on_update(snapshot)
+        except Exception as e:
+            print(f"⚠️ Errore notifica invio di gruppo: {e}")
+
+    def get(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return self._snapshot(job) if job else None
+
+    def list(self):
+        with self.lock:
+            return [self._snapshot(job) for job in reversed(self.jobs.values())]
+
+    def stop(self):
+        with self.delayed_cond:
+            self.running = False
+            self.delayed_cond.notify()
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,233 @@
+# core/outbound.py - Pipeline di invio asincrona
+#
+# Le richieste HTTP di invio non aspettano più il path: ogni invio diventa un
+# handle accodato per destinazione. La richiesta di path parte una volta sola
+# per destinazione e il suo esito è un Future condiviso da tutti gli invii in
+# attesa; un solo thread controlla le destinazioni in risoluzione. Le
+# RNS.Destination in uscita sono create una volta e tenute in cache. Ogni
+# cambio di stato dell'handle viene notificato (on_state → Socket.IO).
+import time
+import uuid
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import RNS
+
+# Attesa massima di un path richiesto (secondi) e intervallo di controllo
+PATH_TIMEOUT = 15.0
+RESOLVE_POLL = 0.25
+
+# Destinazioni inviate in parallelo (ognuna resta in ordine al suo interno)
+SEND_WORKERS = 4
+
+# Handle conservati per /api/send/<handle>
+MAX_HANDLES = 500
+
+
+class PathUnavailable(Exception):
+    pass
+
+
+class OutboundPipeline:
+    def __init__(self, on_state=None, path_timeout=PATH_TIMEOUT, workers=SEND_WORKERS):
+        self.on_state = on_state
+        self.path_timeout = path_timeout
+        self.lock = threading.Lock()
+        self.cond = threading.Condition(self.lock)
+        # dest_hash -> RNS.Destination in uscita
+        self.destinations = {}
+        # dest_hash -> (Future, scadenza) delle risoluzioni in corso
+        self.pending = {}
+        # dest_hash -> deque di (handle, build, callbacks, Future) in attesa; destinazioni in svuotamento
+        self.queues = {}
+        self.active = set()
+        self.handles = OrderedDict()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='outbound')
+        self.running = True
+        self.resolver = threading.Thread(target=self._resolve_loop, daemon=True)
+        self.resolver.start()
+
+    # ============================================
+    # DESTINAZIONI E PATH
+    # ============================================
+
+    @staticmethod
+    def _make_destination(identity):
+        return RNS.Destination(identity, RNS.Destination.OUT, RNS.Destination.SINGLE, "lxmf", "delivery")
+
+    def destination(self, dest_hash):
+        """RNS.Destination in cache, o creata se l'identità è già nota; None se serve un path"""
+        with self.lock:
+            dest = self.destinations.get(dest_hash)
+        if dest:
+            return dest
+        identity = RNS.Identity.recall(bytes.fromhex(dest_hash))
+        if not identity:
+            return None
+        dest = self._make_destination(identity)
+        with self.lock:
+            return self.destinations.setdefault(dest_hash, dest)
+
+    def resolve(self, dest_hash):
+        """Future della RNS.Destination; la richiesta di path parte una sola volta"""
+        dest = self.destination(dest_hash)
+        if dest:
+            future = Future()
+            future.set_result(dest)
+            return future
+
+        with self.cond:
+            entry = self.pending.get(dest_hash)
+            if entry:
+                return entry[0]
+            future = Future()
+            self.pending[dest_hash] = (future, time.time() + self.path_timeout)
+            self.cond.notify()
+
+        RNS.Transport.request_path(bytes.fromhex(dest_hash))
+        return future
+
+    def _resolve_loop(self):
+        while self.running:
+            with self.cond:
+                while self.running and not self.pending:
+                    self.cond.wait()
+                waiting = list(self.pending.items())
+
+            now = time.time()
+            done = []
+            for dest_hash, (future, deadline) in waiting:
+                try:
+                    dest = self.destination(dest_hash)
+                except Exception as e:
+                    done.append((dest_hash, future, None, e))
+                    continue
+                if dest:
+                    done.append((dest_hash, future, dest, None))
+                elif now >= deadline:
+                    done.append((dest_hash, future, None, PathUnavailable('Destinatario sconosciuto: nessun path')))
+
+            # I callback dei Future girano fuori dal lock
+            for dest_hash, future, dest, error in done:
+                with self.lock:
+                    self.pending.pop(dest_hash, None)
+                if error:
+                    future.set_exception(error)
+                else:
+                    future.set_result(dest)
+
+            time.sleep(RESOLVE_POLL)
+
+    # ============================================
+    # INVII
+    # ============================================
+
+    def submit(self, dest_hash, build, callbacks=None, kind='message'):
+        """
+        Accoda un invio: build(destination) crea e invia il messaggio e restituisce
+        il dizionario di risultato di Messenger. Restituisce subito lo stato dell'handle.
+        """
+        handle = uuid.uuid4().hex[:16]
+        state = {'handle': handle, 'destination': dest_hash, 'kind': kind,
+                 'status': 'queued', 'time': time.time()}
+        with self.lock:
+            self.handles[handle] = state
+            while len(self.handles) > MAX_HANDLES:
+                self.handles.popitem(last=False)
+
+        try:
+            future = self.resolve(dest_hash)
+        except ValueError:
+            future = Future()
+            future.set_exception(ValueError(f"Hash di destinazione non valido: {dest_hash}"))
+
+        # Ogni invio tiene la propria risoluzione: una più vecchia (magari
+        # fallita) non deve decidere per gli invii accodati dopo
+        with self.lock:
+            self.queues.setdefault(dest_hash, deque()).append((handle, build, callbacks, future))
+
+        if not future.done():
+            self._update(handle, status='resolving')
+        future.add_done_callback(lambda _: self._schedule(dest_hash))
+        return dict(state)
+
+    def _schedule(self, dest_hash):
+        with self.lock:
+            if dest_hash in self.active:
+                return
+            self.active.add(dest_hash)
+        self.executor.submit(self._drain, dest_hash)
+
+    def _drain(self, dest_hash):
+        """Invia in ordine gli invii in coda per una destinazione"""
+        while True:
+            with self.lock:
+                jobs = self.queues.get(dest_hash)
+                # Si ferma anche sul primo invio ancora in risoluzione: lo riprende il suo callback
+                if not jobs or not jobs[0][3].done():
+                    if not jobs:
+                        self.queues.pop(dest_hash, None)
+                    self.active.discard(dest_hash)
+                    return
+                handle, build, callbacks, future = jobs.popleft()
+
+            error = future.exception()
+            if error:
+                self._fail(handle, str(error), callbacks)
+                continue
+
+            self._update(handle, status='packing')
+            try:
+                result = build(future.result())
+            except Exception as e:
+                result = {'success': False, 'error': str(e)}
+
+            if result.get('success'):
+                self._update(handle, status=result.get('status', 'sending'), hash=result.get('hash'),
+                             method=result.get('method'), packed_size=result.get('packed_size'))
+            else:
+                self._fail(handle, result.get('error', 'Invio fallito'), callbacks)
+
+    def _fail(self, handle, error, callbacks):
+        state = self._update(handle, status='failed', error=error)
+        if callbacks and 'failed' in callbacks:
+            try:
+                callbacks['failed'](state)
+            except Exception as e:
+                print(f"⚠️ Errore callback invio fallito: {e}")
+
+    def _update(self, handle, **changes):
+        with self.lock:
+            state = self.handles.get(handle)
+            if state is None:
+                state = {'handle': handle}
+            state.update(changes)
+            state['time'] = time.time()
+            snapshot = dict(state)
+        if self.on_state:
+            try:
+                self.on_state(snapshot)
+            except Exception as e:
+                print(f"⚠️ Errore notifica stato invio: {e}")
+        return snapshot
+
+    def get(self, handle):
+        with self.lock:
+            state = self.handles.get(handle)
+            return dict(state) if state else None
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        self.executor.shutdown(wait=False)
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'destinations_cached': len(self.destinations),
+                'resolving': len(self.pending),
+                'queued': sum(len(q) for q in self.queues.values()),
+                'active': len(self.active)
+            }
@@ -0,0 +1,304 @@
+# core/raw_store.py - Archivio unico dei pacchetti raw
+#
+# Ogni pacchetto LXMF è salvato una volta sola (compresso con zlib se conviene)
+# nella tabella raw_packets di peers.db, indicizzato per hash del messaggio.
+# Le viste hex/ASCII si generano solo quando servono, a pagine per i pacchetti
+# grandi; una piccola LRU in memoria tiene i pacchetti più recenti.
+import os
+import json
+import time
+import zlib
+import threading
+from collections import OrderedDict
+
+# Pacchetti tenuti in memoria
+LRU_SIZE = 256
+
+# Byte mostrati nelle anteprime delle liste
+PREVIEW_BYTES = 64
+
+# Dimensione pagina di default / massima per /api/raw/<hash>
+PAGE_BYTES = 4096
+MAX_PAGE_BYTES = 65536
+
+# Righe migrate per transazione
+MIGRATION_BATCH = 200
+
+
+def render_hex(data):
+    return data.hex()
+
+
+def render_ascii(data):
+    return ''.join(chr(b) if 32 <= b < 127 else '.' for b in data)
+
+
+def preview(data, length=PREVIEW_BYTES):
+    """Anteprima (hex, ascii) dei primi byte di un pacchetto"""
+    if not data:
+        return None, None
+    head = data[:length]
+    return render_hex(head), render_ascii(head)
+
+
+def stored_preview(data, compressed):
+    """Anteprima da una riga di raw_packets: basta decomprimere l'inizio"""
+    if data is None:
+        return None, None
+    if compressed:
+        head = zlib.decompressobj().decompress(data, PREVIEW_BYTES)
+    else:
+        head = bytes(data[:PREVIEW_BYTES])
+    return preview(head)
+
+
+class RawStore:
+    def __init__(self, db, cache_size=LRU_SIZE):
+        self.db = db
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # Sorgente di riserva per i pacchetti usciti dalla tabella (es. MessageArchive.get_raw)
+        self.fallback = None
+
+    def init_schema(self):
+        with self.db.write() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS raw_packets (
+                    hash TEXT PRIMARY KEY,
+                    data BLOB NOT NULL,
+                    compressed INTEGER DEFAULT 0,
+                    size INTEGER,
+                    source_hash TEXT,
+                    destination_hash TEXT,
+                    method TEXT,
+                    timestamp REAL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_raw_time ON raw_packets(timestamp)')
+
+    # ============================================
+    # CACHE
+    # ============================================
+
+    def _cache_put(self, msg_hash, data):
+        with self.lock:
+            self.cache[msg_hash] = data
+            self.cache.move_to_end(msg_hash)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def _cache_get(self, msg_hash):
+        with self.lock:
+            data = self.cache.get(msg_hash)
+            if data is not None:
+                self.cache.move_to_end(msg_hash)
+                self.hits += 1
+            else:
+                self.misses += 1
+            return data
+
+    # ============================================
+    # SCRITTURA / LETTURA
+    # ============================================
+
+    @staticmethod
+    def _encode(packed):
+        compressed = zlib.compress(packed, 6)
+        if len(compressed) < len(packed):
+            return compressed, 1
+        return packed, 0
+
+    def _row(self, msg_hash, packed, source_hash=None, destination_hash=None, method=None, timestamp=None):
+        data, compressed = self._encode(packed)
+        return (msg_hash, data, compressed, len(packed), source_hash, destination_hash,
+                method, timestamp or time.time())
+
+    def put(self, msg_hash, packed, source_hash=None, destination_hash=None, method=None, timestamp=None,
+            replace=False):
+        """Salva un pacchetto (una sola volta per hash; replace=True per la versione con stamp)"""
+        if not packed:
+            return
+        row = self._row(msg_hash, packed, source_hash, destination_hash, method, timestamp)
+        with self.db.write() as conn:
+            conn.execute(f'''
+                INSERT OR {'REPLACE' if replace else 'IGNORE'} INTO raw_packets
+                (hash, data, compressed, size, source_hash, destination_hash, method, timestamp)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', row)
+        self._cache_put(msg_hash, bytes(packed))
+
+    def get(self, msg_hash):
+        """Restituisce (bytes, da_memoria) oppure (None, False)"""
+        data = self._cache_get(msg_hash)
+        if data is not None:
+            return data, True
+
+        row = self.db.query_one('SELECT data, compressed FROM raw_packets WHERE hash = ?', (msg_hash,))
+        if row:
+            data = zlib.decompress(row[0]) if row[1] else bytes(row[0])
+        else:
+            data = self.fallback(msg_hash) if self.fallback else None
+            if data is None:
+                return None, False
+        self._cache_put(msg_hash, data)
+        return data, False
+
+    def view(self, msg_hash, offset=0, length=PAGE_BYTES):
+        """Pagina hex/ASCII di un pacchetto"""
+        data, from_memory = self.get(msg_hash)
+        if data is None:
+            return None
+
+        offset = max(0, int(offset))
+        length = max(1, min(int(length), MAX_PAGE_BYTES))
+        page = data[offset:offset + length]
+        return {
+            'hex': render_hex(page),
+            'ascii': render_ascii(page),
+            'size': len(data),
+            'offset': offset,
+            'length': len(page),
+            'has_more': offset + len(page) < len(data),
+            'source': 'memory' if from_memory else 'disk'
+        }
+
+    def recent(self, limit=50, peer_hash=None):
+        """Ultimi pacchetti con anteprima (globale o per peer)"""
+        sql = '''
+            SELECT hash, data, compressed, size, source_hash, destination_hash, method, timestamp
+            FROM raw_packets
+        '''
+        params = []
+        if peer_hash:
+            sql += ' WHERE source_hash = ? OR destination_hash = ?'
+            params = [peer_hash, peer_hash]
+        sql += ' ORDER BY timestamp DESC LIMIT ?'
+        params.append(limit)
+
+        packets = []
+        for msg_hash, data, compressed, size, source, dest, method, ts in self.db.query(sql, params):
+            raw_hex, raw_ascii = stored_preview(data, compressed)
+            packets.append({
+                'hash': msg_hash,
+                'time': ts,
+                'from': source,
+                'to': dest,
+                'method': method,
+                'packed_size': size,
+                'raw_hex': raw_hex,
+                'raw_ascii': raw_ascii,
+                'truncated': size > PREVIEW_BYTES
+            })
+        return packets
+
+    def get_stats(self):
+        row = self.db.query_one('SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(LENGTH(data)), 0) FROM raw_packets')
+        with self.lock:
+            cached = len(self.cache)
+        return {
+            'packets': row[0],
+            'raw_bytes': row[1],
+            'stored_bytes': row[2],
+            'cached': cached,
+            'cache_hits': self.hits,
+            'cache_misses': self.misses
+        }
+
+    # ============================================
+    # MIGRAZIONE
+    # ============================================
+
+    def migrate_legacy(self, raw_dir):
+        """
+        Importa le copie ridondanti delle versioni precedenti e le elimina:
+        colonne messages.raw_hex/raw_ascii e file .raw/.hex/.json in raw_dir.
+        Restituisce il numero di pacchetti importati.
+        """
+        imported = 0
+
+        # 1) Colonne raw_hex / raw_ascii in messages
+        if self.db.table_exists('messages'):
+            while True:
+                rows = self.db.query('''
+                    SELECT hash, raw_hex, source_hash, destination_hash, method, timestamp
+                    FROM messages WHERE raw_hex IS NOT NULL LIMIT ?
+                ''', (MIGRATION_BATCH,))
+                if not rows:
+                    break
+
+                packets = []
+                hashes = []
+                for msg_hash, raw_hex, source, dest, method, ts in rows:
+                    hashes.append((msg_hash,))
+                    try:
+                        packets.append(self._row(msg_hash, bytes.fromhex(raw_hex), source, dest, method, ts))
+                    except ValueError:
+                        continue
+
+                with self.db.write() as conn:
+                    conn.executemany('''
+                        INSERT OR IGNORE INTO raw_packets
+                        (hash, data, compressed, size, source_hash, destination_hash, method, timestamp)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    ''', packets)
+                    conn.executemany('UPDATE messages SET raw_hex = NULL, raw_ascii = NULL WHERE hash = ?', hashes)
+                imported += len(packets)
+
+        # 2) File .raw / .hex / .json
+        if os.path.isdir(raw_dir):
+            names = os.listdir(raw_dir)
+            stems = {os.path.splitext(n)[0] for n in names if n.endswith(('.raw', '.hex'))}
+            batch = []
+            for stem in stems:
+                raw_path = os.path.join(raw_dir, f"{stem}.raw")
+                hex_path = os.path.join(raw_dir, f"{stem}.hex")
+                json_path = os.path.join(raw_dir, f"{stem}.json")
+                try:
+                    if os.path.exists(raw_path):
+                        with open(raw_path, 'rb') as f:
+                            packed = f.read()
+                    else:
+                        with open(hex_path, 'r') as f:
+                            packed = bytes.fromhex(f.read().strip())
+
+                    meta = {}
+                    if os.path.exists(json_path):
+                        with open(json_path, 'r') as f:
+                            meta = json.load(f)
+                    if not meta.get('time'):
+                        meta['time'] = os.path.getmtime(raw_path if os.path.exists(raw_path) else hex_path)
+
+                    batch.append(self._row(stem, packed, meta.get('from'), meta.get('to'),
+                                           meta.get('method'), meta.get('time')))
+                except Exception as e:
+                    print(f"⚠️ Raw non importabile {stem}: {e}")
+                    continue
+
+                if len(batch) >= MIGRATION_BATCH:
+                    imported += self._insert_files(batch, raw_dir)
+                    batch = []
+            if batch:
+                imported += self._insert_files(batch, raw_dir)
+
+        if imported:
+            self.db.vacuum()
+        return imported
+
+    def _insert_files(self, batch, raw_dir):
+        with self.db.write() as conn:
+            conn.executemany('''
+                INSERT OR IGNORE INTO raw_packets
+                (hash, data, compressed, size, source_hash, destination_hash, method, timestamp)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', batch)
+        # Solo dopo il commit si eliminano i file
+        for row in batch:
+            for ext in ('.raw', '.hex', '.json'):
+                try:
+                    os.unlink(os.path.join(raw_dir, row[0] + ext))
+                except OSError:
+                    pass
+        return len(batch)
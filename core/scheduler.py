@@ -0,0 +1,177 @@
+# core/scheduler.py - Job periodici (rangetest, polling telemetria)
+#
+# Un solo thread e un heap ordinato per scadenza al posto di un threading.Timer
+# per ogni intervallo di ogni peer: il thread dorme fino al primo job in
+# scadenza e lo passa a un piccolo pool, così migliaia di job periodici
+# costano un thread in tutto. Le scadenze seguono una griglia fissa
+# (start + k * interval) con jitter casuale, per non far partire insieme tutti
+# i job avviati nello stesso momento. Se un giro salta (il job precedente è
+# ancora in corso o il thread è in ritardo di più di un intervallo) viene
+# contato in `missed` invece di recuperare tutti i giri persi in un colpo.
+import time
+import heapq
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Jitter di default, come frazione dell'intervallo
+DEFAULT_JITTER = 0.1
+
+# Job eseguiti in parallelo
+SCHEDULER_WORKERS = 4
+
+
+class PeriodicScheduler:
+    def __init__(self, workers=SCHEDULER_WORKERS):
+        self.cond = threading.Condition()
+        # (scadenza, seq, job_id, generazione): le voci di job rimossi o
+        # rischedulati restano nell'heap e vengono scartate all'uscita.
+        # La generazione viene da un contatore che non riparte mai, così un id
+        # rimosso e poi riaggiunto non riconosce come sue le voci vecchie
+        self.heap = []
+        self.seq = 0
+        self.generations = 0
+        self.jobs = {}
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='scheduler')
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    # ============================================
+    # JOB
+    # ============================================
+
+    def add(self, job_id, interval, fn, jitter=DEFAULT_JITTER, first_delay=None, info=None):
+        """
+        Esegue fn() ogni `interval` secondi (la prima volta dopo `first_delay`,
+        default un intervallo). Un job con lo stesso id viene sostituito.
+        """
+        now = time.time()
+        with self.cond:
+            self.generations += 1
+            job = {
+                'id': job_id,
+                'interval': interval,
+                'jitter': jitter,
+                'fn': fn,
+                'info': info or {},
+                'generation': self.generations,
+                'created': now,
+                'base': now + (interval if first_delay is None else first_delay),
+                'due': None,
+                'running': False,
+                'runs': 0,
+                'missed': 0,
+                'errors': 0,
+                'last_run': None,
+                'last_duration': None,
+                'last_error': None
+            }
+            self.jobs[job_id] = job
+            self._push(job)
+        return self.get(job_id)
+
+    def remove(self, job_id):
+        with self.cond:
+            return self.jobs.pop(job_id, None) is not None
+
+    def _push(self, job):
+        """Mette in heap il prossimo giro (chiamare con il lock)"""
+        offset = random.uniform(0, job['jitter'] * job['interval']) if job['jitter'] else 0
+        job['due'] = job['base'] + offset
+        self.seq += 1
+        heapq.heappush(self.heap, (job['due'], self.seq, job['id'], job['generation']))
+        # Il thread potrebbe dormire fino a una scadenza più lontana
+        self.cond.notify()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while self.running:
+                    if not self.heap:
+                        self.cond.wait()
+                        continue
+                    delay = self.heap[0][0] - time.time()
+                    if delay <= 0:
+                        break
+                    self.cond.wait(delay)
+                if not self.running:
+                    return
+
+                _, _, job_id, generation = heapq.heappop(self.heap)
+                job = self.jobs.get(job_id)
+                if job is None or job['generation'] != generation:
+                    continue
+
+                now = time.time()
+                # Giri della griglia già scaduti oltre a quello corrente
+                late = int((now - job['base']) // job['interval'])
+                if job['running']:
+                    # Il giro precedente non è ancora finito: questo si salta
+                    job['missed'] += 1 + late
+                    run = False
+                else:
+                    job['missed'] += late
+                    job['running'] = True
+                    run = True
+                job['base'] += (1 + late) * job['interval']
+                self._push(job)
+
+            if run:
+                self.executor.submit(self._execute, job)
+
+    def _execute(self, job):
+        started = time.time()
+        error = None
+        try:
+            job['fn']()
+        except Exception as e:
+            error = str(e)
+            print(f"⚠️ Errore job periodico {job['id']}: {e}")
+        with self.cond:
+            job['running'] = False
+            job['runs'] += 1
+            job['last_run'] = started
+            job['last_duration'] = round(time.time() - started, 3)
+            if error:
+                job['errors'] += 1
+                job['last_error'] = error
+
+    # ============================================
+    # STATO
+    # ============================================
+
+    @staticmethod
+    def _snapshot(job):
+        snapshot = {key: value for key, value in job.items() if key not in ('fn', 'generation', 'base')}
+        snapshot['next_run'] = job['due']
+        return snapshot
+
+    def get(self, job_id):
+        with self.cond:
+            job = self.jobs.get(job_id)
+            return self._snapshot(job) if job else None
+
+    def list(self, prefix=None):
+        with self.cond:
+            return [self._snapshot(job) for job_id, job in sorted(self.jobs.items())
+                    if prefix is None or job_id.startswith(prefix)]
+
+    def get_stats(self):
+        with self.cond:
+            jobs = list(self.jobs.values())
+            return {
+                'jobs': len(jobs),
+                'running': sum(1 for job in jobs if job['running']),
+                'runs': sum(job['runs'] for job in jobs),
+                'missed': sum(job['missed'] for job in jobs),
+                'errors': sum(job['errors'] for job in jobs),
+                'heap': len(self.heap),
+                'next_run': self.heap[0][0] if self.heap else None
+            }
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,233 @@
+# core/search.py - Ricerca full-text nei messaggi
+#
+# Indice FTS5 (messages_fts) su testo, titolo e nome del peer, allineato a
+# messages da trigger SQL: ogni scrittura del Messenger aggiorna l'indice
+# senza codice in più. La rowid di messages_fts è l'id di messages_fts_keys
+# (hash -> intero stabile, non rinumerato da VACUUM), quindi il join per i
+# metadati è una ricerca per chiave. I messaggi archiviati (core/archive.py)
+# escono da messages e quindi anche dall'indice: la ricerca copre solo quelli
+# ancora nel database.
+import re
+import sqlite3
+
+# Pesi bm25 per colonna: contenuto, titolo, nome peer
+BM25_WEIGHTS = (10.0, 5.0, 2.0)
+BM25_EXPR = f"bm25(messages_fts, {', '.join(str(w) for w in BM25_WEIGHTS)})"
+
+SNIPPET_TOKENS = 12
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+# Righe indicizzate per transazione durante il backfill
+BACKFILL_BATCH = 2000
+
+TOKEN_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+# Nome del peer di una conversazione: identità della destinazione, o il nome annunciato
+PEER_NAME_SQL = '''
+    COALESCE(
+        (SELECT i.display_name FROM destinations d
+         JOIN identities i ON i.identity_hash = d.identity_hash
+         WHERE d.destination_hash = {hash}),
+        (SELECT display_name FROM destinations WHERE destination_hash = {hash})
+    )
+'''
+
+
+def build_match_query(text):
+    """
+    Trasforma il testo dell'utente in una query FTS5 sicura: ogni parola tra
+    virgolette (niente errori di sintassi), tutte richieste, l'ultima come prefisso
+    """
+    tokens = TOKEN_PATTERN.findall(text or '')
+    if not tokens:
+        return None
+    terms = [f'"{token}"' for token in tokens]
+    terms[-1] += '*'
+    return ' AND '.join(terms)
+
+
+def encode_cursor(first, rowid):
+    return f"{first!r}:{rowid}"
+
+
+def decode_cursor(cursor):
+    try:
+        first, rowid = cursor.rsplit(':', 1)
+        return float(first), int(rowid)
+    except (ValueError, AttributeError):
+        raise ValueError(f"Cursore non valido: {cursor}")
+
+
+class MessageSearch:
+    def __init__(self, db):
+        self.db = db
+        self.enabled = False
+
+    def init_schema(self):
+        """Crea indice e trigger; False se SQLite non ha FTS5"""
+        try:
+            if not self.db.table_exists('messages_fts_keys'):
+                # Versione precedente: indice legato a messages.rowid, da ricostruire
+                with self.db.write() as conn:
+                    for name in ('insert', 'update', 'delete', 'rename'):
+                        conn.execute(f'DROP TRIGGER IF EXISTS trg_messages_fts_{name}')
+                    conn.execute('DROP TABLE IF EXISTS messages_fts')
+
+            with self.db.write() as conn:
+                # Chiave intera stabile per messaggio: messages ha una chiave TEXT,
+                # la sua rowid può cambiare con VACUUM; questa no (INTEGER PRIMARY KEY)
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS messages_fts_keys (
+                        id INTEGER PRIMARY KEY,
+                        hash TEXT NOT NULL UNIQUE
+                    )
+                ''')
+                conn.execute('''
+                    CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+                        content, title, peer,
+                        tokenize = 'unicode61 remove_diacritics 2'
+                    )
+                ''')
+                peer_name = PEER_NAME_SQL.format(hash='NEW.conversation_hash')
+                # Inserimento e modifica: stessa sequenza, la riga di indice viene sostituita
+                reindex = f'''
+                        INSERT OR IGNORE INTO messages_fts_keys (hash) VALUES (NEW.hash);
+                        DELETE FROM messages_fts
+                        WHERE rowid = (SELECT id FROM messages_fts_keys WHERE hash = NEW.hash);
+                        INSERT INTO messages_fts (rowid, content, title, peer)
+                        VALUES ((SELECT id FROM messages_fts_keys WHERE hash = NEW.hash),
+                                NEW.content, NEW.title, {peer_name});
+                '''
+                conn.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS trg_messages_fts_insert AFTER INSERT ON messages
+                    BEGIN{reindex}
+                    END
+                ''')
+                conn.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS trg_messages_fts_update
+                    AFTER UPDATE OF content, title, conversation_hash ON messages
+                    BEGIN{reindex}
+                    END
+                ''')
+                conn.execute('''
+                    CREATE TRIGGER IF NOT EXISTS trg_messages_fts_delete AFTER DELETE ON messages
+                    BEGIN
+                        DELETE FROM messages_fts
+                        WHERE rowid = (SELECT id FROM messages_fts_keys WHERE hash = OLD.hash);
+                        DELETE FROM messages_fts_keys WHERE hash = OLD.hash;
+                    END
+                ''')
+                # Un peer che cambia nome: aggiorna la colonna peer dei suoi messaggi
+                conn.execute('''
+                    CREATE TRIGGER IF NOT EXISTS trg_messages_fts_rename
+                    AFTER UPDATE OF display_name ON identities
+                    WHEN OLD.display_name IS NOT NEW.display_name
+                    BEGIN
+                        UPDATE messages_fts SET peer = NEW.display_name
+                        WHERE rowid IN (
+                            SELECT k.id FROM messages m
+                            JOIN messages_fts_keys k ON k.hash = m.hash
+                            JOIN destinations d ON d.destination_hash = m.conversation_hash
+                            WHERE d.identity_hash = NEW.identity_hash
+                        );
+                    END
+                ''')
+            self.enabled = True
+        except sqlite3.OperationalError as e:
+            print(f"⚠️ Ricerca full-text non disponibile (FTS5): {e}")
+            self.enabled = False
+        return self.enabled
+
+    def backfill(self):
+        """Indicizza i messaggi che non sono ancora in messages_fts. Restituisce quanti."""
+        if not self.enabled:
+            return 0
+
+        peer_name = PEER_NAME_SQL.format(hash='m.conversation_hash')
+        indexed = 0
+        last_rowid = 0
+        while True:
+            with self.db.write() as conn:
+                # La rowid di messages serve solo a scorrere i blocchi in questo giro
+                rows = conn.execute('''
+                    SELECT rowid FROM messages WHERE rowid > ? ORDER BY rowid LIMIT ?
+                ''', (last_rowid, BACKFILL_BATCH)).fetchall()
+                if not rows:
+                    break
+                first, last = rows[0][0], rows[-1][0]
+                conn.execute('''
+                    INSERT OR IGNORE INTO messages_fts_keys (hash)
+                    SELECT hash FROM messages WHERE rowid BETWEEN ? AND ?
+                ''', (first, last))
+                cursor = conn.execute(f'''
+                    INSERT INTO messages_fts (rowid, content, title, peer)
+                    SELECT k.id, m.content, m.title, {peer_name}
+                    FROM messages m
+                    JOIN messages_fts_keys k ON k.hash = m.hash
+                    WHERE m.rowid BETWEEN ? AND ?
+                      AND NOT EXISTS (SELECT 1 FROM messages_fts f WHERE f.rowid = k.id)
+                ''', (first, last))
+                indexed += max(cursor.rowcount, 0)
+                last_rowid = last
+        return indexed
+
+    def search(self, text, peer=None, limit=DEFAULT_LIMIT, cursor=None, order='rank'):
+        """
+        Cerca nei messaggi. order='rank' (bm25) o 'recent' (più recenti prima).
+        Restituisce (risultati, cursore_successivo o None).
+        """
+        if not self.enabled:
+            raise RuntimeError('Ricerca full-text non disponibile')
+        match = build_match_query(text)
+        if not match:
+            raise ValueError('Query di ricerca vuota')
+        if order not in ('rank', 'recent'):
+            raise ValueError(f"Ordinamento non valido: {order}")
+        limit = max(1, min(int(limit), MAX_LIMIT))
+
+        # Chiave di ordinamento (crescente) + rowid per un cursore stabile
+        key = BM25_EXPR if order == 'rank' else '-m.timestamp'
+
+        sql = f'''
+            SELECT m.hash, m.conversation_hash, m.source_hash, m.destination_hash,
+                   m.timestamp, m.incoming, m.title,
+                   snippet(messages_fts, 0, '«', '»', '…', {SNIPPET_TOKENS}),
+                   messages_fts.peer, {key}, messages_fts.rowid
+            FROM messages_fts
+            JOIN messages_fts_keys k ON k.id = messages_fts.rowid
+            JOIN messages m ON m.hash = k.hash
+            WHERE messages_fts MATCH ?
+        '''
+        params = [match]
+        if peer:
+            sql += ' AND m.conversation_hash = ?'
+            params.append(peer)
+        if cursor:
+            first, rowid = decode_cursor(cursor)
+            sql += f' AND ({key} > ? OR ({key} = ? AND messages_fts.rowid > ?))'
+            params += [first, first, rowid]
+        sql += f' ORDER BY {key}, messages_fts.rowid LIMIT ?'
+        params.append(limit + 1)
+
+        rows = self.db.query(sql, params)
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        results = []
+        for msg_hash, conversation, source, dest, ts, incoming, title, snippet, peer_name, sort_key, rowid in rows:
+            results.append({
+                'hash': msg_hash,
+                'conversation': conversation,
+                'from': source,
+                'to': dest,
+                'time': ts,
+                'incoming': bool(incoming),
+                'title': title or '',
+                'snippet': snippet,
+                'peer_name': peer_name,
+                'score': round(-sort_key, 4) if order == 'rank' else None
+            })
+
+        next_cursor = encode_cursor(rows[-1][9], rows[-1][10]) if has_more and rows else None
+        return results, next_cursor
@@ -0,0 +1,267 @@
+# core/stamps.py - Calcolo degli stamp LXMF in processi separati
+#
+# Lo stamp di un messaggio (proof-of-work con costo stamp_cost) è lavoro CPU
+# puro: se lo fa pack() blocca il thread che invia e, per via del GIL, anche
+# il resto del server. Qui i messaggi da timbrare vanno in una coda FIFO e
+# ogni job usa un processo per core (come il generatore vanity); i messaggi
+# accodati vengono timbrati in anticipo, mentre aspettano, e on_progress
+# riceve tentativi, velocità e probabilità per la UI. Un job si può annullare.
+import os
+import time
+import queue
+import threading
+from collections import OrderedDict, deque
+import multiprocessing
+
+from LXMF import LXStamper
+
+# Tentativi tra un aggiornamento e l'altro del contatore condiviso
+COUNTER_BATCH = 64
+
+# Intervallo delle notifiche di avanzamento (secondi)
+PROGRESS_INTERVAL = 1.0
+
+# Job conclusi conservati per /api/stamps
+KEEP_FINISHED = 50
+
+STAMP_SIZE = getattr(LXStamper, 'STAMP_SIZE', 32)
+
+
+# ============================================
+# === WORKER (processo separato) ===
+# ============================================
+
+def _stamp_worker(workblock, cost, counter, stop_event, result_queue):
+    """Prova stamp casuali finché uno non raggiunge il costo richiesto"""
+    try:
+        while not stop_event.is_set():
+            for attempt in range(COUNTER_BATCH):
+                stamp = os.urandom(STAMP_SIZE)
+                if LXStamper.stamp_valid(stamp, cost, workblock):
+                    with counter.get_lock():
+                        counter.value += attempt + 1
+                    result_queue.put(('found', stamp))
+                    stop_event.set()
+                    return
+            with counter.get_lock():
+                counter.value += COUNTER_BATCH
+    except Exception as e:
+        result_queue.put(('error', str(e)))
+
+
+# ============================================
+# === CODA DEI JOB ===
+# ============================================
+
+class StampGenerator:
+    """Timbra un messaggio alla volta su tutti i core, gli altri restano in coda"""
+
+    def __init__(self, on_progress=None, workers=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.on_progress = on_progress
+        self.cond = threading.Condition()
+        self.pending = deque()
+        self.jobs = OrderedDict()
+        self.current = None
+        self.running = True
+        self.thread = None
+
+    @staticmethod
+    def expected_attempts(cost):
+        return 2 ** cost
+
+    def submit(self, key, material, cost, on_done):
+        """
+        Accoda il calcolo dello stamp per `material` (message_id).
+        on_done(stamp) riceve lo stamp, o None se annullato o fallito.
+        """
+        job = {
+            'id': key,
+            'cost': cost,
+            'material': material,
+            'on_done': on_done,
+            'status': 'queued',
+            'queued': time.time(),
+            'started': None,
+            'finished': None,
+            'counter': None,
+            'stop_event': None,
+            'processes': [],
+            'attempts': 0,
+            'error': None
+        }
+        with self.cond:
+            self.jobs[key] = job
+            self.pending.append(job)
+            self._trim()
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+            self.cond.notify()
+        self._notify(job)
+        return self.status(key)
+
+    def _trim(self):
+        finished = [key for key, job in self.jobs.items() if job['finished']]
+        for key in finished[:max(len(finished) - KEEP_FINISHED, 0)]:
+            del self.jobs[key]
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while self.running and not self.pending:
+                    self.cond.wait()
+                if not self.running:
+                    return
+                job = self.pending.popleft()
+                self.current = job
+            try:
+                stamp = self._generate(job)
+            except Exception as e:
+                job['status'] = 'error'
+                job['error'] = str(e)
+                stamp = None
+            finally:
+                with self.cond:
+                    self.current = None
+
+            job['finished'] = time.time()
+            self._notify(job)
+            try:
+                job['on_done'](stamp)
+            except Exception as e:
+                print(f"⚠️ Errore dopo il calcolo dello stamp: {e}")
+
+    def _generate(self, job):
+        workblock = LXStamper.stamp_workblock(job['material'])
+        result_queue = multiprocessing.Queue()
+        with self.cond:
+            # Annullato tra l'uscita dalla coda e l'avvio
+            if job['status'] == 'cancelled':
+                return None
+            job['counter'] = multiprocessing.Value('Q', 0)
+            job['stop_event'] = multiprocessing.Event()
+            job['status'] = 'running'
+            job['started'] = time.time()
+
+        for _ in range(self.workers):
+            p = multiprocessing.Process(
+                target=_stamp_worker,
+                args=(workblock, job['cost'], job['counter'], job['stop_event'], result_queue),
+                daemon=True
+            )
+            p.start()
+            job['processes'].append(p)
+        print(f"🔏 Stamp {job['id'][:16]}: costo {job['cost']} su {self.workers} processi")
+
+        stamp = None
+        try:
+            while job['status'] == 'running':
+                try:
+                    kind, value = result_queue.get(timeout=PROGRESS_INTERVAL)
+                except queue.Empty:
+                    if job['status'] != 'running':
+                        break
+                    if not any(p.is_alive() for p in job['processes']):
+                        job['status'] = 'error'
+                        job['error'] = 'Processi terminati senza risultato'
+                    else:
+                        self._notify(job)
+                    continue
+
+                if job['status'] != 'running':
+                    break
+                if kind == 'found':
+                    stamp = value
+                    job['status'] = 'done'
+                else:
+                    job['status'] = 'error'
+                    job['error'] = value
+        finally:
+            job['stop_event'].set()
+            for p in job['processes']:
+                p.join(timeout=2)
+                if p.is_alive():
+                    p.terminate()
+            job['attempts'] = job['counter'].value
+            job['processes'] = []
+        return stamp if job['status'] == 'done' else None
+
+    def cancel(self, key):
+        """Annulla un job in coda o in corso; on_done riceverà None"""
+        with self.cond:
+            job = self.jobs.get(key)
+            if not job or job['finished']:
+                return False
+            if job in self.pending:
+                self.pending.remove(job)
+                job['status'] = 'cancelled'
+                job['finished'] = time.time()
+                queued = True
+            else:
+                job['status'] = 'cancelled'
+                if job['stop_event']:
+                    job['stop_event'].set()
+                queued = False
+
+        if queued:
+            self._notify(job)
+            job['on_done'](None)
+        return True
+
+    # ============================================
+    # STATO
+    # ============================================
+
+    def _notify(self, job):
+        if self.on_progress:
+            try:
+                self.on_progress(self._status(job))
+            except Exception as e:
+                print(f"⚠️ Errore notifica stamp: {e}")
+
+    def _status(self, job):
+        attempts = job['counter'].value if job['counter'] is not None else job['attempts']
+        elapsed = ((job['finished'] or time.time()) - job['started']) if job['started'] else 0
+        rate = attempts / elapsed if elapsed > 0 else 0
+        expected = self.expected_attempts(job['cost'])
+        # Ricerca senza memoria: il tempo atteso residuo è sempre expected / rate
+        eta = expected / rate if rate > 0 and job['status'] == 'running' else None
+        return {
+            'hash': job['id'],
+            'status': job['status'],
+            'cost': job['cost'],
+            'workers': self.workers,
+            'attempts': attempts,
+            'elapsed': round(elapsed, 1),
+            'rate': round(rate, 1),
+            'expected_attempts': expected,
+            'eta_seconds': round(eta, 1) if eta is not None else None,
+            'probability': round(1 - (1 - 1 / expected) ** attempts, 4),
+            'error': job['error']
+        }
+
+    def status(self, key):
+        with self.cond:
+            job = self.jobs.get(key)
+        return self._status(job) if job else None
+
+    def get_stats(self):
+        with self.cond:
+            jobs = list(self.jobs.values())
+            queued = len(self.pending)
+        return {
+            'workers': self.workers,
+            'queued': queued,
+            'jobs': [self._status(job) for job in reversed(jobs)]
+        }
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            pending = list(self.pending)
+            self.cond.notify()
+        for job in pending:
+            self.cancel(job['id'])
+        if self.current and self.current['stop_event']:
+            self.current['stop_event'].set()
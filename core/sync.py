@@ -0,0 +1,242 @@
+# core/sync.py - Sincronizzazione dal propagation node in background
+#
+# /api/sync non aspetta più la fine del trasferimento: la richiesta al
+# propagation node diventa un job con id, seguito da un thread che notifica
+# stato e avanzamento del router (on_update) e ogni messaggio arrivato nel
+# frattempo (on_message). Un job alla volta, annullabile. Volendo la sync
+# parte da sola ogni N secondi; dopo un fallimento l'intervallo raddoppia
+# (backoff) fino a MAX_BACKOFF e torna normale alla prima sync riuscita.
+import time
+import uuid
+import threading
+from collections import OrderedDict
+
+import LXMF
+
+# Controllo dello stato del router (secondi) e durata massima di un job
+SYNC_POLL = 0.5
+SYNC_TIMEOUT = 120
+
+# Limite del backoff della sync automatica (secondi)
+MAX_BACKOFF = 3600
+
+# Job conservati per /api/sync/<job>
+KEEP_JOBS = 20
+
+STATE_NAMES = {
+    getattr(LXMF.LXMRouter, name): name[3:].lower()
+    for name in ('PR_IDLE', 'PR_PATH_REQUESTED', 'PR_LINK_ESTABLISHING', 'PR_LINK_ESTABLISHED',
+                 'PR_REQUEST_SENT', 'PR_RECEIVING', 'PR_RESPONSE_RECEIVED', 'PR_COMPLETE',
+                 'PR_NO_PATH', 'PR_LINK_FAILED', 'PR_TRANSFER_FAILED', 'PR_NO_IDENTITY_RCVD',
+                 'PR_NO_ACCESS', 'PR_FAILED')
+    if hasattr(LXMF.LXMRouter, name)
+}
+
+FAILED_STATES = {
+    getattr(LXMF.LXMRouter, name)
+    for name in ('PR_NO_PATH', 'PR_LINK_FAILED', 'PR_TRANSFER_FAILED', 'PR_NO_IDENTITY_RCVD',
+                 'PR_NO_ACCESS', 'PR_FAILED')
+    if hasattr(LXMF.LXMRouter, name)
+}
+
+
+class PropagationSync:
+    def __init__(self, router, identity, node_getter, on_update=None, on_message=None):
+        self.router = router
+        self.identity = identity
+        self.node_getter = node_getter
+        self.on_update = on_update
+        self.on_message = on_message
+        self.lock = threading.Lock()
+        self.jobs = OrderedDict()
+        self.current = None
+        self.auto_interval = 0
+        self.auto_stop = None
+        self.failures = 0
+        self.next_auto = None
+
+    # ============================================
+    # JOB
+    # ============================================
+
+    def start(self, limit=None, auto=False):
+        """Avvia una sync (o restituisce quella in corso). Non blocca."""
+        if not self.node_getter():
+            return {'success': False, 'error': 'No propagation node in config'}
+
+        with self.lock:
+            if self.current and self.current['status'] == 'running':
+                return {'success': True, 'already_running': True, **self._snapshot(self.current)}
+            job = {
+                'job': uuid.uuid4().hex[:12],
+                'status': 'running',
+                'state': None,
+                'progress': 0.0,
+                'received': 0,
+                'new': None,
+                'limit': limit,
+                'auto': auto,
+                'started': time.time(),
+                'finished': None,
+                'error': None,
+                'done': threading.Event()
+            }
+            self.current = job
+            self.jobs[job['job']] = job
+            while len(self.jobs) > KEEP_JOBS:
+                self.jobs.popitem(last=False)
+
+        threading.Thread(target=self._run, args=(job,), daemon=True).start()
+        return {'success': True, **self._snapshot(job)}
+
+    def _run(self, job):
+        try:
+            self.router.request_messages_from_propagation_node(self.identity, max_messages=job['limit'])
+        except Exception as e:
+            self._finish(job, 'failed', str(e))
+            return
+
+        left_idle = False
+        deadline = job['started'] + SYNC_TIMEOUT
+        while job['status'] == 'running':
+            state = self.router.propagation_transfer_state
+            progress = round((getattr(self.router, 'propagation_transfer_progress', 0) or 0) * 100, 1)
+            if state != job['state'] or progress != job['progress']:
+                with self.lock:
+                    job['state'] = state
+                    job['progress'] = progress
+                self._notify(job)
+
+            if state == LXMF.LXMRouter.PR_COMPLETE or (left_idle and state == LXMF.LXMRouter.PR_IDLE):
+                self._finish(job, 'complete')
+            elif state in FAILED_STATES:
+                self._finish(job, 'failed', STATE_NAMES.get(state, str(state)))
+            elif time.time() > deadline:
+                self._cancel_router()
+                self._finish(job, 'timeout', 'Nessuna risposta dal propagation node')
+            else:
+                left_idle = left_idle or state != LXMF.LXMRouter.PR_IDLE
+                time.sleep(SYNC_POLL)
+
+    def _finish(self, job, status, error=None):
+        with self.lock:
+            if job['status'] != 'running':
+                return
+            job['status'] = status
+            job['error'] = error
+            job['finished'] = time.time()
+            job['new'] = getattr(self.router, 'propagation_transfer_last_result', None)
+            if status == 'complete':
+                job['progress'] = 100.0
+        job['done'].set()
+        self._notify(job)
+
+    def _cancel_router(self):
+        try:
+            self.router.cancel_propagation_node_requests()
+        except Exception:
+            pass
+
+    def cancel(self):
+        """Annulla la sync in corso"""
+        with self.lock:
+            job = self.current
+        if not job or job['status'] != 'running':
+            return False
+        self._cancel_router()
+        self._finish(job, 'cancelled')
+        return True
+
+    def note_message(self, msg_hash, source_hash):
+        """Un messaggio è arrivato: se c'è una sync in corso lo conta e lo notifica"""
+        with self.lock:
+            job = self.current
+            if not job or job['status'] != 'running':
+                return
+            job['received'] += 1
+        if self.on_message:
+            try:
+                self.on_message({'job': job['job'], 'hash': msg_hash, 'from': source_hash,
+                                 'received': job['received']})
+            except Exception as e:
+                print(f"⚠️ Errore notifica messaggio sincronizzato: {e}")
+
+    # ============================================
+    # SYNC AUTOMATICA
+    # ============================================
+
+    def start_auto(self, interval):
+        """Sync ogni `interval` secondi (0 = disattiva), con backoff dopo i fallimenti"""
+        with self.lock:
+            # Ogni ciclo ha il suo evento di stop: quello vecchio può finire con calma
+            # (anche a metà di una sync) senza impedire l'avvio del nuovo
+            if self.auto_stop:
+                self.auto_stop.set()
+            self.auto_stop = None
+            self.auto_interval = interval or 0
+            self.failures = 0
+            self.next_auto = None
+            if self.auto_interval > 0:
+                self.auto_stop = threading.Event()
+                threading.Thread(target=self._auto_loop, args=(self.auto_stop,), daemon=True).start()
+
+    def _auto_loop(self, stop):
+        while not stop.is_set():
+            delay = min(self.auto_interval * (2 ** self.failures), MAX_BACKOFF)
+            self.next_auto = time.time() + delay
+            if stop.wait(delay):
+                break
+
+            result = self.start(auto=True)
+            if not result.get('success'):
+                self.failures = min(self.failures + 1, 16)
+                continue
+            job = self.jobs.get(result['job'])
+            if job:
+                job['done'].wait(SYNC_TIMEOUT + SYNC_POLL * 4)
+            if stop.is_set():
+                break
+            if job and job['status'] == 'complete':
+                self.failures = 0
+            else:
+                self.failures = min(self.failures + 1, 16)
+                print(f"⚠️ Sync automatica fallita, prossimo tentativo tra "
+                      f"{min(self.auto_interval * (2 ** self.failures), MAX_BACKOFF)}s")
+
+    def stop(self):
+        self.start_auto(0)
+        self.cancel()
+
+    # ============================================
+    # STATO
+    # ============================================
+
+    def _snapshot(self, job):
+        snapshot = {key: value for key, value in job.items() if key != 'done'}
+        snapshot['state_name'] = STATE_NAMES.get(job['state'])
+        return snapshot
+
+    def _notify(self, job):
+        if not self.on_update:
+            return
+        with self.lock:
+            snapshot = self._snapshot(job)
+        try:
+            self.on_update(snapshot)
+        except Exception as e:
+            print(f"⚠️ Errore notifica sync: {e}")
+
+    def get(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return self._snapshot(job) if job else None
+
+    def get_status(self):
+        with self.lock:
+            current = self._snapshot(self.current) if self.current else None
+        return {
+            'current': current,
+            'auto_interval': self.auto_interval,
+            'failures': self.failures,
+            'next_auto': self.next_auto
+        }
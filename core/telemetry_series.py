@@ -0,0 +1,176 @@
+# core/telemetry_series.py - Serie di telemetria ridotte per i grafici
+#
+# Carica la finestra richiesta dalla tabella telemetry come array NumPy
+# colonnari e la riduce a un numero fisso di punti: min/max/media per
+# intervallo (bucket) oppure LTTB (Largest Triangle Three Buckets).
+# Un mese di campioni al minuto diventa qualche centinaio di punti.
+import re
+import time
+
+import numpy as np
+
+# Nome sensore esposto dall'API -> colonna della tabella telemetry
+SERIES_COLUMNS = {
+    'battery': 'battery_percent',
+    'temperature': 'temperature',
+    'humidity': 'humidity',
+    'pressure': 'pressure',
+    'light': 'light',
+    'altitude': 'altitude',
+    'speed': 'speed',
+    'rssi': 'rssi',
+    'snr': 'snr',
+    'q': 'q',
+    'hops': 'hops'
+}
+
+DEFAULT_SENSORS = ('battery', 'temperature', 'rssi', 'snr')
+
+DEFAULT_POINTS = 300
+MAX_POINTS = 2000
+
+RANGE_PATTERN = re.compile(r'^(\d+)\s*([smhdw])$')
+RANGE_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+
+def parse_range(value):
+    """'30m', '24h', '7d', '2w' -> secondi; 'all' o vuoto -> None"""
+    if not value or value == 'all':
+        return None
+    match = RANGE_PATTERN.match(value.strip().lower())
+    if not match:
+        raise ValueError(f"Intervallo non valido: {value}")
+    return int(match.group(1)) * RANGE_UNITS[match.group(2)]
+
+
+def _round(values, digits=3):
+    return [None if np.isnan(v) else round(float(v), digits) for v in values]
+
+
+def bucket_series(t, v, points, t0, t1):
+    """
+    Riduce (t, v) a al massimo `points` intervalli di uguale durata tra t0 e t1.
+    Restituisce t (media dei timestamp del bucket), min, max, mean e count.
+    """
+    valid = ~np.isnan(v)
+    t, v = t[valid], v[valid]
+    if t.size == 0:
+        return {'t': [], 'min': [], 'max': [], 'mean': [], 'count': []}
+
+    width = max((t1 - t0) / points, 1e-9)
+    idx = np.minimum(((t - t0) / width).astype(np.int64), points - 1)
+
+    # t è ordinato, quindi i bucket sono segmenti contigui: basta reduceat
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(idx)) + 1))
+    counts = np.diff(np.concatenate((starts, [t.size])))
+
+    return {
+        't': [int(x) for x in np.add.reduceat(t, starts) / counts],
+        'min': _round(np.minimum.reduceat(v, starts)),
+        'max': _round(np.maximum.reduceat(v, starts)),
+        'mean': _round(np.add.reduceat(v, starts) / counts),
+        'count': counts.tolist()
+    }
+
+
+def lttb_indices(t, v, points):
+    """Indici scelti dall'algoritmo LTTB (mantiene la forma visiva della serie)"""
+    n = t.size
+    if points >= n or points < 3:
+        return np.arange(n)
+
+    selected = np.empty(points, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+
+    # Bucket interni: tutti i punti tranne il primo e l'ultimo
+    edges = np.linspace(1, n - 1, points - 1).astype(np.int64)
+    a = 0
+    for i in range(points - 2):
+        start, end = edges[i], max(edges[i + 1], edges[i] + 1)
+
+        # Media del bucket successivo (o ultimo punto)
+        if i < points - 3:
+            next_start, next_end = edges[i + 1], max(edges[i + 2], edges[i + 1] + 1)
+            avg_t = t[next_start:next_end].mean()
+            avg_v = v[next_start:next_end].mean()
+        else:
+            avg_t, avg_v = t[-1], v[-1]
+
+        bt, bv = t[start:end], v[start:end]
+        areas = np.abs((t[a] - avg_t) * (bv - v[a]) - (t[a] - bt) * (avg_v - v[a]))
+        a = start + int(np.argmax(areas))
+        selected[i + 1] = a
+
+    return selected
+
+
+def lttb_series(t, v, points):
+    valid = ~np.isnan(v)
+    t, v = t[valid], v[valid]
+    if t.size == 0:
+        return {'t': [], 'v': []}
+    idx = lttb_indices(t, v, points)
+    return {'t': [int(x) for x in t[idx]], 'v': _round(v[idx])}
+
+
+def track_series(t, lat, lon, points):
+    """Percorso GPS: sottocampionamento uniforme dei punti validi (primo e ultimo inclusi)"""
+    valid = ~(np.isnan(lat) | np.isnan(lon))
+    t, lat, lon = t[valid], lat[valid], lon[valid]
+    if t.size > points:
+        idx = np.unique(np.linspace(0, t.size - 1, points).round().astype(np.int64))
+        t, lat, lon = t[idx], lat[idx], lon[idx]
+    return {'t': [int(x) for x in t], 'lat': _round(lat, 6), 'lon': _round(lon, 6)}
+
+
+def build_series(store, peer_hash, range_value='24h', points=DEFAULT_POINTS,
+                 sensors=DEFAULT_SENSORS, method='bucket', track=True):
+    """Serie ridotte per i sensori richiesti nella finestra `range_value`"""
+    for sensor in sensors:
+        if sensor not in SERIES_COLUMNS:
+            raise ValueError(f"Sensore non valido: {sensor}")
+    if method not in ('bucket', 'lttb'):
+        raise ValueError(f"Metodo non valido: {method}")
+    points = max(3, min(int(points), MAX_POINTS))
+
+    now = int(time.time())
+    window = parse_range(range_value)
+    since = now - window if window else None
+
+    columns = [SERIES_COLUMNS[s] for s in sensors]
+    if track:
+        columns += ['latitude', 'longitude']
+    rows = store.window(peer_hash, columns, since=since)
+
+    result = {
+        'peer': peer_hash,
+        'range': range_value,
+        'method': method,
+        'points': points,
+        'samples': len(rows),
+        'from': since,
+        'to': now,
+        'series': {}
+    }
+    if not rows:
+        if track:
+            result['track'] = {'t': [], 'lat': [], 'lon': []}
+        return result
+
+    # Colonnare: una colonna per sensore, None -> NaN
+    data = np.array(rows, dtype=np.float64)
+    t = data[:, 0]
+    t0 = since if since is not None else t[0]
+    t1 = max(float(now), t[-1])
+
+    for i, sensor in enumerate(sensors, start=1):
+        if method == 'lttb':
+            result['series'][sensor] = lttb_series(t, data[:, i], points)
+        else:
+            result['series'][sensor] = bucket_series(t, data[:, i], points, t0, t1)
+
+    if track:
+        result['track'] = track_series(t, data[:, -2], data[:, -1], points)
+
+    return result
@@ -0,0 +1,233 @@
+# core/telemetry_store.py - Serie temporali di telemetria in peers.db
+#
+# Un campione per riga nella tabella telemetry, indicizzata su (peer_hash, ts):
+# "ultimo campione" e "campioni dal timestamp X" sono ricerche sull'indice
+# invece di scansioni della cartella telemetry/. Le colonne dei sensori
+# principali permettono query e grafici senza fare il parse del JSON.
+import os
+import re
+import json
+
+# Righe importate per transazione
+IMPORT_BATCH = 500
+
+# <peer_hash>_<timestamp>.json / .bin
+TELEMETRY_FILE_PATTERN = re.compile(r'^([0-9a-f]+)_(\d+)\.(json|bin)$')
+
+SENSOR_COLUMNS = (
+    'latitude', 'longitude', 'altitude', 'speed', 'bearing', 'accuracy',
+    'battery_percent', 'battery_charging', 'temperature', 'humidity',
+    'pressure', 'light', 'rssi', 'snr', 'q', 'hops'
+)
+
+
+def _scalar(value):
+    """Valore numerico di un sensore (numero o dizionario con un solo valore utile)"""
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, dict):
+        for v in value.values():
+            if isinstance(v, (int, float)) and not isinstance(v, bool):
+                return v
+    return None
+
+
+def extract_sensors(data):
+    """Colonne dei sensori da un campione nel formato di Messenger._save_telemetry"""
+    row = dict.fromkeys(SENSOR_COLUMNS)
+    loc = data.get('location') or {}
+    for key in ('latitude', 'longitude', 'altitude', 'speed', 'bearing', 'accuracy'):
+        row[key] = _scalar(loc.get(key))
+
+    bat = data.get('battery') or {}
+    row['battery_percent'] = _scalar(bat.get('charge_percent'))
+    if bat:
+        row['battery_charging'] = 1 if bat.get('charging') else 0
+
+    row['temperature'] = _scalar(data.get('temperature'))
+    row['humidity'] = _scalar(data.get('humidity'))
+    row['pressure'] = _scalar(data.get('pressure'))
+    row['light'] = _scalar(data.get('ambient_light'))
+    for key in ('rssi', 'snr', 'q', 'hops'):
+        row[key] = _scalar(data.get(key))
+    return row
+
+
+class TelemetryStore:
+    def __init__(self, db):
+        self.db = db
+
+    def init_schema(self):
+        columns = ',\n'.join(f'                    {name} REAL' for name in SENSOR_COLUMNS)
+        with self.db.write() as conn:
+            conn.execute(f'''
+                CREATE TABLE IF NOT EXISTS telemetry (
+                    id INTEGER PRIMARY KEY,
+                    peer_hash TEXT NOT NULL,
+                    ts INTEGER NOT NULL,
+{columns},
+                    data TEXT,
+                    packed BLOB
+                )
+            ''')
+            # Stesso peer e stesso secondo: sostituisce (come facevano i file)
+            conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_telemetry_peer_ts ON telemetry(peer_hash, ts)')
+
+    def _row(self, peer_hash, ts, data, packed):
+        sensors = extract_sensors(data or {})
+        return (peer_hash, int(ts), *[sensors[name] for name in SENSOR_COLUMNS],
+                json.dumps(data) if data is not None else None,
+                packed if packed else None)
+
+    def _insert_sql(self):
+        names = ', '.join(SENSOR_COLUMNS)
+        marks = ', '.join('?' for _ in SENSOR_COLUMNS)
+        return f'''
+            INSERT OR REPLACE INTO telemetry (peer_hash, ts, {names}, data, packed)
+            VALUES (?, ?, {marks}, ?, ?)
+        '''
+
+    def add(self, peer_hash, ts, data, packed=None):
+        """Salva un campione (data: dizionario leggibile, packed: Telemeter.packed())"""
+        self.db.execute(self._insert_sql(), self._row(peer_hash, ts, data, packed))
+
+    # ============================================
+    # QUERY
+    # ============================================
+
+    def latest_timestamp(self, peer_hash):
+        """Timestamp dell'ultimo campione (0 se nessuno)"""
+        row = self.db.query_one('SELECT MAX(ts) FROM telemetry WHERE peer_hash = ?', (peer_hash,))
+        return row[0] if row and row[0] is not None else 0
+
+    def packed_since(self, peer_hash, timebase):
+        """Campioni binari con ts >= timebase, in ordine cronologico"""
+        rows = self.db.query('''
+            SELECT packed FROM telemetry
+            WHERE peer_hash = ? AND ts >= ? AND packed IS NOT NULL
+            ORDER BY ts
+        ''', (peer_hash, int(timebase or 0)))
+        return [bytes(row[0]) for row in rows]
+
+    def history(self, peer_hash, limit=50, since=None, until=None):
+        """Ultimi campioni (più recenti per primi) nel formato JSON originale + timestamp"""
+        sql = 'SELECT ts, data FROM telemetry WHERE peer_hash = ?'
+        params = [peer_hash]
+        if since is not None:
+            sql += ' AND ts >= ?'
+            params.append(int(since))
+        if until is not None:
+            sql += ' AND ts <= ?'
+            params.append(int(until))
+        sql += ' ORDER BY ts DESC LIMIT ?'
+        params.append(int(limit))
+
+        history = []
+        for ts, data_json in self.db.query(sql, params):
+            try:
+                data = json.loads(data_json) if data_json else {}
+            except ValueError:
+                data = {}
+            data['timestamp'] = ts
+            history.append(data)
+        return history
+
+    def window(self, peer_hash, columns, since=None, until=None):
+        """Righe (ts, colonne...) in ordine cronologico per le serie dei grafici"""
+        for name in columns:
+            if name not in SENSOR_COLUMNS:
+                raise ValueError(f"Colonna non valida: {name}")
+        sql = f"SELECT ts, {', '.join(columns)} FROM telemetry WHERE peer_hash = ?"
+        params = [peer_hash]
+        if since is not None:
+            sql += ' AND ts >= ?'
+            params.append(int(since))
+        if until is not None:
+            sql += ' AND ts <= ?'
+            params.append(int(until))
+        sql += ' ORDER BY ts'
+        return self.db.query(sql, params)
+
+    def iter_window(self, peer_hash, columns, since=None, until=None, batch=IMPORT_BATCH):
+        """Come window() ma a pagine di `batch` righe (per export lunghi a memoria costante)"""
+        for name in columns:
+            if name not in SENSOR_COLUMNS:
+                raise ValueError(f"Colonna non valida: {name}")
+        last = int(since) - 1 if since is not None else -1
+        while True:
+            sql = f"SELECT ts, {', '.join(columns)} FROM telemetry WHERE peer_hash = ? AND ts > ?"
+            params = [peer_hash, last]
+            if until is not None:
+                sql += ' AND ts <= ?'
+                params.append(int(until))
+            sql += ' ORDER BY ts LIMIT ?'
+            params.append(batch)
+            rows = self.db.query(sql, params)
+            yield from rows
+            if len(rows) < batch:
+                return
+            last = rows[-1][0]
+
+    def count(self, peer_hash=None):
+        if peer_hash:
+            row = self.db.query_one('SELECT COUNT(*) FROM telemetry WHERE peer_hash = ?', (peer_hash,))
+        else:
+            row = self.db.query_one('SELECT COUNT(*) FROM telemetry')
+        return row[0]
+
+    # ============================================
+    # IMPORT DEI FILE
+    # ============================================
+
+    def import_files(self, telemetry_dir):
+        """
+        Importa i file <peer>_<ts>.json/.bin delle versioni precedenti e li
+        elimina dopo il commit. Restituisce il numero di campioni importati.
+        """
+        if not os.path.isdir(telemetry_dir):
+            return 0
+
+        samples = {}
+        for filename in os.listdir(telemetry_dir):
+            match = TELEMETRY_FILE_PATTERN.match(filename)
+            if match:
+                peer_hash, ts, ext = match.groups()
+                samples.setdefault((peer_hash, int(ts)), {})[ext] = os.path.join(telemetry_dir, filename)
+
+        imported = 0
+        batch = []
+        batch_files = []
+        for (peer_hash, ts), files in sorted(samples.items(), key=lambda item: item[0][1]):
+            try:
+                data = None
+                packed = None
+                if 'json' in files:
+                    with open(files['json'], 'r') as f:
+                        data = json.load(f)
+                if 'bin' in files:
+                    with open(files['bin'], 'rb') as f:
+                        packed = f.read()
+                batch.append(self._row(peer_hash, ts, data, packed))
+                batch_files.extend(files.values())
+            except Exception as e:
+                print(f"⚠️ Telemetria non importabile {peer_hash[:8]}_{ts}: {e}")
+                continue
+
+            if len(batch) >= IMPORT_BATCH:
+                imported += self._import_batch(batch, batch_files)
+                batch, batch_files = [], []
+
+        if batch:
+            imported += self._import_batch(batch, batch_files)
+        return imported
+
+    def _import_batch(self, batch, files):
+        self.db.executemany(self._insert_sql(), batch)
+        for path in files:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+        return len(batch)
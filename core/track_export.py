@@ -0,0 +1,246 @@
+# core/track_export.py - Export di tracce GPX, KML e GeoJSON in streaming
+#
+# Le tracce (punti dei rangetest o telemetria salvata) si scrivono un punto
+# alla volta invece di costruire un ElementTree e passarlo a minidom: la
+# memoria resta costante anche per tracce di più giorni. Ogni writer è un
+# generatore di blocchi di testo, usato sia per i file a fine rangetest sia
+# per il download HTTP in streaming. Le sorgenti sono funzioni senza
+# argomenti che restituiscono un nuovo iteratore di punti, perché KML e
+# GeoJSON scorrono i punti due volte (linea del percorso + singoli punti).
+import os
+import re
+import json
+import time
+from xml.sax.saxutils import escape, quoteattr
+
+# Dimensione dei blocchi restituiti dai writer (caratteri)
+CHUNK_SIZE = 64 * 1024
+
+# rangetest_<peer8>_<avvio>.jsonl
+RANGETEST_FILE_PATTERN = re.compile(r'^rangetest_([0-9a-f]+)_(\d+)\.jsonl$')
+
+
+# ============================================
+# SORGENTI
+# ============================================
+
+def track_point(timestamp, location, radio=None, battery=None):
+    """Punto nel formato dei rangetest: location con latitude/longitude/altitude"""
+    return {
+        'timestamp': timestamp,
+        'location': location,
+        'radio': radio or {},
+        'battery': battery
+    }
+
+
+def read_jsonl(path, since=None, until=None):
+    """Punti di un file JSONL di rangetest (le righe troncate si saltano)"""
+    with open(path) as f:
+        for line in f:
+            try:
+                point = json.loads(line)
+            except ValueError:
+                continue
+            ts = point.get('timestamp') or 0
+            if (since is not None and ts < since) or (until is not None and ts > until):
+                continue
+            yield point
+
+
+def rangetest_files(rangetest_dir, peer_hash):
+    """File JSONL dei rangetest di un peer, in ordine di avvio"""
+    if not os.path.isdir(rangetest_dir):
+        return []
+    files = []
+    for filename in os.listdir(rangetest_dir):
+        match = RANGETEST_FILE_PATTERN.match(filename)
+        if match and peer_hash.startswith(match.group(1)):
+            files.append((int(match.group(2)), os.path.join(rangetest_dir, filename)))
+    return [path for _, path in sorted(files)]
+
+
+def rangetest_source(paths, since=None, until=None):
+    def source():
+        for path in paths:
+            yield from read_jsonl(path, since, until)
+    return source
+
+
+TRACK_COLUMNS = ('latitude', 'longitude', 'altitude', 'speed', 'bearing', 'accuracy',
+                 'rssi', 'snr', 'q', 'hops', 'battery_percent')
+
+
+def telemetry_source(store, peer_hash, since=None, until=None):
+    """Punti dalla tabella telemetry (solo campioni con posizione), letti a pagine"""
+    def source():
+        for row in store.iter_window(peer_hash, TRACK_COLUMNS, since, until):
+            ts, lat, lon, alt, speed, bearing, accuracy, rssi, snr, q, hops, battery = row
+            if lat is None or lon is None:
+                continue
+            yield track_point(
+                ts,
+                {'latitude': lat, 'longitude': lon, 'altitude': alt or 0,
+                 'speed': speed, 'bearing': bearing, 'accuracy': accuracy},
+                radio={'rssi': rssi, 'snr': snr, 'q': q, 'hops': hops},
+                battery={'charge_percent': battery} if battery is not None else None
+            )
+    return source
+
+
+def _has_location(point):
+    loc = point.get('location')
+    return bool(loc and loc.get('latitude') is not None and loc.get('longitude') is not None)
+
+
+def _coords(loc):
+    return f"{loc.get('longitude', 0)},{loc.get('latitude', 0)},{loc.get('altitude') or 0}"
+
+
+def _iso(ts):
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(ts))
+
+
+def _buffered(parts):
+    """Raggruppa i pezzi in blocchi da CHUNK_SIZE (meno scritture, meno chunk HTTP)"""
+    buffer = []
+    size = 0
+    for part in parts:
+        buffer.append(part)
+        size += len(part)
+        if size >= CHUNK_SIZE:
+            yield ''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+# ============================================
+# WRITER
+# ============================================
+
+def _gpx_parts(source, name):
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n'
+    yield '<gpx version="1.1" creator="RNS Manager">\n  <trk>\n'
+    yield f'    <name>{escape(name)}</name>\n    <trkseg>\n'
+    for point in source():
+        if not _has_location(point):
+            continue
+        loc = point['location']
+        yield (f'      <trkpt lat={quoteattr(str(loc["latitude"]))} lon={quoteattr(str(loc["longitude"]))}>\n'
+               f'        <ele>{loc.get("altitude") or 0}</ele>\n'
+               f'        <time>{_iso(point["timestamp"])}</time>\n')
+
+        # Estensioni con dati radio e batteria
+        extensions = []
+        radio = point.get('radio') or {}
+        for key, tag in (('rssi', 'rssi'), ('snr', 'snr'), ('q', 'quality'), ('hops', 'hops')):
+            if radio.get(key) is not None:
+                extensions.append(f'<{tag}>{radio[key]}</{tag}>')
+        battery = point.get('battery') or {}
+        if battery.get('charge_percent') is not None:
+            extensions.append(f'<battery>{battery["charge_percent"]}</battery>')
+        if extensions:
+            yield f'        <extensions>{"".join(extensions)}</extensions>\n'
+        yield '      </trkpt>\n'
+    yield '    </trkseg>\n  </trk>\n</gpx>\n'
+
+
+def _kml_description(point):
+    text = []
+    radio = point.get('radio') or {}
+    if radio.get('rssi'):
+        text.append(f"RSSI: {radio['rssi']} dBm")
+    if radio.get('snr'):
+        text.append(f"SNR: {radio['snr']} dB")
+    if radio.get('q'):
+        text.append(f"Q: {radio['q']}%")
+    if radio.get('hops'):
+        text.append(f"Hops: {radio['hops']}")
+    if point.get('battery'):
+        text.append(f"Batteria: {point['battery'].get('charge_percent', 0)}%")
+    return "\n".join(text) if text else "Nessun dato radio"
+
+
+def _kml_parts(source, name):
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n'
+    yield '<kml xmlns="http://www.opengis.net/kml/2.2">\n  <Document>\n'
+    yield f'    <name>{escape(name)}</name>\n'
+
+    # Prima passata: la linea del percorso
+    yield ('    <Placemark>\n      <name>Percorso</name>\n'
+           '      <Style><LineStyle><color>ff0000ff</color><width>2</width></LineStyle></Style>\n'
+           '      <LineString>\n        <tessellate>1</tessellate>\n        <coordinates>\n')
+    for point in source():
+        if _has_location(point):
+            yield _coords(point['location']) + '\n'
+    yield '        </coordinates>\n      </LineString>\n    </Placemark>\n'
+
+    # Seconda passata: un placemark per punto
+    for i, point in enumerate(source()):
+        if not _has_location(point):
+            continue
+        yield (f'    <Placemark>\n      <name>Punto {i + 1}</name>\n'
+               f'      <TimeStamp><when>{_iso(point["timestamp"])}</when></TimeStamp>\n'
+               f'      <description>{escape(_kml_description(point))}</description>\n'
+               f'      <Point><coordinates>{_coords(point["location"])}</coordinates></Point>\n'
+               f'    </Placemark>\n')
+    yield '  </Document>\n</kml>\n'
+
+
+def _geojson_parts(source, name):
+    yield '{"type": "FeatureCollection", "name": ' + json.dumps(name) + ', "features": [\n'
+
+    # Prima passata: la linea del percorso
+    yield '{"type": "Feature", "properties": {"name": "Percorso"}, "geometry": {"type": "LineString", "coordinates": ['
+    first = True
+    for point in source():
+        if not _has_location(point):
+            continue
+        loc = point['location']
+        yield ('' if first else ', ') + json.dumps([loc['longitude'], loc['latitude'], loc.get('altitude') or 0])
+        first = False
+    yield ']}}'
+
+    # Seconda passata: un Feature Point per punto con dati radio e batteria
+    for point in source():
+        if not _has_location(point):
+            continue
+        loc = point['location']
+        properties = {'time': _iso(point['timestamp']), 'timestamp': point['timestamp']}
+        properties.update({key: value for key, value in (point.get('radio') or {}).items() if value is not None})
+        battery = point.get('battery') or {}
+        if battery.get('charge_percent') is not None:
+            properties['battery'] = battery['charge_percent']
+        feature = {
+            'type': 'Feature',
+            'properties': properties,
+            'geometry': {'type': 'Point', 'coordinates': [loc['longitude'], loc['latitude'], loc.get('altitude') or 0]}
+        }
+        yield ',\n' + json.dumps(feature, default=str)
+    yield '\n]}\n'
+
+
+# formato -> (writer, mimetype)
+FORMATS = {
+    'gpx': (_gpx_parts, 'application/gpx+xml'),
+    'kml': (_kml_parts, 'application/vnd.google-earth.kml+xml'),
+    'geojson': (_geojson_parts, 'application/geo+json')
+}
+
+
+def export_stream(fmt, source, name):
+    """Generatore di blocchi di testo della traccia nel formato richiesto"""
+    if fmt not in FORMATS:
+        raise ValueError(f"Formato non valido: {fmt}")
+    writer, _ = FORMATS[fmt]
+    return _buffered(writer(source, name))
+
+
+def export_file(fmt, source, name, path):
+    """Scrive la traccia su file un blocco alla volta"""
+    with open(path, 'w') as f:
+        for chunk in export_stream(fmt, source, name):
+            f.write(chunk)
+    return path
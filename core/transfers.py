@@ -0,0 +1,265 @@
+# core/transfers.py - Avanzamento dei trasferimenti in uscita
+#
+# Un solo TransferTracker al posto di un thread di polling per trasferimento.
+# Quando il messaggio viaggia come RNS.Resource l'avanzamento arriva dal suo
+# progress_callback (in catena con quello di LXMF); per il resto un unico
+# thread controlla i trasferimenti attivi ogni TICK secondi e dorme quando
+# non ce ne sono. Velocità smussata con media mobile esponenziale (EWMA) ed
+# ETA per trasferimento, più statistiche aggregate per /api/transfers.
+import math
+import time
+import threading
+from collections import deque
+
+import LXMF
+
+# Intervallo dello scheduler (secondi)
+TICK = 0.5
+
+# Costante di tempo della EWMA sulla velocità (secondi)
+EWMA_TAU = 2.0
+
+# Notifiche al massimo ogni N secondi per trasferimento (il 100% passa sempre)
+NOTIFY_INTERVAL = 0.25
+
+# Trasferimenti conclusi conservati per le statistiche
+KEEP_FINISHED = 50
+
+FINAL_STATES = tuple(
+    getattr(LXMF.LXMessage, name) for name in ('DELIVERED', 'FAILED', 'REJECTED', 'CANCELLED')
+    if hasattr(LXMF.LXMessage, name)
+)
+
+
+class Transfer:
+    __slots__ = ('key', 'message', 'total_bytes', 'sized', 'on_update', 'auto_finish', 'started',
+                 'bytes_sent', 'progress', 'speed', 'last_sample', 'last_bytes',
+                 'last_notify', 'hooked', 'status', 'finished')
+
+    def __init__(self, key, message, total_bytes, on_update, auto_finish):
+        self.key = key
+        self.message = message
+        self.total_bytes = total_bytes
+        # Dimensione definitiva (data da chi chiama o dalla Resource)
+        self.sized = bool(total_bytes)
+        self.on_update = on_update
+        self.auto_finish = auto_finish
+        self.started = time.time()
+        self.bytes_sent = 0
+        self.progress = 0.0
+        self.speed = 0.0
+        self.last_sample = self.started
+        self.last_bytes = 0
+        self.last_notify = 0
+        self.hooked = False
+        self.status = 'transferring'
+        self.finished = None
+
+    def snapshot(self):
+        now = self.finished or time.time()
+        elapsed = now - self.started
+        remaining = max(self.total_bytes - self.bytes_sent, 0)
+        return {
+            'hash': self.key,
+            'progress': round(self.progress * 100, 1),
+            'state': getattr(self.message, 'state', None),
+            'delivery_attempts': getattr(self.message, 'delivery_attempts', 0),
+            'status': self.status,
+            'speed': self.speed,
+            'avg_speed': self.bytes_sent / elapsed if elapsed > 0 else 0,
+            'eta': remaining / self.speed if self.speed > 0 and remaining else None,
+            'elapsed': elapsed,
+            'bytes_sent': self.bytes_sent,
+            'total_bytes': self.total_bytes
+        }
+
+
+class TransferTracker:
+    def __init__(self, on_update=None, tick=TICK):
+        self.on_update = on_update
+        self.tick = tick
+        self.cond = threading.Condition()
+        self.active = {}
+        self.finished = deque(maxlen=KEEP_FINISHED)
+        self.completed = 0
+        self.failed = 0
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    # ============================================
+    # REGISTRAZIONE
+    # ============================================
+
+    def track(self, key, message, total_bytes=None, on_update=None, auto_finish=True):
+        """
+        Segue un LXMessage in uscita. on_update (o quello del tracker) riceve
+        gli snapshot; con auto_finish il trasferimento si chiude da solo quando
+        il messaggio arriva a uno stato finale, altrimenti serve finish().
+        """
+        transfer = Transfer(key, message, total_bytes or 0, on_update or self.on_update, auto_finish)
+        with self.cond:
+            self.active[key] = transfer
+            self._hook_resource(transfer)
+            self.cond.notify()
+        return transfer
+
+    def finish(self, key, status='delivered'):
+        with self.cond:
+            transfer = self.active.pop(key, None)
+            if not transfer:
+                return None
+            transfer.status = status
+            transfer.finished = time.time()
+            if status == 'delivered':
+                transfer.progress = 1.0
+                transfer.bytes_sent = transfer.total_bytes
+                self.completed += 1
+            else:
+                self.failed += 1
+            self.finished.append(transfer)
+            return transfer.snapshot()
+
+    def _hook_resource(self, transfer):
+        """Aggancia il progress_callback della Resource, se LXMF l'ha già creata"""
+        if transfer.hooked:
+            return
+        resource = getattr(transfer.message, 'resource_representation', None)
+        if resource is None or not hasattr(resource, 'progress_callback'):
+            return
+        # LXMF aggiorna message.progress dallo stesso callback: va mantenuto
+        previous = getattr(resource, '_Resource__progress_callback', None)
+        key = transfer.key
+
+        def on_progress(res):
+            if previous:
+                previous(res)
+            self._on_resource_progress(key)
+
+        resource.progress_callback(on_progress)
+        transfer.hooked = True
+
+    def _on_resource_progress(self, key):
+        with self.cond:
+            transfer = self.active.get(key)
+            if not transfer:
+                return
+            snapshot = self._sample(transfer, time.time())
+        self._notify(transfer, snapshot)
+
+    # ============================================
+    # CAMPIONAMENTO
+    # ============================================
+
+    def _sample(self, transfer, now):
+        """Aggiorna byte, progresso e velocità EWMA; restituisce lo snapshot da notificare o None"""
+        message = transfer.message
+        resource = getattr(message, 'resource_representation', None)
+        if not transfer.sized:
+            size = getattr(resource, 'total_size', None) or getattr(resource, 'size', None)
+            if size:
+                transfer.sized = True
+            elif getattr(message, 'packed', None):
+                # Messaggio in un solo pacchetto (o Resource non ancora creata)
+                size = len(message.packed)
+            transfer.total_bytes = size or 0
+
+        progress = getattr(message, 'progress', 0) or 0
+        if resource is not None and hasattr(resource, 'get_progress'):
+            try:
+                bytes_sent = int(resource.get_progress() * transfer.total_bytes)
+            except Exception:
+                bytes_sent = int(progress * transfer.total_bytes)
+        else:
+            bytes_sent = int(progress * transfer.total_bytes)
+
+        dt = now - transfer.last_sample
+        if dt > 0:
+            instant = max(bytes_sent - transfer.last_bytes, 0) / dt
+            # EWMA pesata sul tempo: campioni fitti (callback) o radi (tick) pesano uguale
+            alpha = 1 - math.exp(-dt / EWMA_TAU)
+            transfer.speed = alpha * instant + (1 - alpha) * transfer.speed
+            transfer.last_sample = now
+            transfer.last_bytes = bytes_sent
+
+        changed = progress != transfer.progress or bytes_sent != transfer.bytes_sent
+        transfer.progress = progress
+        transfer.bytes_sent = bytes_sent
+        if not changed:
+            return None
+        if progress < 1.0 and now - transfer.last_notify < NOTIFY_INTERVAL:
+            return None
+        transfer.last_notify = now
+        return transfer.snapshot()
+
+    def _notify(self, transfer, snapshot):
+        if snapshot and transfer.on_update:
+            try:
+                transfer.on_update(snapshot)
+            except Exception as e:
+                print(f"Errore nel monitoraggio progresso: {e}")
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while self.running and not self.active:
+                    self.cond.wait()
+                if not self.running:
+                    return
+                now = time.time()
+                updates = []
+                for key, transfer in list(self.active.items()):
+                    self._hook_resource(transfer)
+                    # Le Resource agganciate si campionano da sole; qui solo se ferme
+                    if not transfer.hooked or now - transfer.last_sample >= self.tick:
+                        updates.append((transfer, self._sample(transfer, now)))
+                    if transfer.auto_finish and getattr(transfer.message, 'state', None) in FINAL_STATES:
+                        delivered = transfer.message.state == getattr(LXMF.LXMessage, 'DELIVERED', None)
+                        self.finish(key, 'delivered' if delivered else 'failed')
+                        updates.append((transfer, transfer.snapshot()))
+
+            for transfer, snapshot in updates:
+                self._notify(transfer, snapshot)
+
+            with self.cond:
+                if self.running:
+                    self.cond.wait(self.tick)
+
+    # ============================================
+    # STATO
+    # ============================================
+
+    def get(self, key):
+        with self.cond:
+            transfer = self.active.get(key)
+            if transfer is None:
+                transfer = next((t for t in self.finished if t.key == key), None)
+            return transfer.snapshot() if transfer else None
+
+    def get_stats(self):
+        """Statistiche aggregate: attivi, byte, velocità totale ed ETA complessiva"""
+        with self.cond:
+            active = [t.snapshot() for t in self.active.values()]
+            recent = [t.snapshot() for t in self.finished]
+            completed, failed = self.completed, self.failed
+
+        total_bytes = sum(t['total_bytes'] for t in active)
+        bytes_sent = sum(t['bytes_sent'] for t in active)
+        speed = sum(t['speed'] for t in active)
+        remaining = max(total_bytes - bytes_sent, 0)
+        return {
+            'active': len(active),
+            'completed': completed,
+            'failed': failed,
+            'total_bytes': total_bytes,
+            'bytes_sent': bytes_sent,
+            'speed': speed,
+            'eta': remaining / speed if speed > 0 and remaining else None,
+            'transfers': active,
+            'recent': recent
+        }
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify()
@@ -1,14 +1,13 @@
 #!/usr/bin/env python3
 # app.py - Server web per LXMF Messenger
 
-from flask import Flask, render_template, request, jsonify, send_from_directory
+from flask import Flask, render_template, request, jsonify, send_from_directory, send_file, Response
 from flask_socketio import SocketIO, emit
 import json
 import os
 import time
 import threading
 import queue
-import sqlite3
 import base64
 import traceback
 import signal
@@ -19,6 +18,9 @@ from messenger import Messenger, Commands, guess_image_format
 import LXMF
 import RNS
 from messenger import Messenger, Commands, guess_image_format, CODEC2_AVAILABLE
+from core.blob_store import describe_attachment, attachment_media
+from core.raw_store import PAGE_BYTES as RAW_PAGE_BYTES, stored_preview
+from core.telemetry_series import build_series, parse_range, DEFAULT_SENSORS, DEFAULT_POINTS
 
 # 🔴 COSTANTI LXMF
 FIELD_TELEMETRY = 0x02
@@ -50,6 +52,28 @@ def on_progress(info):
     """Callback quando il progresso di invio cambia"""
     socketio.emit('progress_update', info)
 
+def on_message_state(state):
+    """Callback della pipeline di uscita: queued → resolving → packing → sending / failed"""
+    socketio.emit('message_state', state)
+
+def on_group_send(job):
+    """Callback degli invii di gruppo: avanzamento aggregato ed esito per membro"""
+    socketio.emit('group_send_update', job)
+
+def on_stamp_progress(status):
+    """Callback del calcolo stamp: tentativi, velocità e probabilità per la UI"""
+    socketio.emit('stamp_progress', status)
+
+def on_sync_update(job):
+    """Callback della sync dal propagation node: stato, avanzamento ed esito finale"""
+    socketio.emit('sync_progress', job)
+    if job['status'] == 'complete':
+        socketio.emit('sync_complete', {'new': job['new'], 'job': job['job'], 'received': job['received']})
+
+def on_sync_message(info):
+    """Callback per ogni messaggio arrivato durante una sync"""
+    socketio.emit('sync_message', info)
+
 def message_callback(msg):
     """Callback per messaggi in arrivo - invia via websocket"""
     try:
@@ -169,6 +193,11 @@ def create_messenger(identity_file=None):
             
             messenger.local_dest = messenger.dest
             messenger.message_callback = message_callback
+            messenger.outbound.on_state = on_message_state
+            messenger.fanout.on_update = on_group_send
+            messenger.stamps.on_progress = on_stamp_progress
+            messenger.sync.on_update = on_sync_update
+            messenger.sync.on_message = on_sync_message
             messenger.announce()
         
         print(f"✅ Messenger inizializzato: {messenger.display_name}")
@@ -213,6 +242,9 @@ def get_status():
         'aspect_hash': aspect_hash,
         'name': messenger.display_name,
         'propagation_node': messenger.config.get('propagation_node'),
+        'announce_queue': messenger.announce_queue.get_stats(),
+        'announce_bridge': messenger.announce_bridge.connected,
+        'outbound': messenger.outbound.get_stats(),
         'connected': True
     })
 
@@ -296,154 +328,177 @@ def select_identity():
 
 @app.route('/api/peers')
 def get_peers():
-    """Restituisce la lista dei peer con tutti i dati"""
+    """
+    Restituisce la lista dei peer con tutti i dati.
+    Risposta in cache finché identities/destinations non cambiano (ETag sulla versione).
+    """
     if not messenger:
         return jsonify([])
     
     try:
-        # Usa direttamente list_peers() che ora restituisce tutto
-        peers = messenger.list_peers()
+        version, _, body = messenger.get_peers_snapshot()
+        etag = f"peers-{version}"
         
-        # 🔴 AGGIUNGI I DATI DELL'ULTIMA TELEMETRIA
-        with messenger.db_lock:
-            conn = sqlite3.connect(messenger.peers_db, timeout=10)
-            c = conn.cursor()
-            
-            for peer in peers:
-                # Recupera gli ultimi dati telemetria per questo peer
-                c.execute('''
-                    SELECT last_latitude, last_longitude, last_altitude,
-                           last_speed, last_bearing, last_accuracy,
-                           last_battery, last_battery_charging,
-                           last_temperature, last_humidity, last_pressure,
-                           last_light, last_uptime, last_processor,
-                           last_ram, last_nvm, last_telemetry_time,
-                           trust_level, allow_telemetry, allow_commands,
-                           messages_sent, messages_received, telemetry_count,
-                           is_favorite, group_name, notes,
-                           destination_hash, last_seen, hops, rssi, snr, q
-                    FROM destinations 
-                    WHERE identity_hash = ? AND aspect = 'lxmf.delivery'
-                    ORDER BY last_seen DESC LIMIT 1
-                ''', (peer['hash'],))
-                
-                row = c.fetchone()
-                if row:
-                    peer.update({
-                        'dest_hash': row[26],
-                        'last_seen': row[27],
-                        'hops': row[28],
-                        'rssi': row[29],
-                        'snr': row[30],
-                        'q': row[31],
-                        'last_location': {
-                            'latitude': row[0],
-                            'longitude': row[1],
-                            'altitude': row[2],
-                            'speed': row[3],
-                            'bearing': row[4],
-                            'accuracy': row[5]
-                        } if row[0] and row[1] else None,
-                        'last_battery': {
-                            'percent': row[6],
-                            'charging': bool(row[7])
-                        } if row[6] is not None else None,
-                        'last_temperature': row[8],
-                        'last_humidity': row[9],
-                        'last_pressure': row[10],
-                        'last_light': row[11],
-                        'last_uptime': row[12],
-                        'last_processor': row[13],
-                        'last_ram': row[14],
-                        'last_nvm': row[15],
-                        'last_telemetry_time': row[16],
-                        'trust_level': row[17],
-                        'allow_telemetry': bool(row[18]),
-                        'allow_commands': bool(row[19]),
-                        'messages_sent': row[20],
-                        'messages_received': row[21],
-                        'telemetry_count': row[22],
-                        'favorite': bool(row[23]),
-                        'group': row[24] or 'public',
-                        'notes': row[25]
-                    })
-                else:
-                    peer['favorite'] = False
-                    peer['group'] = 'public'
-            
-            conn.close()
-        
-        return jsonify(peers)
+        if etag in request.if_none_match:
+            response = Response(status=304)
+        else:
+            response = Response(body, mimetype='application/json')
+        response.set_etag(etag)
+        # Il browser rivalida sempre: 304 finché la versione non cambia
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
     
     except Exception as e:
         print(f"Errore in get_peers: {e}")
         traceback.print_exc()
         return jsonify([])
 
+# Pagine della conversazione
+CONVERSATION_PAGE = 100
+MAX_CONVERSATION_PAGE = 1000
+
+# Colonne delle righe di get_conversation (prima di data/compressed del raw)
+CONVERSATION_FIELDS = (
+    'hash', 'source_hash', 'destination_hash', 'content', 'title', 'timestamp',
+    'method', 'packed_size', 'rssi', 'snr', 'q', 'hops', 'incoming', 'attachments'
+)
+
+def _archived_row(record, with_raw):
+    """Un record di MessageArchive nella forma delle righe lette da messages"""
+    raw = record.get('raw') if with_raw else None
+    return tuple(record.get(name) for name in CONVERSATION_FIELDS) + (raw, 0)
+
 @app.route('/api/conversation/<dest_hash>')
 def get_conversation(dest_hash):
-    """Restituisce i messaggi con un peer (dal database)"""
+    """
+    Restituisce i messaggi con un peer in ordine cronologico, a pagine (dalla più recente).
+    Parametri: limit (default 100), before / after (hash del messaggio cursore),
+    include=raw per l'anteprima del pacchetto raw.
+    Header: X-Has-More, X-Next-Before (cursore per la pagina precedente), X-Next-After
+    """
     if not messenger:
         return jsonify([])
-    
+
     messages = []
-    
+    has_more = False
+
     try:
-        with messenger.db_lock:
-            conn = sqlite3.connect(messenger.peers_db, timeout=10)
+        limit = max(1, min(request.args.get('limit', CONVERSATION_PAGE, type=int), MAX_CONVERSATION_PAGE))
+        before = request.args.get('before')
+        after = request.args.get('after')
+        include = set((request.args.get('include') or '').split(','))
+        with_raw = 'raw' in include
+
+        # Proiezione leggera: il raw (join su raw_packets) solo se richiesto
+        columns = '''
+            m.hash, m.source_hash, m.destination_hash, m.content, m.title, m.timestamp,
+            m.method, m.packed_size, m.rssi, m.snr, m.q, m.hops, m.incoming, m.attachments
+        '''
+        if with_raw:
+            columns += ', r.data, r.compressed'
+            source = 'messages m LEFT JOIN raw_packets r ON r.hash = m.hash'
+        else:
+            columns += ', NULL, NULL'
+            source = 'messages m'
+
+        with messenger.db.read() as conn:
             c = conn.cursor()
-            
-            c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='messages'")
-            if not c.fetchone():
-                conn.close()
-                return jsonify([])
-            
-            c.execute('''
-                SELECT hash, source_hash, destination_hash, content, title, timestamp,
-                       method, packed_size, rssi, snr, q, hops, incoming,
-                       raw_hex, raw_ascii, attachments
-                FROM messages 
-                WHERE source_hash = ? OR destination_hash = ?
-                ORDER BY timestamp ASC
-            ''', (dest_hash, dest_hash))
-            
+
+            cursor_hash = before or after
+            cursor_key = None
+            if cursor_hash:
+                c.execute('SELECT timestamp FROM messages WHERE hash = ?', (cursor_hash,))
+                cursor_row = c.fetchone()
+                if not cursor_row:
+                    # Il cursore può essere un messaggio già archiviato
+                    archived_ts = messenger.archive.timestamp_of(cursor_hash)
+                    cursor_row = (archived_ts,) if archived_ts is not None else None
+                if not cursor_row:
+                    return jsonify({'error': 'Cursore non trovato'}), 404
+                cursor_key = (cursor_row[0], cursor_hash)
+
+                # (timestamp, hash) come chiave univoca: nessun messaggio saltato a parità di tempo
+                if before:
+                    where = 'AND (m.timestamp < ? OR (m.timestamp = ? AND m.hash < ?))'
+                    order = 'DESC'
+                else:
+                    where = 'AND (m.timestamp > ? OR (m.timestamp = ? AND m.hash > ?))'
+                    order = 'ASC'
+                params = (dest_hash, cursor_row[0], cursor_row[0], cursor_hash, limit + 1)
+            else:
+                where = ''
+                order = 'DESC'
+                params = (dest_hash, limit + 1)
+
+            # Usa l'indice (conversation_hash, timestamp)
+            c.execute(f'''
+                SELECT {columns}
+                FROM {source}
+                WHERE m.conversation_hash = ? {where}
+                ORDER BY m.timestamp {order}, m.hash {order}
+                LIMIT ?
+            ''', params)
             rows = c.fetchall()
-            conn.close()
-        
-        print(f"📁 Caricati {len(rows)} messaggi dal database per {dest_hash[:8]}...")
-        
+
+        # Messaggi archiviati della chat: stesso cursore, uniti per (timestamp, hash)
+        archived_keys = messenger.archive.conversation_keys(
+            dest_hash, limit + 1,
+            before=cursor_key if before else None,
+            after=cursor_key if after else None
+        )
+        if archived_keys:
+            merged = [(row[5] or 0, row[0], row) for row in rows]
+            merged += [(ts or 0, msg_hash, None) for ts, msg_hash in archived_keys]
+            merged.sort(key=lambda item: (item[0], item[1]), reverse=(order == 'DESC'))
+            merged = merged[:limit + 1]
+            records = messenger.archive.load(msg_hash for _, msg_hash, row in merged if row is None)
+            rows = [
+                row if row is not None else _archived_row(records[msg_hash], with_raw)
+                for _, msg_hash, row in merged
+                if row is not None or msg_hash in records
+            ]
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if order == 'DESC':
+            rows.reverse()
+
         for row in rows:
-            hash_msg, source, dest, content, title, ts, method, packed_size, rssi, snr, q, hops, incoming, raw_hex, raw_ascii, attachments_json = row
-            
+            hash_msg, source_hash, dest, content, title, ts, method, packed_size, rssi, snr, q, hops, incoming, attachments_json, raw_data, raw_compressed = row
+
             msg_attachments = []
             if attachments_json:
                 try:
                     atts = json.loads(attachments_json)
                     for att in atts:
-                        if att['type'] == 'image':
+                        att_type, meta = describe_attachment(att)
+                        if att_type == 'image':
                             msg_attachments.append({
                                 'type': 'image',
-                                'format': att['format'],
-                                'size': att['size']
+                                'format': meta.get('format'),
+                                'size': meta.get('size'),
+                                'sha256': meta.get('sha256')
                             })
-                        elif att['type'] == 'audio':
+                        elif att_type == 'audio':
                             msg_attachments.append({
                                 'type': 'audio',
-                                'mode': att['mode'],
-                                'size': att['size']
+                                'mode': meta.get('mode'),
+                                'size': meta.get('size'),
+                                'sha256': meta.get('sha256')
                             })
-                        elif att['type'] == 'file':
+                        elif att_type == 'file':
                             msg_attachments.append({
                                 'type': 'file',
-                                'name': att['name'],
-                                'size': att['size']
+                                'name': meta.get('name'),
+                                'size': meta.get('size'),
+                                'sha256': meta.get('sha256')
                             })
                 except Exception as e:
                     print(f"❌ Errore parsing attachments: {e}")
-            
-            messages.append({
+
+            msg = {
                 'hash': hash_msg,
-                'from': source,
+                'from': source_hash,
                 'to': dest,
                 'content': content or '',
                 'title': title or '',
@@ -455,20 +510,25 @@ def get_conversation(dest_hash):
                 'snr': snr,
                 'q': q,
                 'hops': hops,
-                'raw_hex': raw_hex,
-                'raw_ascii': raw_ascii,
                 'attachments': msg_attachments,
                 'status': 'delivered' if incoming else 'sent'
-            })
-        
-        messages.sort(key=lambda x: x['time'])
-        print(f"✅ Totale messaggi caricati: {len(messages)}")
-        
+            }
+            if with_raw:
+                msg['raw_hex'], msg['raw_ascii'] = stored_preview(raw_data, raw_compressed)
+            messages.append(msg)
+
+        print(f"📁 Caricati {len(messages)} messaggi per {dest_hash[:8]}... (altri: {has_more})")
+
     except Exception as e:
         print(f"❌ Errore caricamento conversazione: {e}")
         traceback.print_exc()
-    
-    return jsonify(messages)
+
+    response = jsonify(messages)
+    response.headers['X-Has-More'] = '1' if has_more else '0'
+    if messages:
+        response.headers['X-Next-Before'] = messages[0]['hash']
+        response.headers['X-Next-After'] = messages[-1]['hash']
+    return response
 
 @app.route('/api/send', methods=['POST'])
 def send_message():
@@ -538,7 +598,8 @@ def send_message():
             'progress': on_progress
         }
         
-        result = messenger.send(
+        # Risponde subito con l'handle: path e invio proseguono nella pipeline
+        result = messenger.send_async(
             dest, content, title=title,
             image_path=image_path,
             audio_path=audio_path,
@@ -546,7 +607,7 @@ def send_message():
             callbacks=callbacks
         )
         
-        return jsonify(result)
+        return jsonify({'success': True, **result})
     
     except Exception as e:
         traceback.print_exc()
@@ -584,8 +645,162 @@ def send_command():
     cmd_type = cmd_map[cmd]
     cmd_data = text.encode('utf-8') if cmd == 'echo' and text else None
     
-    result = messenger.send_command(dest, cmd_type, cmd_data)
-    return jsonify(result)
+    result = messenger.send_command_async(dest, cmd_type, cmd_data)
+    return jsonify({'success': True, **result})
+
+@app.route('/api/groups/<group>/members')
+def get_group_members(group):
+    """Membri di un gruppo (destinazione lxmf.delivery più recente di ogni peer)"""
+    if not messenger:
+        return jsonify({'success': False, 'error': 'Messenger non inizializzato'})
+    
+    members = [{'destination': dest, 'name': name} for dest, name in messenger.group_members(group)]
+    return jsonify({'success': True, 'group': group, 'members': members})
+
+def parse_destinations(value):
+    """Lista JSON di hash di destinazione (32 caratteri esadecimali); None se non valida"""
+    try:
+        destinations = json.loads(value)
+    except ValueError:
+        return None
+    if not isinstance(destinations, list):
+        return None
+    for dest in destinations:
+        if not isinstance(dest, str) or len(dest) != RNS.Reticulum.TRUNCATED_HASHLENGTH // 4:
+            return None
+        try:
+            bytes.fromhex(dest)
+        except ValueError:
+            return None
+    return [dest.lower() for dest in destinations]
+
+@app.route('/api/groups/<group>/send', methods=['POST'])
+def send_group_message(group):
+    """Invia un messaggio a tutti i membri di un gruppo; risponde subito con il job"""
+    if not messenger:
+        return jsonify({'success': False, 'error': 'Messenger non inizializzato'})
+    
+    temp_files = []
+    
+    def cleanup_uploads():
+        # Allegati già letti e codificati: i file caricati non servono più
+        for temp_file in temp_files:
+            if os.path.exists(temp_file):
+                try:
+                    os.unlink(temp_file)
+                except:
+                    pass
+    
+    try:
+        content = request.form.get('content', '')
+        title = request.form.get('title', '')
+        file = request.files.get('file')
+        file_type = request.form.get('type', 'file')
+        members = request.form.get('members')
+        
+        # Lista esplicita di destinazioni (JSON) al posto dei membri del gruppo
+        if members:
+            destinations = parse_destinations(members)
+            if not destinations:
+                return jsonify({'success': False, 'error': 'Lista di destinatari non valida'})
+            members = [(dest, dest) for dest in destinations]
+        
+        image_path = None
+        audio_path = None
+        file_paths = None
+        
+        if file:
+            upload_dir = os.path.expanduser("~/.rns_manager/uploads")
+            os.makedirs(upload_dir, exist_ok=True)
+            
+            unique_id = str(uuid.uuid4())[:8]
+            safe_filename = f"{int(time.time())}_{unique_id}_{file.filename}"
+            temp_path = os.path.join(upload_dir, safe_filename)
+            file.save(temp_path)
+            temp_files.append(temp_path)
+            
+            if file_type == 'image':
+                image_path = temp_path
+            elif file_type == 'audio':
+                audio_path = temp_path
+            else:
+                file_paths = [(file.filename, temp_path)]
+        
+        if not content and not file:
+            return jsonify({'success': False, 'error': 'Messaggio o file mancante'})
+        
+        result = messenger.send_group(
+            group, content, title=title,
+            image_path=image_path,
+            audio_path=audio_path,
+            file_attachments=file_paths,
+            members=members,
+            on_prepared=cleanup_uploads
+        )
+        if not result.get('success'):
+            cleanup_uploads()
+        return jsonify(result)
+    
+    except Exception as e:
+        traceback.print_exc()
+        cleanup_uploads()
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/groups/sends')
+def list_group_sends():
+    """Invii di gruppo recenti"""
+    if not messenger:
+        return jsonify({'success': False, 'error': 'Messenger non inizializzato'})
+    
+    return jsonify({'success': True, 'sends': messenger.fanout.list()})
+
+@app.route('/api/groups/sends/<job_id>')
+def get_group_send(job_id):
+    """Stato di un invio di gruppo"""
+    if not messenger:
+        return jsonify({'success': False, 'error': 'Messenger non inizializzato'})
+    
+    job = messenger.fanout.get(job_id)
+    if not job:
+        return jsonify({'success': False, 'error': 'Invio di gruppo sconosciuto'})
+    return jsonify({'success': True, **job})
+
+@app.route('/api/stamps')
+def get_stamps():
+    """Coda del calcolo stamp (job in corso, in attesa e conclusi di recente)"""
+    if not messenger:
+        return jsonify({'success': False, 'error': 'Messenger non inizializzato'})
+    
+    return jsonify({'success': True, **messenger.stamps.get_stats()})
+
+@app.route('/api/stamps/<msg_hash>/cancel', methods=['POST'])
+def cancel_stamp(msg_hash):
+    """Annulla il calcolo dello stamp: il messaggio risulta fallito"""
+    if not messenger:
+        return jsonify({'success': False, 'error': 'Messenger non inizializzato'})
+    
+    if not messenger.cancel_stamp(msg_hash):
+        return jsonify({'success': False, 'error': 'Nessun calcolo stamp attivo per questo messaggio'})
+    return jsonify({'success': True})
+
+@app.route('/api/transfers')
+def get_transfers():
+    """Trasferimenti in uscita: attivi con velocità/ETA e totali aggregati"""
+    if not messenger:
+        return jsonify({'success': False, 'error': 'Messenger non inizializzato'})
+    
+    return jsonify({'success': True, **messenger.transfers.get_stats()})
+
+@app.route('/api/send/<handle>')
+def get_send_state(handle):
+    """Stato di un invio accodato (alternativa all'evento message_state)"""
+    if not messenger:
+        return jsonify({'success': False, 'error': 'Messenger non inizializzato'})
+    
+    state = messenger.outbound.get(handle)
+    if not state:
+        return jsonify({'success': False, 'error': 'Handle sconosciuto'})
+    return jsonify({'success': True, **state})
 
 @app.route('/api/telemetry/request', methods=['POST'])
 def request_telemetry():
@@ -602,6 +817,39 @@ def request_telemetry():
     result = messenger.request_telemetry(dest)
     return jsonify(result)
 
+@app.route('/api/telemetry/poll', methods=['GET', 'POST'])
+def telemetry_poll():
+    """Richieste di telemetria periodiche: GET elenca, POST {destination, interval} (0 = ferma)"""
+    if not messenger:
+        return jsonify({'success': False, 'error': 'Messenger non inizializzato'})
+    
+    if request.method == 'GET':
+        return jsonify({'success': True, 'polls': messenger.list_telemetry_polls()})
+    
+    data = request.json or {}
+    dest = data.get('destination')
+    if not dest:
+        return jsonify({'success': False, 'error': 'Destinazione mancante'})
+    try:
+        interval = int(data.get('interval', 0))
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'Intervallo non valido'})
+    
+    messenger.set_telemetry_poll(dest, interval)
+    return jsonify({'success': True, 'poll': messenger.scheduler.get(f"telemetry:{dest}")})
+
+@app.route('/api/rangetests')
+def get_rangetests():
+    """Rangetest attivi (punti salvati, giri eseguiti e saltati) e stato dello scheduler"""
+    if not messenger:
+        return jsonify({'success': False, 'error': 'Messenger non inizializzato'})
+    
+    return jsonify({
+        'success': True,
+        'rangetests': messenger.list_rangetests(),
+        'scheduler': messenger.scheduler.get_stats()
+    })
+
 # ==================== ENDPOINT PER TELEMETRIA ====================
 
 @app.route('/api/telemetry/config', methods=['GET', 'POST'])
@@ -657,30 +905,94 @@ def handle_telemetry_config():
 
 @app.route('/api/telemetry/history/<peer_hash>')
 def get_telemetry_history(peer_hash):
-    """Restituisce lo storico telemetria per un peer"""
+    """
+    Restituisce lo storico telemetria per un peer (più recenti per primi).
+    Parametri opzionali: range (30m, 24h, 7d, all), limit (default 50),
+    since, until (timestamp unix). Per i grafici usare /api/telemetry/series.
+    """
     if not messenger:
         return jsonify([])
     
-    history = []
-    telemetry_dir = messenger.telemetry_dir
-    
-    if os.path.exists(telemetry_dir):
-        for filename in os.listdir(telemetry_dir):
-            if filename.startswith(peer_hash) and filename.endswith('.json'):
-                filepath = os.path.join(telemetry_dir, filename)
-                try:
-                    with open(filepath, 'r') as f:
-                        data = json.load(f)
-                        ts = int(filename.split('_')[1].split('.')[0])
-                        data['timestamp'] = ts
-                        history.append(data)
-                except Exception as e:
-                    print(f"❌ Errore lettura {filename}: {e}")
-                    continue
+    try:
+        since = request.args.get('since', type=int)
+        window = parse_range(request.args.get('range'))
+        if window and since is None:
+            since = int(time.time()) - window
+        
+        history = messenger.telemetry_store.history(
+            peer_hash,
+            limit=min(request.args.get('limit', 50, type=int), 5000),
+            since=since,
+            until=request.args.get('until', type=int)
+        )
+    except Exception as e:
+        print(f"❌ Errore lettura telemetria: {e}")
+        return jsonify([])
     
-    history.sort(key=lambda x: x['timestamp'], reverse=True)
     print(f"📊 Caricati {len(history)} record di telemetria per {peer_hash[:8]}...")
-    return jsonify(history[:50])
+    return jsonify(history)
+
+@app.route('/api/telemetry/series/<peer_hash>')
+def get_telemetry_series(peer_hash):
+    """
+    Serie ridotte per i grafici.
+    Parametri: range (default 24h), points (default 300), method (bucket|lttb),
+    sensors (es. battery,temperature,rssi), track (1/0)
+    """
+    if not messenger:
+        return jsonify({'success': False, 'error': 'Messenger non inizializzato'})
+    
+    try:
+        sensors = request.args.get('sensors')
+        sensors = [x.strip() for x in sensors.split(',') if x.strip()] if sensors else list(DEFAULT_SENSORS)
+        
+        result = build_series(
+            messenger.telemetry_store,
+            peer_hash,
+            range_value=request.args.get('range', '24h'),
+            points=request.args.get('points', DEFAULT_POINTS, type=int),
+            sensors=sensors,
+            method=request.args.get('method', 'bucket'),
+            track=request.args.get('track', '1') != '0'
+        )
+        return jsonify({'success': True, **result})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        print(f"❌ Errore serie telemetria: {e}")
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/track/<peer_hash>')
+def export_track(peer_hash):
+    """
+    Traccia di un peer in streaming (memoria costante anche per più giorni).
+    Parametri: format (gpx|kml|geojson), source (telemetry|rangetest),
+    range (es. 24h, 7d, all) oppure since/until (timestamp unix)
+    """
+    if not messenger:
+        return jsonify({'success': False, 'error': 'Messenger non inizializzato'})
+    
+    try:
+        since = request.args.get('since', type=int)
+        window = parse_range(request.args.get('range'))
+        if window and since is None:
+            since = int(time.time()) - window
+        
+        stream, mimetype, filename = messenger.export_track(
+            peer_hash,
+            fmt=request.args.get('format', 'gpx').lower(),
+            since=since,
+            until=request.args.get('until', type=int),
+            source=request.args.get('source', 'telemetry')
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    return Response(
+        stream,
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
 
 @app.route('/api/telemetry/test', methods=['POST'])
 def test_telemetry():
@@ -704,8 +1016,7 @@ def get_last_telemetry(identity_hash):
         return jsonify({'error': 'Messenger non inizializzato'}), 404
     
     try:
-        with messenger.db_lock:
-            conn = sqlite3.connect(messenger.peers_db, timeout=10)
+        with messenger.db.read() as conn:
             c = conn.cursor()
             
             c.execute('''
@@ -721,7 +1032,6 @@ def get_last_telemetry(identity_hash):
             ''', (identity_hash,))
             
             row = c.fetchone()
-            conn.close()
         
         if not row or not row[16]:
             return jsonify({'error': 'Nessuna telemetria disponibile'}), 404
@@ -760,129 +1070,142 @@ def get_last_telemetry(identity_hash):
 
 @app.route('/api/raw/history')
 def get_raw_history_all():
-    """Restituisce lo storico dei pacchetti raw (globale)"""
+    """Restituisce lo storico dei pacchetti raw (globale, con anteprima)"""
     if not messenger:
         return jsonify([])
     
-    history = []
     try:
-        raw_files = sorted(os.listdir(messenger.raw_dir), reverse=True)[:50]
-        for filename in raw_files:
-            if filename.endswith('.raw'):
-                filepath = os.path.join(messenger.raw_dir, filename)
-                with open(filepath, 'rb') as f:
-                    raw_data = f.read()
-                
-                json_file = filename.replace('.raw', '.json')
-                json_path = os.path.join(messenger.raw_dir, json_file)
-                metadata = {}
-                if os.path.exists(json_path):
-                    with open(json_path, 'r') as jf:
-                        metadata = json.load(jf)
-                
-                history.append({
-                    'hash': filename.replace('.raw', ''),
-                    'time': metadata.get('time', os.path.getmtime(filepath)),
-                    'from': metadata.get('from', '?'),
-                    'to': metadata.get('to', '?'),
-                    'method': metadata.get('method', '?'),
-                    'packed_size': len(raw_data),
-                    'raw_hex': raw_data.hex()[:128] + '...' if len(raw_data) > 64 else raw_data.hex(),
-                    'raw_ascii': ''.join(chr(b) if 32 <= b < 127 else '.' for b in raw_data[:64])
-                })
+        limit = min(request.args.get('limit', 50, type=int), 500)
+        return jsonify(messenger.raw_store.recent(limit=limit))
     except Exception as e:
         print(f"❌ Errore caricamento storico raw: {e}")
-    
-    return jsonify(history)
+        return jsonify([])
 
 @app.route('/api/raw/history/<dest_hash>')
 def get_raw_history(dest_hash):
-    """Restituisce lo storico dei raw per una conversazione"""
+    """Restituisce lo storico dei raw per una conversazione (con anteprima)"""
     if not messenger:
         return jsonify([])
     
     try:
-        conn = sqlite3.connect(messenger.peers_db)
-        c = conn.cursor()
-        
-        c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='messages'")
-        if not c.fetchone():
-            conn.close()
-            return jsonify([])
-        
-        c.execute('''
-            SELECT hash, raw_hex, raw_ascii, timestamp, source_hash, method, packed_size
-            FROM messages 
-            WHERE (source_hash = ? OR destination_hash = ?) 
-              AND raw_hex IS NOT NULL
-            ORDER BY timestamp DESC
-            LIMIT 50
-        ''', (dest_hash, dest_hash))
-        
-        rows = c.fetchall()
-        conn.close()
-        
-        raw_messages = []
-        for row in rows:
-            raw_messages.append({
-                'hash': row[0],
-                'raw_hex': row[1],
-                'raw_ascii': row[2],
-                'time': row[3],
-                'from': row[4],
-                'method': row[5],
-                'packed_size': row[6]
-            })
-        return jsonify(raw_messages)
+        limit = min(request.args.get('limit', 50, type=int), 500)
+        return jsonify(messenger.raw_store.recent(limit=limit, peer_hash=dest_hash))
     except Exception as e:
         print(f"❌ Errore get_raw_history: {e}")
         return jsonify([])
 
 @app.route('/api/raw/<hash>')
 def get_raw(hash):
-    """Restituisce il raw di un messaggio"""
+    """
+    Restituisce il raw di un messaggio, a pagine per i pacchetti grandi.
+    Parametri: offset (byte), length (byte, default 4096)
+    """
     if not messenger:
         return jsonify({'error': 'Messenger non inizializzato'})
     
-    if hasattr(messenger, 'received_raw') and hash in messenger.received_raw:
-        data = messenger.received_raw[hash]
-        return jsonify({
-            'hex': data['hex'],
-            'ascii': data['ascii'],
-            'source': 'memory'
-        })
+    try:
+        view = messenger.raw_store.view(
+            hash,
+            offset=request.args.get('offset', 0, type=int),
+            length=request.args.get('length', RAW_PAGE_BYTES, type=int)
+        )
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
     
-    hex_path = os.path.join(messenger.raw_dir, f"{hash}.hex")
-    raw_path = os.path.join(messenger.raw_dir, f"{hash}.raw")
+    if not view:
+        return jsonify({'error': 'Messaggio non trovato'}), 404
     
-    if os.path.exists(hex_path):
-        with open(hex_path, 'r') as f:
-            hex_data = f.read().strip()
-        
-        if os.path.exists(raw_path):
-            with open(raw_path, 'rb') as f:
-                raw = f.read()
-            ascii_data = ''.join(chr(b) if 32 <= b < 127 else '.' for b in raw)
-        else:
-            ascii_data = None
-        
-        return jsonify({
-            'hex': hex_data,
-            'ascii': ascii_data,
-            'source': 'disk'
-        })
-    elif os.path.exists(raw_path):
-        with open(raw_path, 'rb') as f:
-            raw = f.read()
-        hex_data = raw.hex()
-        ascii_data = ''.join(chr(b) if 32 <= b < 127 else '.' for b in raw)
-        return jsonify({
-            'hex': hex_data,
-            'ascii': ascii_data,
-            'source': 'disk'
-        })
-    
-    return jsonify({'error': 'Messaggio non trovato'}), 404
+    return jsonify(view)
+
+@app.route('/api/conversations')
+def get_conversations():
+    """
+    Lista delle chat dalla più recente: ultimo messaggio, totali e non letti.
+    Parametri: limit, unread=1 (solo chat con messaggi non letti)
+    """
+    if not messenger:
+        return jsonify([])
+
+    try:
+        return jsonify(messenger.conversations.list(
+            limit=request.args.get('limit', type=int),
+            unread_only=request.args.get('unread') == '1'
+        ))
+    except Exception as e:
+        print(f"❌ Errore lista conversazioni: {e}")
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/conversations/<peer_hash>/read', methods=['POST'])
+def mark_conversation_read(peer_hash):
+    """Segna come letta la chat (fino a 'until' se indicato nel body JSON)"""
+    if not messenger:
+        return jsonify({'success': False, 'error': 'Messenger non inizializzato'})
+
+    try:
+        data = request.get_json(silent=True) or {}
+        conversation = messenger.conversations.mark_read(peer_hash, data.get('until'))
+        if not conversation:
+            return jsonify({'success': False, 'error': 'Conversazione non trovata'}), 404
+        return jsonify({'success': True, 'conversation': conversation})
+    except (TypeError, ValueError) as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/archive/stats')
+def get_archive_stats():
+    """Messaggi e segmenti dell'archivio"""
+    if not messenger:
+        return jsonify({'error': 'Messenger non inizializzato'})
+    return jsonify(messenger.archive.get_stats())
+
+@app.route('/api/archive/run', methods=['POST'])
+def run_archive():
+    """Avvia subito l'archiviazione (body JSON opzionale: days)"""
+    if not messenger:
+        return jsonify({'success': False, 'error': 'Messenger non inizializzato'})
+
+    data = request.get_json(silent=True) or {}
+    days = data.get('days')
+    if days is not None and (not isinstance(days, (int, float)) or days <= 0):
+        return jsonify({'success': False, 'error': 'days deve essere un numero positivo'}), 400
+
+    archived = messenger.run_archive(days)
+    return jsonify({'success': True, 'archived': archived, 'stats': messenger.archive.get_stats()})
+
+@app.route('/api/search')
+def search_messages():
+    """
+    Ricerca full-text nei messaggi.
+    Parametri: q (testo), peer (hash conversazione), limit, cursor, order=rank|recent
+    I messaggi spostati nell'archivio escono dall'indice e non compaiono nei
+    risultati (includes_archive: False nella risposta).
+    """
+    if not messenger:
+        return jsonify({'success': False, 'error': 'Messenger non inizializzato'})
+
+    try:
+        results, next_cursor = messenger.search.search(
+            request.args.get('q', ''),
+            peer=request.args.get('peer'),
+            limit=request.args.get('limit', 20, type=int),
+            cursor=request.args.get('cursor'),
+            order=request.args.get('order', 'rank')
+        )
+        return jsonify({'success': True, 'results': results, 'next_cursor': next_cursor,
+                        'includes_archive': False})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        print(f"❌ Errore ricerca: {e}")
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/raw/stats')
+def get_raw_stats():
+    """Statistiche dell'archivio raw"""
+    if not messenger:
+        return jsonify({'error': 'Messenger non inizializzato'})
+    return jsonify(messenger.raw_store.get_stats())
 
 @app.route('/download/<filename>')
 def download_file(filename):
@@ -918,22 +1241,50 @@ def handle_config():
                     except:
                         pass
             
+            if 'sync_interval' in data:
+                messenger.sync.start_auto(int(data['sync_interval'] or 0))
+            
             return jsonify({'success': True})
         except Exception as e:
             return jsonify({'success': False, 'error': str(e)})
 
 @app.route('/api/sync', methods=['POST'])
 def sync_messages():
-    """Sincronizza messaggi dal propagation node"""
+    """Avvia la sync dal propagation node; l'avanzamento arriva via 'sync_progress'"""
     if not messenger:
         return jsonify({'success': False, 'error': 'Messenger non inizializzato'})
     
-    result = messenger.sync_messages()
+    data = request.get_json(silent=True) or {}
+    return jsonify(messenger.sync_messages(data.get('limit', 10)))
+
+@app.route('/api/sync/status')
+def sync_status():
+    """Sync in corso (o ultima) e stato della sync automatica"""
+    if not messenger:
+        return jsonify({'success': False, 'error': 'Messenger non inizializzato'})
     
-    if result['success']:
-        socketio.emit('sync_complete', {'new': result['new']})
+    return jsonify({'success': True, **messenger.sync.get_status()})
+
+@app.route('/api/sync/<job_id>')
+def sync_job(job_id):
+    """Stato di una sync"""
+    if not messenger:
+        return jsonify({'success': False, 'error': 'Messenger non inizializzato'})
     
-    return jsonify(result)
+    job = messenger.sync.get(job_id)
+    if not job:
+        return jsonify({'success': False, 'error': 'Sync non trovata'})
+    return jsonify({'success': True, **job})
+
+@app.route('/api/sync/cancel', methods=['POST'])
+def cancel_sync():
+    """Annulla la sync in corso"""
+    if not messenger:
+        return jsonify({'success': False, 'error': 'Messenger non inizializzato'})
+    
+    if not messenger.sync.cancel():
+        return jsonify({'success': False, 'error': 'Nessuna sync in corso'})
+    return jsonify({'success': True})
 
 @app.route('/api/announce', methods=['POST'])
 def send_announce():
@@ -950,7 +1301,8 @@ def import_peers():
     if not messenger:
         return jsonify({'success': False, 'error': 'Messenger non inizializzato'})
     
-    count = messenger.import_peers_from_cache()
+    data = request.get_json(silent=True) or {}
+    count = messenger.import_peers_from_cache(full=bool(data.get('full')))
     return jsonify({'success': True, 'count': count})
 
 @app.route('/api/shutdown', methods=['POST'])
@@ -1005,23 +1357,19 @@ def cleanup_temp_files():
 
 @app.route('/api/attachment/<hash>')
 def get_attachment(hash):
-    """Recupera un attachment dal database per visualizzazione/download"""
+    """
+    Serve un attachment dal blob store (file su disco, con Range ed ETag).
+    ?index=N sceglie l'allegato se il messaggio ne ha più di uno.
+    """
     if not messenger:
         return jsonify({'error': 'Messenger non inizializzato'}), 404
     
     try:
-        with messenger.db_lock:
-            conn = sqlite3.connect(messenger.peers_db, timeout=10)
-            c = conn.cursor()
-            
-            c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='messages'")
-            if not c.fetchone():
-                conn.close()
-                return jsonify({'error': 'Tabella non trovata'}), 404
-            
-            c.execute('SELECT attachments FROM messages WHERE hash = ?', (hash,))
-            row = c.fetchone()
-            conn.close()
+        row = messenger.db.query_one('SELECT attachments FROM messages WHERE hash = ?', (hash,))
+        if not row:
+            # Messaggio archiviato: i byte degli allegati restano nel blob store
+            record = messenger.archive.get(hash)
+            row = (record['attachments'],) if record else None
         
         if not row or not row[0]:
             return jsonify({'error': 'Attachment non trovato'}), 404
@@ -1031,68 +1379,38 @@ def get_attachment(hash):
         if not attachments:
             return jsonify({'error': 'Nessun attachment'}), 404
         
-        att = attachments[0]
+        index = request.args.get('index', 0, type=int)
+        if index < 0 or index >= len(attachments):
+            return jsonify({'error': 'Indice attachment non valido'}), 404
         
-        file_bytes = None
-        filename = None
-        mime_type = None
-        is_inline = False
+        att_type, meta = describe_attachment(attachments[index])
+        if meta is None:
+            return jsonify({'error': 'Formato attachment non supportato'}), 400
         
-        if isinstance(att, dict):
-            if 'bytes' in att:
-                file_bytes = bytes.fromhex(att['bytes'])
-                
-                if att.get('type') == 'image':
-                    img_format = att.get('format', 'jpg')
-                    mime_type = f"image/{img_format}"
-                    filename = f"image.{img_format}"
-                    is_inline = True
-                
-                elif att.get('type') == 'audio':
-                    mode = att.get('mode', 16)
-                    if mode < 16:
-                        mime_type = "application/octet-stream"
-                        filename = f"audio_c2_{mode}.c2"
-                    else:
-                        mime_type = "audio/ogg"
-                        filename = "audio.opus"
-                        is_inline = True
-                
-                elif att.get('type') == 'file':
-                    mime_type = "application/octet-stream"
-                    filename = att.get('name', 'file.bin')
+        mime_type, filename, is_inline = attachment_media(att_type, meta)
+        if not mime_type:
+            return jsonify({'error': 'Formato attachment non supportato'}), 400
         
-        elif isinstance(att, list) and len(att) == 2:
-            att_type = att[0]
-            att_data = att[1]
-            
-            if 'bytes' in att_data:
-                file_bytes = bytes.fromhex(att_data['bytes'])
-                
-                if att_type == 'image':
-                    img_format = att_data.get('format', 'jpg')
-                    mime_type = f"image/{img_format}"
-                    filename = f"image.{img_format}"
-                    is_inline = True
-                
-                elif att_type == 'audio':
-                    mode = att_data.get('mode', 16)
-                    if mode < 16:
-                        mime_type = "application/octet-stream"
-                        filename = f"audio_c2_{mode}.c2"
-                    else:
-                        mime_type = "audio/ogg"
-                        filename = "audio.opus"
-                        is_inline = True
-                
-                elif att_type == 'file':
-                    mime_type = "application/octet-stream"
-                    filename = att_data.get('name', 'file.bin')
+        sha256 = meta.get('sha256')
+        if sha256 and messenger.blob_store.exists(sha256):
+            # Il contenuto non cambia mai: lo sha256 è un ETag perfetto
+            response = send_file(
+                messenger.blob_store.path(sha256),
+                mimetype=mime_type,
+                as_attachment=not is_inline,
+                download_name=filename,
+                conditional=True,
+                etag=sha256,
+                max_age=31536000
+            )
+            response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+            return response
         
-        if not file_bytes:
-            return jsonify({'error': 'Formato attachment non supportato'}), 400
+        # Messaggio non ancora migrato: bytes ancora in hex nel database
+        if 'bytes' not in meta:
+            return jsonify({'error': 'Attachment non trovato'}), 404
         
-        from flask import Response
+        file_bytes = bytes.fromhex(meta['bytes'])
         disposition = "inline" if is_inline else "attachment"
         return Response(
             file_bytes,
@@ -1119,20 +1437,11 @@ def get_favorites():
     
     favorites = []
     try:
-        with messenger.db_lock:
-            conn = sqlite3.connect(messenger.peers_db, timeout=10)
+        with messenger.db.read() as conn:
             c = conn.cursor()
-            
-            c.execute('''
-                CREATE TABLE IF NOT EXISTS favorites (
-                    peer_hash TEXT PRIMARY KEY,
-                    added_at REAL
-                )
-            ''')
-            
+            # La tabella favorites è creata da Messenger._init_peers_db
             c.execute('SELECT peer_hash FROM favorites ORDER BY added_at DESC')
             rows = c.fetchall()
-            conn.close()
         
         for row in rows:
             favorites.append(row[0])
@@ -1155,8 +1464,7 @@ def add_favorite():
         return jsonify({'success': False, 'error': 'peer_hash mancante'})
     
     try:
-        with messenger.db_lock:
-            conn = sqlite3.connect(messenger.peers_db, timeout=10)
+        with messenger.db.write() as conn:
             c = conn.cursor()
             
             c.execute('''
@@ -1169,8 +1477,6 @@ def add_favorite():
             c.execute('INSERT OR REPLACE INTO favorites (peer_hash, added_at) VALUES (?, ?)',
                      (peer_hash, time.time()))
             
-            conn.commit()
-            conn.close()
         
         return jsonify({'success': True})
     except Exception as e:
@@ -1189,12 +1495,9 @@ def remove_favorite():
         return jsonify({'success': False, 'error': 'peer_hash mancante'})
     
     try:
-        with messenger.db_lock:
-            conn = sqlite3.connect(messenger.peers_db, timeout=10)
+        with messenger.db.write() as conn:
             c = conn.cursor()
             c.execute('DELETE FROM favorites WHERE peer_hash = ?', (peer_hash,))
-            conn.commit()
-            conn.close()
         
         return jsonify({'success': True})
     except Exception as e:
@@ -1215,8 +1518,7 @@ def update_peer():
         return jsonify({'success': False, 'error': 'identity_hash mancante'})
     
     try:
-        with messenger.db_lock:
-            conn = sqlite3.connect(messenger.peers_db, timeout=10)
+        with messenger.db.write() as conn:
             c = conn.cursor()
             
             updates = []
@@ -1256,9 +1558,7 @@ def update_peer():
                     WHERE identity_hash = ? AND aspect = 'lxmf.delivery'
                 ''', values)
                 
-                conn.commit()
             
-            conn.close()
         
         return jsonify({'success': True})
         
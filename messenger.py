@@ -9,9 +9,7 @@ import json
 import traceback
 import threading
 import struct
-import sqlite3
 import uuid
-import re
 import wave
 import numpy as np
 import tempfile
@@ -19,6 +17,23 @@ import subprocess
 from RNS.vendor import umsgpack
 from gpsdclient import GPSDClient
 import core.telemeter as telemeter
+import core.track_export as track_export
+from core.db import PeersDatabase, sort_name, SORT_NAME_SQL
+from core.blob_store import BlobStore, migrate_hex_attachments
+from core.raw_store import RawStore, preview as raw_preview
+from core.telemetry_store import TelemetryStore
+from core.search import MessageSearch
+from core.conversations import ConversationIndex, message_preview
+from core.archive import MessageArchive, DEFAULT_ARCHIVE_DAYS
+from core.announce_queue import AnnounceQueue
+from core.announce_import import AnnounceImporter, display_name_from_hex
+from core.announce_bridge import AnnounceSubscriber
+from core.outbound import OutboundPipeline
+from core.transfers import TransferTracker
+from core.fanout import FanoutEngine
+from core.stamps import StampGenerator
+from core.sync import PropagationSync
+from core.scheduler import PeriodicScheduler
 import audio_codec
 from telemetry_provider import TelemetryProvider, setup_telemetry_handlers
 
@@ -213,6 +228,48 @@ def get_telemetry_sensor_name(sensor_id):
     }
     return sensor_names.get(sensor_id, f"Sconosciuto (0x{sensor_id:02x})")
 
+# Intervallo tra due passate di archiviazione (secondi)
+ARCHIVE_INTERVAL = 24 * 3600
+
+# Attesa massima del path negli invii sincroni (risposte ai comandi, rangetest)
+SYNC_PATH_WAIT = 5.0
+
+# Membri di un gruppo: gruppo del peer (destinations.group_name) o peer_groups
+GROUP_MEMBERS_QUERY = '''
+    SELECT d.destination_hash, COALESCE(i.display_name, d.destination_hash)
+    FROM identities i
+    JOIN destinations d ON d.rowid = (
+        SELECT rowid FROM destinations
+        WHERE identity_hash = i.identity_hash AND aspect = 'lxmf.delivery'
+        ORDER BY last_seen DESC LIMIT 1
+    )
+    WHERE {condition}
+       OR i.identity_hash IN (SELECT identity_hash FROM peer_groups WHERE group_name = ?)
+    ORDER BY i.sort_name
+'''
+
+# Tutti i peer con l'ultima destinazione lxmf.delivery (subquery sull'indice identity/aspect/last_seen)
+PEERS_QUERY = '''
+    SELECT i.identity_hash, i.display_name, d.appearance,
+           d.last_latitude, d.last_longitude, d.last_altitude,
+           d.last_speed, d.last_bearing, d.last_accuracy,
+           d.last_battery, d.last_battery_charging,
+           d.last_temperature, d.last_humidity, d.last_pressure,
+           d.last_light, d.last_uptime, d.last_processor,
+           d.last_ram, d.last_nvm, d.last_telemetry_time,
+           d.trust_level, d.allow_telemetry, d.allow_commands,
+           d.messages_sent, d.messages_received, d.telemetry_count,
+           d.is_favorite, d.group_name, d.notes,
+           d.destination_hash, d.last_seen, d.hops, d.rssi, d.snr, d.q
+    FROM identities i
+    LEFT JOIN destinations d ON d.rowid = (
+        SELECT rowid FROM destinations
+        WHERE identity_hash = i.identity_hash AND aspect = 'lxmf.delivery'
+        ORDER BY last_seen DESC LIMIT 1
+    )
+    ORDER BY i.sort_name, i.identity_hash
+'''
+
 class Messenger:
     def __init__(self, storagepath="~/.rns_manager/storage", configpath="~/.rns_manager/config.json", identity_path=None):
         self.storagepath = os.path.expanduser(storagepath)
@@ -224,6 +281,7 @@ class Messenger:
         self.peers_db = os.path.join(self.storagepath, "peers.db")
         self.announces_cache_db = os.path.expanduser("~/.rns_manager/Cache/announces.db")
         self.rangetest_dir = os.path.join(self.storagepath, "rangetest")
+        self.archive_dir = os.path.join(self.storagepath, "archive")
 
         os.makedirs(self.storagepath, exist_ok=True)
         os.makedirs(self.telemetry_dir, exist_ok=True)
@@ -232,7 +290,36 @@ class Messenger:
         os.makedirs(self.raw_dir, exist_ok=True)
         os.makedirs(self.rangetest_dir, exist_ok=True)
 
-        self.db_lock = threading.Lock()
+        # Una connessione di scrittura + pool di letture WAL (niente lock globale sulle letture)
+        self.db = PeersDatabase(self.peers_db)
+        # Cache di /api/peers: (versione, peers, json)
+        self.peers_cache = None
+        self.peers_cache_lock = threading.Lock()
+        # Allegati salvati una volta sola su file, indirizzati per SHA-256
+        self.blob_store = BlobStore(os.path.join(self.attachments_dir, "blobs"))
+        # Pacchetti raw: una copia compressa in peers.db + LRU in memoria
+        self.raw_store = RawStore(self.db)
+        # Telemetria: tabella indicizzata su (peer, ts) invece di un file per campione
+        self.telemetry_store = TelemetryStore(self.db)
+        # Ricerca full-text (FTS5) sui messaggi
+        self.search = MessageSearch(self.db)
+        # Riepilogo delle chat (ultimo messaggio, non letti) aggiornato a ogni salvataggio
+        self.conversations = ConversationIndex(self.db)
+        # Messaggi vecchi nei segmenti mensili compressi; il raw archiviato resta leggibile
+        self.archive = MessageArchive(self.db, self.archive_dir)
+        self.raw_store.fallback = self.archive.get_raw
+        # Announce accodati e scritti a blocchi da un thread in background
+        self.announce_queue = AnnounceQueue(self.db)
+        # Import incrementale da announces.db (watermark in import_state)
+        self.announce_importer = AnnounceImporter(self.db, self.announces_cache_db)
+        # Announce già risolti dal monitor di rns_manager.py, se è in esecuzione
+        self.announce_bridge = AnnounceSubscriber(self._on_bridge_announce)
+        # Invii in coda per destinazione, path richiesto una volta e atteso con un Future
+        self.outbound = OutboundPipeline()
+        # Invii di gruppo: allegati preparati una volta, consegne distanziate per interfaccia
+        self.fanout = FanoutEngine(self.outbound, self._send_prepared)
+        # Stamp dei messaggi in uscita calcolati in processi separati (un job alla volta, tutti i core)
+        self.stamps = StampGenerator()
         self.config = self._load_config()
         self.rns = get_reticulum()
         
@@ -257,21 +344,35 @@ class Messenger:
         self.delivery_callbacks = {}
         self.failed_callbacks = {}
         self.progress_callbacks = {}
-        self.sent_messages = {}
+        # Avanzamento degli invii: callback delle Resource + un solo scheduler
+        self.transfers = TransferTracker(on_update=self._on_transfer_progress)
 
         self.router.register_delivery_callback(self._on_message)
         self.propagation_node = None
         self._set_propagation_node()
+        # Sync dal propagation node come job in background (più sync automatica)
+        self.sync = PropagationSync(self.router, self.identity, lambda: self.propagation_node)
         self._init_peers_db()
+        self.raw_store.init_schema()
+        self.telemetry_store.init_schema()
+        self.search.init_schema()
+        self.conversations.init_schema()
+        self.archive.init_schema()
+        self.announce_importer.init_schema()
+        self.announce_importer.start(self.config.get('announce_import_interval', 0))
+        self.announce_bridge.start()
+        self.sync.start_auto(self.config.get('sync_interval', 0))
+        threading.Thread(target=self._storage_maintenance, daemon=True).start()
 
         self.announce_handler = AnnounceHandler(self)
         RNS.Transport.register_announce_handler(self.announce_handler)
-        self.received_raw = {}
         
         self.running = True
-        self.progress_thread = threading.Thread(target=self._monitor_progress, daemon=True)
-        self.progress_thread.start()
-        self.active_rangetests = {}  # {peer_hash: {'interval': secondi, 'timer': threading.Timer, 'last_run': timestamp, 'data_points': []}}
+        # Rangetest e polling telemetria: job periodici su un solo scheduler
+        self.scheduler = PeriodicScheduler()
+        self.active_rangetests = {}  # {peer_hash: {'interval': secondi, 'start_time': timestamp, 'file': jsonl, 'points': n}}
+        for peer_hash, interval in self.config.get('telemetry_polls', {}).items():
+            self._schedule_telemetry_poll(peer_hash, interval)
 
         # 🔴 Inizializza telemetria provider con il config principale
         try:
@@ -287,9 +388,9 @@ class Messenger:
         """Pulisce le risorse Reticulum prima di distruggere l'istanza"""
         self.running = False
         try:
-            # Aspetta che il thread di progresso finisca
-            if hasattr(self, 'progress_thread') and self.progress_thread.is_alive():
-                self.progress_thread.join(timeout=1.0)
+            # Ferma lo scheduler dei trasferimenti
+            if hasattr(self, 'transfers'):
+                self.transfers.stop()
             
             # Deregistra la destinazione principale - CORREZIONE!
             if hasattr(self, 'dest') and self.dest:
@@ -311,6 +412,24 @@ class Messenger:
                 except:
                     pass
             
+            # Scrive gli announce ancora in coda
+            if hasattr(self, 'announce_importer'):
+                self.announce_importer.stop()
+            if hasattr(self, 'announce_bridge'):
+                self.announce_bridge.stop()
+            if hasattr(self, 'announce_queue'):
+                self.announce_queue.stop()
+            if hasattr(self, 'outbound'):
+                self.outbound.stop()
+            if hasattr(self, 'fanout'):
+                self.fanout.stop()
+            if hasattr(self, 'stamps'):
+                self.stamps.stop()
+            if hasattr(self, 'sync'):
+                self.sync.stop()
+            if hasattr(self, 'scheduler'):
+                self.scheduler.stop()
+            
             # Ferma il router
             if hasattr(self, 'router'):
                 # Pulisci riferimenti
@@ -327,8 +446,7 @@ class Messenger:
             print(f"⚠️ Errore durante cleanup: {e}")
 
     def _init_peers_db(self):
-        with self.db_lock:
-            conn = sqlite3.connect(self.peers_db, timeout=10)
+        with self.db.write() as conn:
             c = conn.cursor()
             
             # ============================================
@@ -500,9 +618,67 @@ class Messenger:
             # 🔴 NUOVI INDICI
             c.execute('CREATE INDEX IF NOT EXISTS idx_peer_groups_identity ON peer_groups(identity_hash)')
             c.execute('CREATE INDEX IF NOT EXISTS idx_peer_groups_group ON peer_groups(group_name)')
-            
-            conn.commit()
-            conn.close()
+
+            # ============================================
+            # VISTA PEER: chiave di ordinamento + contatore modifiche
+            # ============================================
+            if not self.db.column_exists(conn, 'identities', 'sort_name'):
+                c.execute('ALTER TABLE identities ADD COLUMN sort_name TEXT')
+                c.execute('UPDATE identities SET sort_name = sort_name(display_name)')
+            c.execute('CREATE INDEX IF NOT EXISTS idx_identities_sort ON identities(sort_name)')
+            # sort_name lo calcolano le scritture di Messenger (sort_name() di core/db.py).
+            # I trigger sono solo un ripiego in SQL puro per chi scrive peers.db senza
+            # passare da qui (rns_lxmf.py, sqlite3): niente funzioni Python, che su
+            # quelle connessioni non esistono. Le versioni precedenti le usavano.
+            c.execute('DROP TRIGGER IF EXISTS trg_identities_sort_insert')
+            c.execute('DROP TRIGGER IF EXISTS trg_identities_sort_update')
+            c.execute(f'''
+                CREATE TRIGGER trg_identities_sort_insert AFTER INSERT ON identities
+                WHEN NEW.sort_name IS NULL
+                BEGIN
+                    UPDATE identities SET sort_name = {SORT_NAME_SQL}
+                    WHERE identity_hash = NEW.identity_hash;
+                END
+            ''')
+            c.execute(f'''
+                CREATE TRIGGER trg_identities_sort_update AFTER UPDATE OF display_name ON identities
+                WHEN NEW.display_name IS NOT OLD.display_name AND NEW.sort_name IS OLD.sort_name
+                BEGIN
+                    UPDATE identities SET sort_name = {SORT_NAME_SQL}
+                    WHERE identity_hash = NEW.identity_hash;
+                END
+            ''')
+
+            # ============================================
+            # CONVERSAZIONI: hash dell'altro peer + indice (conversazione, tempo)
+            # ============================================
+            if not self.db.column_exists(conn, 'messages', 'conversation_hash'):
+                c.execute('ALTER TABLE messages ADD COLUMN conversation_hash TEXT')
+                c.execute('''
+                    UPDATE messages
+                    SET conversation_hash = CASE WHEN incoming = 1 THEN source_hash ELSE destination_hash END
+                ''')
+            c.execute('CREATE INDEX IF NOT EXISTS idx_messages_conversation ON messages(conversation_hash, timestamp)')
+
+            # Ultima destinazione lxmf.delivery di ogni identità con una sola ricerca sull'indice
+            c.execute('CREATE INDEX IF NOT EXISTS idx_dest_identity_aspect_seen ON destinations(identity_hash, aspect, last_seen)')
+
+            # Ogni scrittura su identities/destinations incrementa la versione dei peer
+            c.execute('''
+                CREATE TABLE IF NOT EXISTS change_counters (
+                    name TEXT PRIMARY KEY,
+                    version INTEGER DEFAULT 0
+                )
+            ''')
+            c.execute("INSERT OR IGNORE INTO change_counters (name, version) VALUES ('peers', 0)")
+            for table in ('identities', 'destinations'):
+                for event in ('INSERT', 'UPDATE', 'DELETE'):
+                    c.execute(f'''
+                        CREATE TRIGGER IF NOT EXISTS trg_{table}_{event.lower()}_version AFTER {event} ON {table}
+                        BEGIN
+                            UPDATE change_counters SET version = version + 1 WHERE name = 'peers';
+                        END
+                    ''')
 
     def _load_config(self):
         default = {
@@ -527,7 +703,15 @@ class Messenger:
             },
             "gpsd_host": "localhost",
             "gpsd_port": 2947,
-            "appearance": ["antenna", "4c9aff", "1a1f2e"]
+            "appearance": ["antenna", "4c9aff", "1a1f2e"],
+            # Messaggi più vecchi di N giorni spostati nell'archivio (0 = mai)
+            "archive_after_days": DEFAULT_ARCHIVE_DAYS,
+            # Import continuo da announces.db ogni N secondi (0 = solo manuale)
+            "announce_import_interval": 0,
+            # Sync automatica dal propagation node ogni N secondi (0 = solo manuale)
+            "sync_interval": 0,
+            # Richieste di telemetria periodiche {destination_hash: secondi}
+            "telemetry_polls": {}
         }
         if os.path.exists(self.configpath):
             with open(self.configpath, 'r') as f:
@@ -580,16 +764,65 @@ class Messenger:
                 f.write(default_name)
             return default_name
 
+    def _storage_maintenance(self):
+        """Thread di manutenzione: migrazioni all'avvio, poi archiviazione periodica"""
+        self._migrate_legacy_storage()
+        while True:
+            self.run_archive()
+            time.sleep(ARCHIVE_INTERVAL)
+
+    def run_archive(self, days=None):
+        """Archivia i messaggi più vecchi di `days` giorni (default: archive_after_days)"""
+        if days is None:
+            days = self.config.get('archive_after_days', DEFAULT_ARCHIVE_DAYS)
+        try:
+            archived = self.archive.archive_older_than(days)
+            if archived:
+                print(f"🗄️ Messaggi archiviati: {archived} (più vecchi di {days} giorni)")
+            return archived
+        except Exception as e:
+            print(f"⚠️ Errore archiviazione messaggi: {e}")
+            traceback.print_exc()
+            return 0
+
+    def _migrate_legacy_storage(self):
+        """Sposta allegati hex e copie raw delle versioni precedenti negli archivi unici"""
+        try:
+            migrated = migrate_hex_attachments(self.db, self.blob_store)
+            if migrated:
+                print(f"📦 Allegati migrati nel blob store: {migrated} messaggi")
+        except Exception as e:
+            print(f"⚠️ Errore migrazione allegati: {e}")
+
+        try:
+            imported = self.raw_store.migrate_legacy(self.raw_dir)
+            if imported:
+                print(f"📦 Pacchetti raw migrati: {imported}")
+        except Exception as e:
+            print(f"⚠️ Errore migrazione raw: {e}")
+
+        try:
+            imported = self.telemetry_store.import_files(self.telemetry_dir)
+            if imported:
+                print(f"📊 Campioni di telemetria importati: {imported}")
+        except Exception as e:
+            print(f"⚠️ Errore import telemetria: {e}")
+
+        try:
+            indexed = self.search.backfill()
+            if indexed:
+                print(f"🔎 Messaggi indicizzati per la ricerca: {indexed}")
+        except Exception as e:
+            print(f"⚠️ Errore indicizzazione ricerca: {e}")
+
     def _save_attachment(self, msg_hash, typ, data, filename_hint=None):
         """🔴 DEPRECATO - Non usiamo più file su disco"""
         return None
 
     def _save_telemetry(self, source_hash, telemetry_obj, msg_data=None):
-        """Salva la telemetria ricevuta in formato JSON"""
+        """Salva la telemetria ricevuta (dati leggibili + binario originale) nel TelemetryStore"""
         try:
             ts = int(time.time())
-            json_filename = f"{source_hash}_{ts}.json"
-            json_path = os.path.join(self.telemetry_dir, json_filename)
             
             # Ottieni i dati in formato leggibile
             data = telemetry_obj.read_all()
@@ -674,18 +907,11 @@ class Messenger:
                 except Exception as e:
                     print(f"⚠️ Errore nel calcolo hops: {e}")
             
-            with open(json_path, 'w') as f:
-                json.dump(formatted_data, f, indent=2)
-            
-            # Salva anche il binario originale
-            bin_filename = f"{source_hash}_{ts}.bin"
-            bin_path = os.path.join(self.telemetry_dir, bin_filename)
+            # Salva anche il binario originale (serve per rispondere alle richieste dei collector)
             packed = telemetry_obj.packed()
-            if packed and len(packed) > 0:
-                with open(bin_path, 'wb') as f:
-                    f.write(packed)
+            self.telemetry_store.add(source_hash, ts, formatted_data, packed)
             
-            print(f"📊 Telemetria salvata: {json_filename}")
+            print(f"📊 Telemetria salvata: {source_hash[:8]} @ {ts}")
             if msg_data:
                 radio_info = []
                 if hasattr(msg_data, 'rssi') and msg_data.rssi:
@@ -704,7 +930,7 @@ class Messenger:
                 if radio_info:
                     print(f"📡 Dati radio: {' • '.join(radio_info)}")
             
-            return json_path
+            return ts
             
         except Exception as e:
             RNS.log(f"Errore salvataggio telemetria: {e}", RNS.LOG_ERROR)
@@ -714,8 +940,7 @@ class Messenger:
     def _save_peer_appearance(self, peer_hash, appearance):
         """Salva l'appearance di un peer nel database."""
         try:
-            with self.db_lock:
-                conn = sqlite3.connect(self.peers_db, timeout=10)
+            with self.db.write() as conn:
                 c = conn.cursor()
                 
                 # Crea JSON con l'appearance
@@ -730,8 +955,6 @@ class Messenger:
                     UPDATE destinations SET appearance = ? WHERE destination_hash = ?
                 ''', (appearance_json, peer_hash))
                 
-                conn.commit()
-                conn.close()
                 print(f"💾 Appearance salvata per {peer_hash[:8]}: {appearance[0]}")
         except Exception as e:
             print(f"❌ Errore salvataggio appearance: {e}")
@@ -739,8 +962,7 @@ class Messenger:
     def _update_peer_telemetry(self, source_hash, telemetry_data, msg_data=None):
         """Aggiorna l'ultima telemetria conosciuta di un peer"""
         try:
-            with self.db_lock:
-                conn = sqlite3.connect(self.peers_db, timeout=10)
+            with self.db.write() as conn:
                 c = conn.cursor()
                 
                 # Prepara i dati
@@ -823,44 +1045,19 @@ class Messenger:
                     WHERE destination_hash = ?
                 ''', (source_hash,))
                 
-                conn.commit()
-                conn.close()
-                
                 print(f"📊 Telemetria aggiornata per {source_hash[:8]}")
                 
         except Exception as e:
             print(f"❌ Errore aggiornamento telemetria peer: {e}")
 
     def _get_last_telemetry_timestamp(self, peer_hash):
-        max_ts = 0
-        prefix = f"{peer_hash}_"
-        for fname in os.listdir(self.telemetry_dir):
-            if fname.startswith(prefix) and fname.endswith('.bin'):
-                try:
-                    ts = int(fname.split('_')[1].split('.')[0])
-                    if ts > max_ts:
-                        max_ts = ts
-                except:
-                    continue
-        return max_ts
+        return self.telemetry_store.latest_timestamp(peer_hash)
 
     def _get_telemetry_since(self, peer_hash, timebase):
-        stream = []
-        prefix = f"{peer_hash}_"
-        for fname in os.listdir(self.telemetry_dir):
-            if fname.startswith(prefix) and fname.endswith('.bin'):
-                try:
-                    ts = int(fname.split('_')[1].split('.')[0])
-                    if ts >= timebase:
-                        with open(os.path.join(self.telemetry_dir, fname), 'rb') as f:
-                            stream.append(f.read())
-                except Exception as e:
-                    RNS.log(f"Errore nel caricare telemetria {fname}: {e}", RNS.LOG_ERROR)
-        return stream
+        return self.telemetry_store.packed_since(peer_hash, timebase)
 
     def _update_peer_from_message(self, source_hash, message):
-        with self.db_lock:
-            conn = sqlite3.connect(self.peers_db, timeout=10)
+        with self.db.write() as conn:
             c = conn.cursor()
             now = time.time()
             hops = RNS.Transport.hops_to(bytes.fromhex(source_hash)) if source_hash else None
@@ -918,19 +1115,18 @@ class Messenger:
                     ON CONFLICT(identity_hash) DO UPDATE SET
                         last_seen = excluded.last_seen
                 ''', (identity_hash, now))
-            conn.commit()
-            conn.close()
 
-    def _save_raw(self, msg_hash, packed):
+    def _save_raw(self, msg_hash, packed, message=None, replace=False):
         if not packed:
             return
         try:
-            raw_path = os.path.join(self.raw_dir, f"{msg_hash}.raw")
-            with open(raw_path, 'wb') as f:
-                f.write(packed)
-            hex_path = os.path.join(self.raw_dir, f"{msg_hash}.hex")
-            with open(hex_path, 'w') as f:
-                f.write(packed.hex())
+            source_hash = destination_hash = method = timestamp = None
+            if message is not None:
+                source_hash = message.source_hash.hex() if message.source_hash else None
+                destination_hash = message.destination_hash.hex() if message.destination_hash else None
+                method = {0x01: 'opportunistic', 0x02: 'direct', 0x03: 'propagated'}.get(getattr(message, 'method', None))
+                timestamp = getattr(message, 'timestamp', None)
+            self.raw_store.put(msg_hash, packed, source_hash, destination_hash, method, timestamp, replace=replace)
         except Exception as e:
             RNS.log(f"Errore salvataggio raw per {msg_hash}: {e}", RNS.LOG_ERROR)
 
@@ -1026,90 +1222,114 @@ class Messenger:
     def _save_message(self, message, incoming=True):
         """Salva un messaggio nel database con tutti i dati"""
         try:
-            with self.db_lock:
-                conn = sqlite3.connect(self.peers_db, timeout=10)
-                c = conn.cursor()
-                
-                # Calcola hops
-                hops = None
-                if message.source_hash:
-                    try:
-                        hops = RNS.Transport.hops_to(message.source_hash)
-                    except:
-                        pass
-                
-                # Raw hex/ascii
-                raw_hex = None
-                raw_ascii = None
-                if message.packed:
-                    raw_hex = message.packed.hex()
-                    raw_ascii = ''.join(chr(b) if 32 <= b < 127 else '.' for b in message.packed)
-                
-                # 📦 ESTRAI ATTACHMENTS - FORMATO CORRETTO
-                attachments_list = []
-                if message.fields:
-                    
-                    # IMMAGINI
-                    if FIELD_IMAGE in message.fields:
-                        img = message.fields[FIELD_IMAGE]
-                        if isinstance(img, (list, tuple)) and len(img) == 2:
-                            attachments_list.append({
-                                'type': 'image',
-                                'format': img[0],  # stringa
-                                'size': len(img[1]),
-                                'bytes': img[1].hex()  # SALVA I BYTES!
-                            })
-                            print(f"📸 Salvata immagine: {img[0]}, {len(img[1])} bytes")
-                    
-                    # AUDIO
-                    if FIELD_AUDIO in message.fields:
-                        aud = message.fields[FIELD_AUDIO]
-                        if isinstance(aud, (list, tuple)) and len(aud) == 2:
-                            attachments_list.append({
-                                'type': 'audio',
-                                'mode': aud[0],  # int
-                                'size': len(aud[1]),
-                                'bytes': aud[1].hex()  # SALVA I BYTES!
-                            })
-                            mode_name = "Codec2" if aud[0] < 16 else "Opus"
-                            print(f"🎵 Salvato audio: {mode_name} mode={aud[0]}, {len(aud[1])} bytes")
-                    
-                    # FILE
-                    if FIELD_FILE_ATTACHMENTS in message.fields:
-                        files = message.fields[FIELD_FILE_ATTACHMENTS]
-                        if isinstance(files, list):
-                            for f in files:
-                                if isinstance(f, (list, tuple)) and len(f) == 2:
-                                    attachments_list.append({
-                                        'type': 'file',
-                                        'name': f[0],  # stringa
-                                        'size': len(f[1]),
-                                        'bytes': f[1].hex()  # SALVA I BYTES!
-                                    })
-                                    print(f"📎 Salvato file: {f[0]}, {len(f[1])} bytes")
+            # Prepara tutto fuori dalla transazione: la connessione di scrittura resta libera
+            
+            # Calcola hops
+            hops = None
+            if message.source_hash:
+                try:
+                    hops = RNS.Transport.hops_to(message.source_hash)
+                except:
+                    pass
+            
+            # I byte raw stanno in raw_packets (RawStore), non in messages
+            
+            # 📦 ESTRAI ATTACHMENTS - FORMATO CORRETTO
+            attachments_list = []
+            if message.fields:
                 
-                attachments_json = json.dumps(attachments_list) if attachments_list else None
+                # IMMAGINI
+                if FIELD_IMAGE in message.fields:
+                    img = message.fields[FIELD_IMAGE]
+                    if isinstance(img, (list, tuple)) and len(img) == 2:
+                        attachments_list.append({
+                            'type': 'image',
+                            'format': img[0],  # stringa
+                            'size': len(img[1]),
+                            'sha256': self.blob_store.put(img[1])  # bytes nel blob store
+                        })
+                        print(f"📸 Salvata immagine: {img[0]}, {len(img[1])} bytes")
                 
-                # Determina metodo come stringa
-                method_str = 'direct'
-                if hasattr(message, 'method'):
-                    if message.method == 0x03:
-                        method_str = 'propagated'
-                    elif message.method == 0x01:
-                        method_str = 'opportunistic'
+                # AUDIO
+                if FIELD_AUDIO in message.fields:
+                    aud = message.fields[FIELD_AUDIO]
+                    if isinstance(aud, (list, tuple)) and len(aud) == 2:
+                        attachments_list.append({
+                            'type': 'audio',
+                            'mode': aud[0],  # int
+                            'size': len(aud[1]),
+                            'sha256': self.blob_store.put(aud[1])  # bytes nel blob store
+                        })
+                        mode_name = "Codec2" if aud[0] < 16 else "Opus"
+                        print(f"🎵 Salvato audio: {mode_name} mode={aud[0]}, {len(aud[1])} bytes")
                 
-                # Inserisci nel database
+                # FILE
+                if FIELD_FILE_ATTACHMENTS in message.fields:
+                    files = message.fields[FIELD_FILE_ATTACHMENTS]
+                    if isinstance(files, list):
+                        for f in files:
+                            if isinstance(f, (list, tuple)) and len(f) == 2:
+                                attachments_list.append({
+                                    'type': 'file',
+                                    'name': f[0],  # stringa
+                                    'size': len(f[1]),
+                                    'sha256': self.blob_store.put(f[1])  # bytes nel blob store
+                                })
+                                print(f"📎 Salvato file: {f[0]}, {len(f[1])} bytes")
+            
+            attachments_json = json.dumps(attachments_list) if attachments_list else None
+            
+            # Determina metodo come stringa
+            method_str = 'direct'
+            if hasattr(message, 'method'):
+                if message.method == 0x03:
+                    method_str = 'propagated'
+                elif message.method == 0x01:
+                    method_str = 'opportunistic'
+            
+            source_hash = message.source_hash.hex() if message.source_hash else None
+            destination_hash = message.destination_hash.hex() if message.destination_hash else None
+            conversation_hash = source_hash if incoming else destination_hash
+            msg_hash = message.hash.hex()
+            content = message.content.decode('utf-8') if message.content else ''
+            title = message.title.decode('utf-8') if message.title else ''
+
+            # Inserisci nel database
+            with self.db.write() as conn:
+                c = conn.cursor()
+                is_new = c.execute('SELECT 1 FROM messages WHERE hash = ?', (msg_hash,)).fetchone() is None
+                if is_new and c.execute('SELECT 1 FROM archive_index WHERE hash = ?', (msg_hash,)).fetchone():
+                    # Già archiviato: una copia ricevuta di nuovo (es. dal propagation
+                    # node) non torna in messages né nel riepilogo della chat
+                    print(f"🗄️ Messaggio {msg_hash[:16]} già in archivio, ignorato")
+                    return
                 c.execute('''
-                    INSERT OR REPLACE INTO messages 
-                    (hash, source_hash, destination_hash, content, title, timestamp, 
-                     method, packed_size, rssi, snr, q, hops, incoming, raw_hex, raw_ascii, attachments)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    INSERT INTO messages 
+                    (hash, source_hash, destination_hash, conversation_hash, content, title, timestamp, 
+                     method, packed_size, rssi, snr, q, hops, incoming, attachments)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(hash) DO UPDATE SET
+                        source_hash = excluded.source_hash,
+                        destination_hash = excluded.destination_hash,
+                        conversation_hash = excluded.conversation_hash,
+                        content = excluded.content,
+                        title = excluded.title,
+                        timestamp = excluded.timestamp,
+                        method = excluded.method,
+                        packed_size = excluded.packed_size,
+                        rssi = excluded.rssi,
+                        snr = excluded.snr,
+                        q = excluded.q,
+                        hops = excluded.hops,
+                        incoming = excluded.incoming,
+                        attachments = excluded.attachments
                 ''', (
-                    message.hash.hex(),
-                    message.source_hash.hex() if message.source_hash else None,
-                    message.destination_hash.hex() if message.destination_hash else None,
-                    message.content.decode('utf-8') if message.content else '',
-                    message.title.decode('utf-8') if message.title else '',
+                    msg_hash,
+                    source_hash,
+                    destination_hash,
+                    conversation_hash,
+                    content,
+                    title,
                     message.timestamp,
                     method_str,
                     len(message.packed) if message.packed else 0,
@@ -1118,16 +1338,19 @@ class Messenger:
                     getattr(message, 'q', None),
                     hops,
                     1 if incoming else 0,
-                    raw_hex,
-                    raw_ascii,
                     attachments_json
                 ))
-                
-                conn.commit()
-                conn.close()
-                
-                if attachments_list:
-                    print(f"💾 Messaggio salvato con {len(attachments_list)} attachments")
+
+                # Riepilogo della chat nella stessa transazione (una volta per messaggio)
+                if is_new and conversation_hash:
+                    self.conversations.record_message(
+                        conn, conversation_hash, msg_hash, message.timestamp,
+                        message_preview(content, title, bool(attachments_list)),
+                        incoming, 'delivered' if incoming else 'sent'
+                    )
+            
+            if attachments_list:
+                print(f"💾 Messaggio salvato con {len(attachments_list)} attachments")
                 
         except Exception as e:
             print(f"❌ Errore salvataggio messaggio: {e}")
@@ -1448,9 +1671,9 @@ class Messenger:
         packed_size = 0
         if message.packed:
             packed_size = len(message.packed)
-            raw_hex = message.packed.hex()
-            raw_ascii = ''.join(chr(b) if 32 <= b < 127 else '.' for b in message.packed)
-            self._save_raw(message.hash.hex(), message.packed)
+            # Anteprima per la UI: il pacchetto completo si legge da /api/raw/<hash>
+            raw_hex, raw_ascii = raw_preview(message.packed)
+            self._save_raw(message.hash.hex(), message.packed, message)
 
         self._update_peer_from_message(source_hash_hex, message)
 
@@ -1481,27 +1704,7 @@ class Messenger:
             'fields': message.fields,
         }
 
-        meta_path = os.path.join(self.raw_dir, f"{message.hash.hex()}.json")
-        try:
-            with open(meta_path, 'w') as f:
-                json.dump({
-                    'content': msg_dict['content'],
-                    'title': msg_dict['title'],
-                    'rssi': msg_dict.get('rssi'),
-                    'snr': msg_dict.get('snr'),
-                    'q': msg_dict.get('q'),
-                    'hops': msg_dict.get('hops'),
-                    'time': msg_dict['time'],
-                    'from': msg_dict['from'],
-                    'to': msg_dict['to'],
-                    'method': msg_dict['method'],
-                    'packed_size': msg_dict['packed_size']
-                }, f, indent=2)
-        except Exception as e:
-            pass
-
-        if raw_hex:
-            self.received_raw[msg_dict['hash']] = {'hex': raw_hex, 'ascii': raw_ascii}
+        self.sync.note_message(msg_dict['hash'], msg_dict['from'])
 
         if self.message_callback:
             self.message_callback(msg_dict)
@@ -1651,35 +1854,27 @@ class Messenger:
                     'failed': on_failed
                 }
             )
-            
-            if peer_hash in self.active_rangetests:
-                timer = threading.Timer(interval, run_rangetest)
-                timer.daemon = True
-                timer.start()
-                self.active_rangetests[peer_hash]['timer'] = timer
-        
-        # Avvia il primo ciclo DOPO interval secondi
-        timer = threading.Timer(interval, run_rangetest)
-        timer.daemon = True
-        timer.start()
         
+        # I punti vanno su disco man mano che arrivano (JSONL, una riga per punto)
+        start_time = time.time()
         self.active_rangetests[peer_hash] = {
             'interval': interval,
-            'timer': timer,
-            'last_run': time.time(),
-            'start_time': time.time(),
-            'data_points': []
+            'last_run': start_time,
+            'start_time': start_time,
+            'file': os.path.join(self.rangetest_dir, f"rangetest_{peer_hash[:8]}_{int(start_time)}.jsonl"),
+            'points': 0
         }
         
+        # Primo ciclo DOPO interval secondi
+        self.scheduler.add(f"rangetest:{peer_hash}", interval, run_rangetest,
+                           info={'kind': 'rangetest', 'peer': peer_hash})
+        
         print(f"✅ Rangetest avviato verso {peer_hash[:8]}")
 
     def _stop_rangetest(self, peer_hash):
         """Ferma un rangetest attivo"""
         if peer_hash in self.active_rangetests:
-            # Ferma il timer
-            if 'timer' in self.active_rangetests[peer_hash]:
-                timer = self.active_rangetests[peer_hash]['timer']
-                timer.cancel()
+            self.scheduler.remove(f"rangetest:{peer_hash}")
             
             # Esporta i dati in KML/GPX prima di rimuovere
             self._export_rangetest_data(peer_hash)
@@ -1688,6 +1883,20 @@ class Messenger:
             del self.active_rangetests[peer_hash]
             print(f"📡 Rangetest fermato per {peer_hash[:8]}")
 
+    def list_rangetests(self):
+        """Rangetest attivi con i contatori dello scheduler"""
+        rangetests = []
+        for peer_hash, data in list(self.active_rangetests.items()):
+            rangetests.append({
+                'peer': peer_hash,
+                'interval': data['interval'],
+                'start_time': data['start_time'],
+                'points': data['points'],
+                'file': os.path.basename(data['file']),
+                'schedule': self.scheduler.get(f"rangetest:{peer_hash}")
+            })
+        return rangetests
+
     def _save_rangetest_data(self, peer_hash, telemetry_obj, original_message):
         """Salva un punto dati del rangetest per il peer B"""
         if peer_hash in self.active_rangetests:
@@ -1731,8 +1940,11 @@ class Messenger:
                     'raw_data': data
                 }
                 
-                self.active_rangetests[peer_hash]['data_points'].append(data_point)
-                print(f"📊 Punto B {len(self.active_rangetests[peer_hash]['data_points'])} salvato - Posizione B: {location}")
+                rangetest = self.active_rangetests[peer_hash]
+                with open(rangetest['file'], 'a') as f:
+                    f.write(json.dumps(data_point, default=str) + '\n')
+                rangetest['points'] += 1
+                print(f"📊 Punto B {rangetest['points']} salvato - Posizione B: {location}")
                 
             except Exception as e:
                 print(f"❌ Errore salvataggio dati rangetest: {e}")
@@ -1743,389 +1955,331 @@ class Messenger:
             return
         
         data = self.active_rangetests[peer_hash]
-        points = data['data_points']
-        
-        if not points:
+        if not data['points'] or not os.path.exists(data['file']):
             print(f"⚠️ Nessun dato da esportare per {peer_hash[:8]}")
             return
         
-        # Crea directory per i rangetest
-        rangetest_dir = os.path.join(self.storagepath, "rangetest")
-        os.makedirs(rangetest_dir, exist_ok=True)
-        
         timestamp = int(time.time())
         peer_short = peer_hash[:8]
+        name = f"Rangetest {peer_short} {time.strftime('%Y-%m-%d %H:%M:%S')}"
+        source = track_export.rangetest_source([data['file']])
         
-        # Esporta in GPX
-        self._export_to_gpx(points, peer_short, timestamp, rangetest_dir)
-        
-        # Esporta in KML
-        self._export_to_kml(points, peer_short, timestamp, rangetest_dir)
+        # GPX e KML scritti in streaming dal file JSONL
+        for fmt in ('gpx', 'kml'):
+            filename = os.path.join(self.rangetest_dir, f"rangetest_{peer_short}_{timestamp}.{fmt}")
+            try:
+                track_export.export_file(fmt, source, name, filename)
+                print(f"💾 {fmt.upper()} salvato: {filename}")
+            except Exception as e:
+                print(f"❌ Errore esportazione {fmt.upper()}: {e}")
+                traceback.print_exc()
         
         print(f"📊 Dati rangetest esportati per {peer_short}")
 
-    def _export_to_gpx(self, points, peer_short, timestamp, output_dir):
-        """Esporta in formato GPX"""
-        try:
-            import xml.etree.ElementTree as ET
-            from xml.dom import minidom
-            
-            gpx = ET.Element('gpx', version='1.1', creator='RNS Manager')
-            trk = ET.SubElement(gpx, 'trk')
-            name = ET.SubElement(trk, 'name')
-            name.text = f"Rangetest {peer_short} {time.strftime('%Y-%m-%d %H:%M:%S')}"
-            
-            trkseg = ET.SubElement(trk, 'trkseg')
-            
-            for point in points:
-                # 🔴 CORREZIONE: location è DENTRO point, NON in point['telemetry']!
-                if point.get('location') and point['location'].get('latitude'):
-                    loc = point['location']
-                    trkpt = ET.SubElement(trkseg, 'trkpt', 
-                                          lat=str(loc.get('latitude', 0)), 
-                                          lon=str(loc.get('longitude', 0)))
-                    
-                    ele = ET.SubElement(trkpt, 'ele')
-                    ele.text = str(loc.get('altitude', 0))
-                    
-                    time_elem = ET.SubElement(trkpt, 'time')
-                    time_elem.text = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(point['timestamp']))
-                    
-                    # Aggiungi estensioni con dati radio e batteria
-                    extensions = ET.SubElement(trkpt, 'extensions')
-                    
-                    if point.get('radio'):
-                        radio = point['radio']
-                        if radio.get('rssi') is not None:
-                            rssi_elem = ET.SubElement(extensions, 'rssi')
-                            rssi_elem.text = str(radio['rssi'])
-                        if radio.get('snr') is not None:
-                            snr_elem = ET.SubElement(extensions, 'snr')
-                            snr_elem.text = str(radio['snr'])
-                        if radio.get('q') is not None:
-                            q_elem = ET.SubElement(extensions, 'quality')
-                            q_elem.text = str(radio['q'])
-                        if radio.get('hops') is not None:
-                            hops_elem = ET.SubElement(extensions, 'hops')
-                            hops_elem.text = str(radio['hops'])
-                    
-                    if point.get('battery'):
-                        battery = point['battery']
-                        if battery.get('charge_percent') is not None:
-                            batt_elem = ET.SubElement(extensions, 'battery')
-                            batt_elem.text = str(battery['charge_percent'])
-            
-            xml_str = minidom.parseString(ET.tostring(gpx)).toprettyxml(indent="  ")
-            filename = os.path.join(output_dir, f"rangetest_{peer_short}_{timestamp}.gpx")
-            with open(filename, 'w') as f:
-                f.write(xml_str)
-            print(f"💾 GPX salvato: {filename}")
-            
-        except Exception as e:
-            print(f"❌ Errore esportazione GPX: {e}")
-            traceback.print_exc()
+    def export_track(self, peer_hash, fmt='gpx', since=None, until=None, source='telemetry'):
+        """
+        Traccia di un peer come generatore di blocchi di testo (gpx, kml, geojson).
+        source: 'telemetry' (tabella telemetry) o 'rangetest' (file JSONL dei rangetest).
+        Restituisce (stream, mimetype, nome file).
+        """
+        if fmt not in track_export.FORMATS:
+            raise ValueError(f"Formato non valido: {fmt}")
+        if source == 'rangetest':
+            points = track_export.rangetest_source(
+                track_export.rangetest_files(self.rangetest_dir, peer_hash), since, until)
+        elif source == 'telemetry':
+            points = track_export.telemetry_source(self.telemetry_store, peer_hash, since, until)
+        else:
+            raise ValueError(f"Sorgente non valida: {source}")
+        
+        name = f"{self.get_peer_name(peer_hash)} {time.strftime('%Y-%m-%d %H:%M:%S')}"
+        filename = f"track_{peer_hash[:8]}_{int(time.time())}.{fmt}"
+        return track_export.export_stream(fmt, points, name), track_export.FORMATS[fmt][1], filename
+
+    # ============================================
+    # INVIO (pipeline di uscita)
+    # ============================================
 
-    def _export_to_kml(self, points, peer_short, timestamp, output_dir):
-        """Esporta in formato KML"""
+    def _wait_destination(self, dest_hash, timeout=SYNC_PATH_WAIT):
+        """Destinazione in uscita per gli invii sincroni: attende il path condiviso della pipeline"""
         try:
-            import xml.etree.ElementTree as ET
-            from xml.dom import minidom
-            
-            kml = ET.Element('kml', xmlns='http://www.opengis.net/kml/2.2')
-            document = ET.SubElement(kml, 'Document')
-            
-            name = ET.SubElement(document, 'name')
-            name.text = f"Rangetest {peer_short} {time.strftime('%Y-%m-%d %H:%M:%S')}"
-            
-            # Crea una linea per il percorso
-            placemark = ET.SubElement(document, 'Placemark')
-            line_name = ET.SubElement(placemark, 'name')
-            line_name.text = "Percorso"
-            
-            line_style = ET.SubElement(placemark, 'Style')
-            line_style = ET.SubElement(line_style, 'LineStyle')
-            line_color = ET.SubElement(line_style, 'color')
-            line_color.text = 'ff0000ff'  # Rosso
-            line_width = ET.SubElement(line_style, 'width')
-            line_width.text = '2'
-            
-            linestring = ET.SubElement(placemark, 'LineString')
-            tessellate = ET.SubElement(linestring, 'tessellate')
-            tessellate.text = '1'
-            coordinates = ET.SubElement(linestring, 'coordinates')
-            
-            coord_text = []
-            for point in points:
-                # 🔴 CORREZIONE: location è DENTRO point, NON in point['telemetry']!
-                if point.get('location') and point['location'].get('latitude'):
-                    loc = point['location']
-                    coord_text.append(f"{loc.get('longitude', 0)},{loc.get('latitude', 0)},{loc.get('altitude', 0)}")
-            
-            coordinates.text = '\n'.join(coord_text)
-            
-            # Aggiungi punti come placemarks
-            for i, point in enumerate(points):
-                if point.get('location') and point['location'].get('latitude'):
-                    loc = point['location']
-                    pt = ET.SubElement(document, 'Placemark')
-                    pt_name = ET.SubElement(pt, 'name')
-                    pt_name.text = f"Punto {i+1}"
-                    
-                    # Aggiungi descrizione con dati radio
-                    description = ET.SubElement(pt, 'description')
-                    radio_text = []
-                    if point.get('radio'):
-                        radio = point['radio']
-                        if radio.get('rssi'):
-                            radio_text.append(f"RSSI: {radio['rssi']} dBm")
-                        if radio.get('snr'):
-                            radio_text.append(f"SNR: {radio['snr']} dB")
-                        if radio.get('q'):
-                            radio_text.append(f"Q: {radio['q']}%")
-                        if radio.get('hops'):
-                            radio_text.append(f"Hops: {radio['hops']}")
-                    
-                    if point.get('battery'):
-                        radio_text.append(f"Batteria: {point['battery'].get('charge_percent', 0)}%")
-                    
-                    description.text = "\n".join(radio_text) if radio_text else "Nessun dato radio"
-                    
-                    pt_point = ET.SubElement(pt, 'Point')
-                    pt_coords = ET.SubElement(pt_point, 'coordinates')
-                    pt_coords.text = f"{loc.get('longitude', 0)},{loc.get('latitude', 0)},{loc.get('altitude', 0)}"
-            
-            # Formatta e salva
-            xml_str = minidom.parseString(ET.tostring(kml)).toprettyxml(indent="  ")
-            filename = os.path.join(output_dir, f"rangetest_{peer_short}_{timestamp}.kml")
-            with open(filename, 'w') as f:
-                f.write(xml_str)
-            print(f"💾 KML salvato: {filename}")
-            
-        except Exception as e:
-            print(f"❌ Errore esportazione KML: {e}")
-            traceback.print_exc()
+            return self.outbound.resolve(dest_hash).result(timeout), None
+        except ValueError:
+            return None, 'Hash di destinazione non valido'
+        except Exception:
+            return None, 'Destinatario sconosciuto'
 
     def send(self, dest_hash, content, title="", callbacks=None,
                  image_path=None, audio_path=None,
                  file_attachments=None, telemetry=None, fields=None):
+            dest, error = self._wait_destination(dest_hash)
+            if not dest:
+                return {'success': False, 'error': error}
+            return self._send_to(dest_hash, dest, content, title, callbacks, image_path,
+                                 audio_path, file_attachments, telemetry, fields)
+
+    def send_async(self, dest_hash, content, title="", callbacks=None,
+                   image_path=None, audio_path=None,
+                   file_attachments=None, telemetry=None, fields=None):
+        """Accoda l'invio e restituisce subito l'handle; gli stati arrivano da outbound.on_state"""
+        return self.outbound.submit(
+            dest_hash,
+            lambda dest: self._send_to(dest_hash, dest, content, title, callbacks, image_path,
+                                       audio_path, file_attachments, telemetry, fields),
+            callbacks=callbacks,
+            kind='message'
+        )
+
+    def group_members(self, group):
+        """[(destination_hash, nome)] dei peer di un gruppo ('favorite' = preferiti)"""
+        if group == 'favorite':
+            sql = GROUP_MEMBERS_QUERY.format(condition='d.is_favorite = 1')
+            return self.db.query(sql, (group,))
+        sql = GROUP_MEMBERS_QUERY.format(condition="COALESCE(d.group_name, 'public') = ?")
+        return self.db.query(sql, (group, group))
+
+    def send_group(self, group, content, title="", image_path=None, audio_path=None,
+                   file_attachments=None, members=None, on_prepared=None):
+        """
+        Invia lo stesso messaggio a tutti i membri del gruppo (o a `members`).
+        Gli allegati sono letti e codificati una volta; on_prepared() viene
+        chiamata subito dopo (es. per cancellare i file caricati).
+        """
+        if members is None:
+            members = self.group_members(group)
+        if not members:
+            return {'success': False, 'error': 'Nessun membro nel gruppo'}
+
+        def prepare():
             try:
-                dest_hash_bytes = bytes.fromhex(dest_hash)
-                dest_identity = RNS.Identity.recall(dest_hash_bytes)
-                if not dest_identity:
-                    RNS.Transport.request_path(dest_hash_bytes)
-                    time.sleep(2)
-                    dest_identity = RNS.Identity.recall(dest_hash_bytes)
-                    if not dest_identity:
-                        return {'success': False, 'error': 'Destinatario sconosciuto'}
-
-                dest = RNS.Destination(
-                    dest_identity,
-                    RNS.Destination.OUT,
-                    RNS.Destination.SINGLE,
-                    "lxmf",
-                    "delivery"
+                return self._prepare_fields(content, title, image_path, audio_path, file_attachments)
+            finally:
+                if on_prepared:
+                    on_prepared()
+
+        return {'success': True, **self.fanout.start(group, members, prepare)}
+
+    def _send_to(self, dest_hash, dest, content, title="", callbacks=None,
+                 image_path=None, audio_path=None,
+                 file_attachments=None, telemetry=None, fields=None):
+            try:
+                content, title, fields_dict = self._prepare_fields(
+                    content, title, image_path, audio_path, file_attachments, telemetry, fields
                 )
-                source_dest = self.dest
+                return self._send_prepared(dest_hash, dest, content, title, fields_dict, callbacks)
+            except Exception as e:
+                traceback.print_exc()
+                return {'success': False, 'error': str(e)}
 
-                fields_dict = {}
+    def _prepare_fields(self, content, title="", image_path=None, audio_path=None,
+                        file_attachments=None, telemetry=None, fields=None):
+        """
+        Legge e codifica gli allegati una volta sola: restituisce (content, title, fields)
+        riutilizzabili per più destinatari (invii di gruppo)
+        """
+        fields_dict = {}
 
-                # 🔴 IMMAGINE - AGGIUNGI TITOLO DEFAULT SE NECESSARIO
-                if image_path and not title and not content:
-                    title = "🖼️ Image"
-                    content = " "  # spazio vuoto per far visualizzare il messaggio
+        # 🔴 IMMAGINE - AGGIUNGI TITOLO DEFAULT SE NECESSARIO
+        if image_path and not title and not content:
+            title = "🖼️ Image"
+            content = " "  # spazio vuoto per far visualizzare il messaggio
+
+        # GESTIONE IMMAGINE - FORMATO ORIGINALE LXMF (SIDEBAND COMPATIBLE)
+        if image_path:
+            with open(image_path, 'rb') as f:
+                img_bytes = f.read()
+
+            # Rileva il tipo dall'estensione o dal magic bytes
+            ext = os.path.splitext(image_path)[1].lower()
+
+            # Determina il tipo come STRINGA (formato originale Sideband)
+            if ext in ['.jpg', '.jpeg']:
+                image_type = 'jpg'
+            elif ext == '.png':
+                image_type = 'png'
+            elif ext == '.gif':
+                image_type = 'gif'
+            elif ext == '.webp':
+                image_type = 'webp'
+            else:
+                # Rileva dal magic bytes se l'estensione non è riconosciuta
+                if img_bytes.startswith(b'\xff\xd8'):
+                    image_type = 'jpg'
+                elif img_bytes.startswith(b'\x89PNG\r\n\x1a\n'):
+                    image_type = 'png'
+                elif img_bytes.startswith(b'GIF87a') or img_bytes.startswith(b'GIF89a'):
+                    image_type = 'gif'
+                elif img_bytes.startswith(b'RIFF') and img_bytes[8:12] == b'WEBP':
+                    image_type = 'webp'
+                else:
+                    image_type = 'img'  # fallback generico
 
-                # GESTIONE IMMAGINE - FORMATO ORIGINALE LXMF (SIDEBAND COMPATIBLE)
-                if image_path:
-                    with open(image_path, 'rb') as f:
-                        img_bytes = f.read()
-                    
-                    # Rileva il tipo dall'estensione o dal magic bytes
-                    ext = os.path.splitext(image_path)[1].lower()
-                    
-                    # Determina il tipo come STRINGA (formato originale Sideband)
-                    if ext in ['.jpg', '.jpeg']:
-                        image_type = 'jpg'
-                    elif ext == '.png':
-                        image_type = 'png'
-                    elif ext == '.gif':
-                        image_type = 'gif'
-                    elif ext == '.webp':
-                        image_type = 'webp'
-                    else:
-                        # Rileva dal magic bytes se l'estensione non è riconosciuta
-                        if img_bytes.startswith(b'\xff\xd8'):
-                            image_type = 'jpg'
-                        elif img_bytes.startswith(b'\x89PNG\r\n\x1a\n'):
-                            image_type = 'png'
-                        elif img_bytes.startswith(b'GIF87a') or img_bytes.startswith(b'GIF89a'):
-                            image_type = 'gif'
-                        elif img_bytes.startswith(b'RIFF') and img_bytes[8:12] == b'WEBP':
-                            image_type = 'webp'
-                        else:
-                            image_type = 'img'  # fallback generico
-                    
-                    # 🔴 FORMATO ORIGINALE: [tipo_stringa, bytes] - SENZA CONVERSIONI!
-                    fields_dict[FIELD_IMAGE] = [image_type, img_bytes]
-                    print(f"📸 Immagine aggiunta: {image_type}, {len(img_bytes)} bytes (formato originale)")
-
-                # 🔴 AUDIO - AGGIUNGI TITOLO DEFAULT SE NECESSARIO
-                if audio_path and not title and not content:
-                    title = "🎤 Audio Message"
-                    content = " "  # spazio vuoto
-
-                # 🎵 AUDIO - CONVERSIONE CON FFMPEG (garantito)
-                if audio_path:
-                    ext = os.path.splitext(audio_path)[1].lower()
-                    
-                    if ext == '.wav':
-                        try:
-                            print(f"🎵 Conversione WAV con ffmpeg...")
-                            
-                            # Crea file Opus temporaneo
-                            temp_opus = audio_path + "_compressed.opus"
-                            
-                            # FFMPEG: converti WAV in Opus con parametri ottimali
-                            cmd = [
-                                'ffmpeg', '-i', audio_path,
-                                '-c:a', 'libopus',           # Codec Opus
-                                '-b:a', '16k',                # Bitrate 16kbps (voce)
-                                '-application', 'voip',        # Ottimizzato per voce
-                                '-frame_duration', '60',       # Frame 60ms come Sideband
-                                '-packet_loss', '1',           # Tolleranza perdita pacchetti
-                                '-ac', '1',                     # Mono
-                                '-ar', '48000',                  # Sample rate 48kHz
-                                '-y',                             # Sovrascrivi
-                                temp_opus
-                            ]
-                            
-                            result = subprocess.run(cmd, capture_output=True)
-                            
-                            if result.returncode == 0 and os.path.exists(temp_opus):
-                                with open(temp_opus, 'rb') as f:
-                                    audio_bytes = f.read()
-                                os.unlink(temp_opus)
-                                
-                                fields_dict[FIELD_AUDIO] = [AM_OPUS_OGG, audio_bytes]
-                                print(f"✅ Audio Opus compresso con ffmpeg: {len(audio_bytes)} bytes")
-                                print(f"   Rapporto compressione: {os.path.getsize(audio_path)} → {len(audio_bytes)} bytes")
-                            else:
-                                print(f"❌ FFmpeg errore: {result.stderr.decode()}")
-                                return {'success': False, 'error': 'FFmpeg compression failed'}
-                                
-                        except Exception as e:
-                            print(f"❌ Conversione audio fallita: {e}")
-                            traceback.print_exc()
-                            return {'success': False, 'error': f'Conversione audio fallita: {e}'}
-
-                # 🔴 FILE - AGGIUNGI TITOLO DEFAULT SE NECESSARIO
-                if file_attachments and not title and not content:
-                    if len(file_attachments) == 1:
-                        filename = file_attachments[0][0]
-                        title = f"📎 {filename}"
+            # 🔴 FORMATO ORIGINALE: [tipo_stringa, bytes] - SENZA CONVERSIONI!
+            fields_dict[FIELD_IMAGE] = [image_type, img_bytes]
+            print(f"📸 Immagine aggiunta: {image_type}, {len(img_bytes)} bytes (formato originale)")
+
+        # 🔴 AUDIO - AGGIUNGI TITOLO DEFAULT SE NECESSARIO
+        if audio_path and not title and not content:
+            title = "🎤 Audio Message"
+            content = " "  # spazio vuoto
+
+        # 🎵 AUDIO - CONVERSIONE CON FFMPEG (garantito)
+        if audio_path:
+            ext = os.path.splitext(audio_path)[1].lower()
+
+            if ext == '.wav':
+                try:
+                    print(f"🎵 Conversione WAV con ffmpeg...")
+
+                    # Crea file Opus temporaneo
+                    temp_opus = audio_path + "_compressed.opus"
+
+                    # FFMPEG: converti WAV in Opus con parametri ottimali
+                    cmd = [
+                        'ffmpeg', '-i', audio_path,
+                        '-c:a', 'libopus',           # Codec Opus
+                        '-b:a', '16k',                # Bitrate 16kbps (voce)
+                        '-application', 'voip',        # Ottimizzato per voce
+                        '-frame_duration', '60',       # Frame 60ms come Sideband
+                        '-packet_loss', '1',           # Tolleranza perdita pacchetti
+                        '-ac', '1',                     # Mono
+                        '-ar', '48000',                  # Sample rate 48kHz
+                        '-y',                             # Sovrascrivi
+                        temp_opus
+                    ]
+
+                    result = subprocess.run(cmd, capture_output=True)
+
+                    if result.returncode == 0 and os.path.exists(temp_opus):
+                        with open(temp_opus, 'rb') as f:
+                            audio_bytes = f.read()
+                        os.unlink(temp_opus)
+
+                        fields_dict[FIELD_AUDIO] = [AM_OPUS_OGG, audio_bytes]
+                        print(f"✅ Audio Opus compresso con ffmpeg: {len(audio_bytes)} bytes")
+                        print(f"   Rapporto compressione: {os.path.getsize(audio_path)} → {len(audio_bytes)} bytes")
                     else:
-                        title = f"📎 {len(file_attachments)} files"
-                    content = " "  # spazio vuoto
-
-                # 📎 FILE ATTACHMENTS
-                if file_attachments:
-                    attachments_list = []
-                    for fname, fpath in file_attachments:
-                        with open(fpath, 'rb') as f:
-                            file_bytes = f.read()
-                        attachments_list.append([fname, file_bytes])
-                        print(f"📎 File aggiunto: {fname}, {len(file_bytes)} bytes")
-                    
-                    fields_dict[FIELD_FILE_ATTACHMENTS] = attachments_list
-
-                # 🎨 ICON APPEARANCE
-                appearance = self.config.get('appearance', ['antenna', '4c9aff', '1a1f2e'])
-                if appearance and len(appearance) == 3:
-                    # Converti hex color in bytes
-                    fg_bytes = bytes.fromhex(appearance[1].lstrip('#')) if isinstance(appearance[1], str) else appearance[1]
-                    bg_bytes = bytes.fromhex(appearance[2].lstrip('#')) if isinstance(appearance[2], str) else appearance[2]
-                    fields_dict[FIELD_ICON_APPEARANCE] = [appearance[0], fg_bytes, bg_bytes]
-
-                # 📊 TELEMETRIA
-                if telemetry:
-                    fields_dict[FIELD_TELEMETRY] = telemetry.packed()
-                
-                # Altri fields
-                if fields:
-                    fields_dict.update(fields)
-
-                # Crea il messaggio LXMF
-                msg = LXMF.LXMessage(
-                    dest,
-                    source_dest,
-                    content,
-                    title,
-                    fields=fields_dict if fields_dict else None,
-                    desired_method=0x01  # opportunistic
-                )
+                        print(f"❌ FFmpeg errore: {result.stderr.decode()}")
+                        raise RuntimeError('FFmpeg compression failed')
 
-                msg.stamp_cost = self.config.get('stamp_cost', 0)
-                if self.config.get('try_propagation_on_fail') and self.propagation_node:
-                    msg.try_propagation_on_fail = True
+                except Exception as e:
+                    print(f"❌ Conversione audio fallita: {e}")
+                    traceback.print_exc()
+                    raise RuntimeError(f'Conversione audio fallita: {e}')
 
-                msg.pack()
-                msg_hash = msg.hash.hex()
+        # 🔴 FILE - AGGIUNGI TITOLO DEFAULT SE NECESSARIO
+        if file_attachments and not title and not content:
+            if len(file_attachments) == 1:
+                filename = file_attachments[0][0]
+                title = f"📎 {filename}"
+            else:
+                title = f"📎 {len(file_attachments)} files"
+            content = " "  # spazio vuoto
 
-                # Salva raw
-                self._save_raw(msg_hash, msg.packed)
+        # 📎 FILE ATTACHMENTS
+        if file_attachments:
+            attachments_list = []
+            for fname, fpath in file_attachments:
+                with open(fpath, 'rb') as f:
+                    file_bytes = f.read()
+                attachments_list.append([fname, file_bytes])
+                print(f"📎 File aggiunto: {fname}, {len(file_bytes)} bytes")
 
-                # Registra callbacks
-                if callbacks:
-                    if 'delivery' in callbacks:
-                        self.delivery_callbacks[msg_hash] = callbacks['delivery']
-                    if 'failed' in callbacks:
-                        self.failed_callbacks[msg_hash] = callbacks['failed']
-                    if 'progress' in callbacks:
-                        self.progress_callbacks[msg_hash] = callbacks['progress']
+            fields_dict[FIELD_FILE_ATTACHMENTS] = attachments_list
 
-                msg.register_delivery_callback(self._delivery_callback)
-                msg.register_failed_callback(self._failed_callback)
-                
-                self.sent_messages[msg_hash] = {
-                    'message': msg,
-                    'last_progress': 0,
-                    'callbacks': callbacks
-                }
+        # 🎨 ICON APPEARANCE
+        appearance = self.config.get('appearance', ['antenna', '4c9aff', '1a1f2e'])
+        if appearance and len(appearance) == 3:
+            # Converti hex color in bytes
+            fg_bytes = bytes.fromhex(appearance[1].lstrip('#')) if isinstance(appearance[1], str) else appearance[1]
+            bg_bytes = bytes.fromhex(appearance[2].lstrip('#')) if isinstance(appearance[2], str) else appearance[2]
+            fields_dict[FIELD_ICON_APPEARANCE] = [appearance[0], fg_bytes, bg_bytes]
 
-                self.router.handle_outbound(msg)
+        # 📊 TELEMETRIA
+        if telemetry:
+            fields_dict[FIELD_TELEMETRY] = telemetry.packed()
 
-                # SALVA NEL DATABASE
-                self._save_message(msg, incoming=False)
+        # Altri fields
+        if fields:
+            fields_dict.update(fields)
 
-                return {
-                    'success': True,
-                    'hash': msg_hash,
-                    'method': 'opportunistic',
-                    'status': 'sending',
-                    'packed_size': msg.packed_size
-                }
 
-            except Exception as e:
-                traceback.print_exc()
-                return {'success': False, 'error': str(e)}
+        return content, title, fields_dict
 
-    def send_command(self, dest_hash, command_type, command_data=None, callbacks=None):
+    def _send_prepared(self, dest_hash, dest, content, title, fields_dict, callbacks=None):
+        """Crea, impacchetta e accoda un LXMessage con fields già preparati"""
         try:
-            dest_hash_bytes = bytes.fromhex(dest_hash)
-            dest_identity = RNS.Identity.recall(dest_hash_bytes)
-            if not dest_identity:
-                RNS.Transport.request_path(dest_hash_bytes)
-                time.sleep(2)
-                dest_identity = RNS.Identity.recall(dest_hash_bytes)
-                if not dest_identity:
-                    return {'success': False, 'error': 'Destinatario sconosciuto'}
-
-            dest = RNS.Destination(
-                dest_identity,
-                RNS.Destination.OUT,
-                RNS.Destination.SINGLE,
-                "lxmf",
-                "delivery"
+            source_dest = self.dest
+
+            # Crea il messaggio LXMF
+            msg = LXMF.LXMessage(
+                dest,
+                source_dest,
+                content,
+                title,
+                fields=fields_dict if fields_dict else None,
+                desired_method=0x01  # opportunistic
             )
+
+            msg.stamp_cost = self.config.get('stamp_cost', 0)
+            if self.config.get('try_propagation_on_fail') and self.propagation_node:
+                msg.try_propagation_on_fail = True
+
+            self._pack(msg)
+            msg_hash = msg.hash.hex()
+
+            # Salva raw
+            self._save_raw(msg_hash, msg.packed, msg)
+
+            # Registra callbacks
+            if callbacks:
+                if 'delivery' in callbacks:
+                    self.delivery_callbacks[msg_hash] = callbacks['delivery']
+                if 'failed' in callbacks:
+                    self.failed_callbacks[msg_hash] = callbacks['failed']
+                if 'progress' in callbacks:
+                    self.progress_callbacks[msg_hash] = callbacks['progress']
+
+            msg.register_delivery_callback(self._delivery_callback)
+            msg.register_failed_callback(self._failed_callback)
+
+            # Chiuso da _delivery_callback/_failed_callback (che può ritentare via propagation)
+            self.transfers.track(msg_hash, msg, auto_finish=False)
+
+            status = self._dispatch(msg, msg_hash)
+
+            # SALVA NEL DATABASE
+            self._save_message(msg, incoming=False)
+
+            return {
+                'success': True,
+                'hash': msg_hash,
+                'method': 'opportunistic',
+                'status': status,
+                'packed_size': msg.packed_size
+            }
+
+        except Exception as e:
+            traceback.print_exc()
+            return {'success': False, 'error': str(e)}
+
+    def send_command(self, dest_hash, command_type, command_data=None, callbacks=None):
+        dest, error = self._wait_destination(dest_hash)
+        if not dest:
+            return {'success': False, 'error': error}
+        return self._send_command_to(dest_hash, dest, command_type, command_data, callbacks)
+
+    def send_command_async(self, dest_hash, command_type, command_data=None, callbacks=None):
+        """Come send_async, per i comandi"""
+        return self.outbound.submit(
+            dest_hash,
+            lambda dest: self._send_command_to(dest_hash, dest, command_type, command_data, callbacks),
+            callbacks=callbacks,
+            kind='command'
+        )
+
+    def _send_command_to(self, dest_hash, dest, command_type, command_data=None, callbacks=None):
+        try:
             source_dest = self.dest
 
             fields = {FIELD_COMMANDS: [{command_type: command_data}]}
@@ -2145,24 +2299,21 @@ class Messenger:
             if self.config.get('try_propagation_on_fail') and self.propagation_node:
                 msg.try_propagation_on_fail = True
 
-            msg.pack()
+            self._pack(msg)
             msg_hash = msg.hash.hex()
 
             # 🔴 DEBUG: Visualizza il pacchetto comando in invio
             if msg.packed:
                 debug_packet(msg.packed, "⬆️ COMANDO", f"Tipo: {command_type}")
 
-            self._save_raw(msg_hash, msg.packed)
+            self._save_raw(msg_hash, msg.packed, msg)
 
-            with self.db_lock:
-                conn = sqlite3.connect(self.peers_db, timeout=10)
+            with self.db.write() as conn:
                 c = conn.cursor()
                 c.execute('''
                     INSERT INTO sent_messages (hash, destination_hash, content, sent_at, status, method)
                     VALUES (?, ?, ?, ?, ?, ?)
                 ''', (msg_hash, dest_hash, "[Command]", time.time(), 'sending', method_name))
-                conn.commit()
-                conn.close()
 
             # 🔴 SALVA IL COMANDO COME MESSAGGIO
             self._save_message(msg, incoming=False)
@@ -2179,19 +2330,15 @@ class Messenger:
             msg.register_failed_callback(self._failed_callback)
             
             # Salva per monitoraggio
-            self.sent_messages[msg_hash] = {
-                'message': msg,
-                'last_progress': 0,
-                'callbacks': callbacks
-            }
+            self.transfers.track(msg_hash, msg, auto_finish=False)
 
-            self.router.handle_outbound(msg)
+            status = self._dispatch(msg, msg_hash)
 
             return {
                 'success': True,
                 'hash': msg_hash,
                 'method': method_name,
-                'status': 'sending',
+                'status': status,
                 'packed_size': msg.packed_size
             }
 
@@ -2199,15 +2346,42 @@ class Messenger:
             traceback.print_exc()
             return {'success': False, 'error': str(e)}
 
+    # ============================================
+    # POLLING TELEMETRIA
+    # ============================================
+
+    def _schedule_telemetry_poll(self, dest_hash, interval):
+        def poll():
+            result = self.request_telemetry(dest_hash)
+            if not result.get('success'):
+                raise RuntimeError(result.get('error'))
+
+        self.scheduler.add(f"telemetry:{dest_hash}", interval, poll,
+                           info={'kind': 'telemetry', 'peer': dest_hash})
+
+    def set_telemetry_poll(self, dest_hash, interval):
+        """Richiede la telemetria a un peer ogni `interval` secondi (0 = smette); salvato nel config"""
+        polls = self.config.setdefault('telemetry_polls', {})
+        if interval and interval > 0:
+            polls[dest_hash] = interval
+            self._schedule_telemetry_poll(dest_hash, interval)
+        else:
+            polls.pop(dest_hash, None)
+            self.scheduler.remove(f"telemetry:{dest_hash}")
+        with open(self.configpath, 'w') as f:
+            json.dump(self.config, f, indent=4)
+
+    def list_telemetry_polls(self):
+        return self.scheduler.list('telemetry:')
+
     def request_telemetry(self, dest_hash, timebase=None, is_collector_request=False, callbacks=None):
         try:
-            dest_hash_bytes = bytes.fromhex(dest_hash)
-            dest_identity = RNS.Identity.recall(dest_hash_bytes)
-            if not dest_identity:
-                RNS.Transport.request_path(dest_hash_bytes)
+            dest = self.outbound.destination(dest_hash)
+            if not dest:
+                # Avvia (una sola volta) la richiesta di path: il polling riproverà
+                self.outbound.resolve(dest_hash)
                 return {'success': False, 'error': 'Destinatario sconosciuto, richiesto path'}
 
-            dest = RNS.Destination(dest_identity, RNS.Destination.OUT, RNS.Destination.SINGLE, "lxmf", "delivery")
             source_dest = self.dest
 
             if timebase is None:
@@ -2232,24 +2406,21 @@ class Messenger:
             if self.config.get('try_propagation_on_fail') and self.propagation_node:
                 msg.try_propagation_on_fail = True
 
-            msg.pack()
+            self._pack(msg)
             msg_hash = msg.hash.hex()
 
             # 🔴 DEBUG: Visualizza il pacchetto telemetria in invio
             if msg.packed:
                 debug_packet(msg.packed, "⬆️ TELEMETRIA", f"Richiesta per {dest_hash[:16]}...")
 
-            self._save_raw(msg_hash, msg.packed)
+            self._save_raw(msg_hash, msg.packed, msg)
 
-            with self.db_lock:
-                conn = sqlite3.connect(self.peers_db, timeout=10)
+            with self.db.write() as conn:
                 c = conn.cursor()
                 c.execute('''
                     INSERT INTO sent_messages (hash, destination_hash, content, sent_at, status, method)
                     VALUES (?, ?, ?, ?, ?, ?)
                 ''', (msg_hash, dest_hash, "[Telemetry Request]", time.time(), 'sending', method_name))
-                conn.commit()
-                conn.close()
 
             # 🔴 SALVA LA RICHIESTA COME MESSAGGIO
             self._save_message(msg, incoming=False)
@@ -2266,19 +2437,15 @@ class Messenger:
             msg.register_failed_callback(self._failed_callback)
             
             # Salva per monitoraggio
-            self.sent_messages[msg_hash] = {
-                'message': msg,
-                'last_progress': 0,
-                'callbacks': callbacks
-            }
+            self.transfers.track(msg_hash, msg, auto_finish=False)
 
-            self.router.handle_outbound(msg)
+            status = self._dispatch(msg, msg_hash)
 
             return {
                 'success': True,
                 'hash': msg_hash,
                 'method': method_name,
-                'status': 'sending',
+                'status': status,
                 'packed_size': msg.packed_size
             }
 
@@ -2286,82 +2453,55 @@ class Messenger:
             traceback.print_exc()
             return {'success': False, 'error': str(e)}
 
-    def _monitor_progress(self):
-        """Monitora il progresso dei messaggi in invio"""
-        while self.running:
-            try:
-                for msg_hash, data in list(self.sent_messages.items()):
-                    msg = data['message']
-                    last_progress = data['last_progress']
-                    
-                    # Se il progresso è cambiato
-                    if msg.progress != last_progress and msg.progress > 0:
-                        data['last_progress'] = msg.progress
-                        
-                        # Calcola velocità
-                        speed = 0
-                        bytes_sent = 0
-                        total_bytes = 0
-                        
-                        if hasattr(msg, 'resource_representation') and msg.resource_representation:
-                            resource = msg.resource_representation
-                            if hasattr(resource, 'get_progress') and hasattr(resource, 'size'):
-                                try:
-                                    resource_progress = resource.get_progress()
-                                    total_bytes = resource.size
-                                    bytes_sent = int(resource_progress * total_bytes)
-                                    
-                                    # 🔴 CALCOLA VELOCITÀ
-                                    now = time.time()
-                                    if 'last_update' not in data:
-                                        data['last_update'] = now
-                                        data['last_bytes'] = bytes_sent
-                                    else:
-                                        time_diff = now - data['last_update']
-                                        bytes_diff = bytes_sent - data['last_bytes']
-                                        if time_diff > 0:
-                                            speed = bytes_diff / time_diff  # bytes/sec
-                                        data['last_update'] = now
-                                        data['last_bytes'] = bytes_sent
-                                        
-                                except:
-                                    pass
-                        
-                        if msg_hash in self.progress_callbacks:
-                            progress_data = {
-                                'hash': msg_hash,
-                                'progress': msg.progress,
-                                'state': msg.state,
-                                'delivery_attempts': msg.delivery_attempts,
-                                'status': 'transferring',
-                                'speed': speed,
-                                'bytes_sent': bytes_sent,
-                                'total_bytes': total_bytes
-                            }
-                            
-                            self.progress_callbacks[msg_hash](progress_data)
-            except Exception as e:
-                print(f"Errore nel monitoraggio progresso: {e}")
-            
-            time.sleep(0.5)
+    # ============================================
+    # STAMP (pool di processi)
+    # ============================================
+
+    def _pack(self, msg):
+        """Impacchetta senza calcolare lo stamp: se serve lo calcola StampGenerator in _dispatch"""
+        cost = getattr(msg, 'stamp_cost', None)
+        if cost:
+            msg.stamp_cost = None
+        try:
+            msg.pack()
+        finally:
+            if cost:
+                msg.stamp_cost = cost
+
+    def _dispatch(self, msg, msg_hash):
+        """Consegna il messaggio al router; se ha uno stamp_cost prima lo accoda per lo stamp"""
+        if not getattr(msg, 'stamp_cost', None) or getattr(msg, 'stamp', None):
+            self.router.handle_outbound(msg)
+            return 'sending'
+        self.stamps.submit(msg_hash, msg.hash, msg.stamp_cost,
+                           lambda stamp: self._on_stamp(msg, msg_hash, stamp))
+        return 'stamping'
+
+    def _on_stamp(self, msg, msg_hash, stamp):
+        """Stamp pronto (o annullato): reimpacchetta con lo stamp e invia, oppure segna fallito"""
+        if stamp is None:
+            msg.try_propagation_on_fail = False
+            self._failed_callback(msg)
+            return
+        msg.stamp = stamp
+        msg.defer_stamp = False
+        msg.packed = None
+        msg.pack()
+        self._save_raw(msg_hash, msg.packed, msg, replace=True)
+        self.router.handle_outbound(msg)
+
+    def cancel_stamp(self, msg_hash):
+        return self.stamps.cancel(msg_hash)
+
+    def _on_transfer_progress(self, info):
+        """Avanzamento dal TransferTracker: progresso in %, velocità EWMA ed ETA"""
+        callback = self.progress_callbacks.get(info['hash'])
+        if callback:
+            callback(info)
 
     def sync_messages(self, limit=10):
-        if not self.propagation_node:
-            return {'success': False, 'error': 'No propagation node in config'}
-        self.router.request_messages_from_propagation_node(self.identity, max_messages=limit)
-        timeout = 30
-        while timeout > 0 and self.router.propagation_transfer_state not in [
-            LXMF.LXMRouter.PR_IDLE,
-            LXMF.LXMRouter.PR_COMPLETE,
-            LXMF.LXMRouter.PR_FAILED
-        ]:
-            time.sleep(0.5)
-            timeout -= 0.5
-        return {
-            'success': True,
-            'new': self.router.propagation_transfer_last_result,
-            'state': self.router.propagation_transfer_state
-        }
+        """Avvia la sync dal propagation node e ritorna subito lo stato del job"""
+        return self.sync.start(limit)
 
     def announce(self):
         self.router.announce(self.dest.hash)
@@ -2375,8 +2515,7 @@ class Messenger:
         return self.dest.hash.hex()
 
     def get_peer_name(self, dest_hash):
-        with self.db_lock:
-            conn = sqlite3.connect(self.peers_db, timeout=10)
+        with self.db.read() as conn:
             c = conn.cursor()
             c.execute('''
                 SELECT i.display_name FROM identities i
@@ -2384,159 +2523,149 @@ class Messenger:
                 WHERE d.destination_hash = ?
             ''', (dest_hash,))
             row = c.fetchone()
-            conn.close()
             if row:
                 return row[0]
             return dest_hash[:8]
 
     def list_peers(self):
-        """Restituisce una lista di tutte le identità (con nome, identity_hash e appearance)"""
-        with self.db_lock:
-            conn = sqlite3.connect(self.peers_db, timeout=10)
-            c = conn.cursor()
-            
-            # 🔴 CORREZIONE: group_name NON esiste in identities, ma in destinations!
-            c.execute('''
-                SELECT i.identity_hash, i.display_name, d.group_name, d.appearance
-                FROM identities i
-                LEFT JOIN destinations d ON i.identity_hash = d.identity_hash 
-                    AND d.aspect = 'lxmf.delivery'
-                GROUP BY i.identity_hash
-            ''')
-            rows = c.fetchall()
-            conn.close()
-        
-        # Ordina
-        def sort_key(row):
-            name = row[1] or ""
-            clean = re.sub(r'^[^a-zA-Z0-9]+', '', name)
-            return clean.lower()
-        
-        rows.sort(key=sort_key)
-        
-        # Costruisci risultato con appearance
-        result = []
-        for row in rows:
-            peer = {
-                'hash': row[0],
-                'name': row[1],
-                'group': row[2] or 'public'  # 🔴 group_name viene da destinations!
-            }
-            
-            # 🔴 DECODIFICA APPEARANCE SE PRESENTE
-            if row[3]:
-                try:
-                    app_data = json.loads(row[3])
-                    peer['appearance'] = [
-                        app_data.get('icon', 'account-outline'),
-                        app_data.get('fg', '4c9aff'),
-                        app_data.get('bg', '1a1f2e')
-                    ]
-                except:
-                    peer['appearance'] = None
-            else:
+        """
+        Restituisce tutte le identità con i dati dell'ultima destinazione lxmf.delivery
+        (telemetria, permessi, contatori), ordinate per sort_name
+        """
+        return self.get_peers_snapshot()[1]
+
+    def get_peers_snapshot(self):
+        """
+        (versione, peers, json) dalla cache in memoria: la query viene rifatta solo
+        se change_counters.peers è cambiato (trigger su identities/destinations)
+        """
+        with self.db.read() as conn:
+            # Versione e righe dalla stessa transazione di lettura
+            conn.execute('BEGIN')
+            version = conn.execute("SELECT version FROM change_counters WHERE name = 'peers'").fetchone()[0]
+
+            with self.peers_cache_lock:
+                if self.peers_cache and self.peers_cache[0] == version:
+                    return self.peers_cache
+
+            rows = conn.execute(PEERS_QUERY).fetchall()
+
+        peers = [self._peer_from_row(row) for row in rows]
+        snapshot = (version, peers, json.dumps(peers))
+        with self.peers_cache_lock:
+            if not self.peers_cache or self.peers_cache[0] <= version:
+                self.peers_cache = snapshot
+        return snapshot
+
+    @staticmethod
+    def _peer_from_row(row):
+        peer = {
+            'hash': row[0],
+            'name': row[1],
+            'group': 'public',
+            'appearance': None
+        }
+
+        # 🔴 DECODIFICA APPEARANCE SE PRESENTE
+        if row[2]:
+            try:
+                app_data = json.loads(row[2])
+                peer['appearance'] = [
+                    app_data.get('icon', 'account-outline'),
+                    app_data.get('fg', '4c9aff'),
+                    app_data.get('bg', '1a1f2e')
+                ]
+            except:
                 peer['appearance'] = None
-            
-            result.append(peer)
-        
-        return result
+
+        d = row[3:]
+        if d[26] is None:
+            # Nessuna destinazione lxmf.delivery conosciuta
+            peer['favorite'] = False
+            return peer
+
+        peer.update({
+            'dest_hash': d[26],
+            'last_seen': d[27],
+            'hops': d[28],
+            'rssi': d[29],
+            'snr': d[30],
+            'q': d[31],
+            'last_location': {
+                'latitude': d[0],
+                'longitude': d[1],
+                'altitude': d[2],
+                'speed': d[3],
+                'bearing': d[4],
+                'accuracy': d[5]
+            } if d[0] and d[1] else None,
+            'last_battery': {
+                'percent': d[6],
+                'charging': bool(d[7])
+            } if d[6] is not None else None,
+            'last_temperature': d[8],
+            'last_humidity': d[9],
+            'last_pressure': d[10],
+            'last_light': d[11],
+            'last_uptime': d[12],
+            'last_processor': d[13],
+            'last_ram': d[14],
+            'last_nvm': d[15],
+            'last_telemetry_time': d[16],
+            'trust_level': d[17],
+            'allow_telemetry': bool(d[18]),
+            'allow_commands': bool(d[19]),
+            'messages_sent': d[20],
+            'messages_received': d[21],
+            'telemetry_count': d[22],
+            'favorite': bool(d[23]),
+            'group': d[24] or 'public',
+            'notes': d[25]
+        })
+        return peer
 
     def add_peer_manual(self, identity_hash, name, group=None):
-        with self.db_lock:
-            conn = sqlite3.connect(self.peers_db, timeout=10)
+        with self.db.write() as conn:
             c = conn.cursor()
             now = time.time()
             c.execute('''
-                INSERT INTO identities (identity_hash, display_name, first_seen, last_seen, group_name)
-                VALUES (?, ?, ?, ?, ?)
+                INSERT INTO identities (identity_hash, display_name, sort_name, first_seen, last_seen, group_name)
+                VALUES (?, ?, ?, ?, ?, ?)
                 ON CONFLICT(identity_hash) DO UPDATE SET
                     display_name = excluded.display_name,
+                    sort_name = excluded.sort_name,
                     last_seen = excluded.last_seen,
                     group_name = excluded.group_name
-            ''', (identity_hash, name, now, now, group))
-            conn.commit()
-            conn.close()
+            ''', (identity_hash, name, sort_name(name), now, now, group))
         print(f"✅ Identità {name} aggiunta con hash {identity_hash}")
 
-    def import_peers_from_cache(self):
+    def _on_bridge_announce(self, announce):
+        """Announce lxmf.delivery ricevuto dal monitor: va direttamente nella coda di scrittura"""
+        if announce.get('aspect') != 'lxmf.delivery' or not announce.get('dest_hash'):
+            return
+        dest_hash = announce['dest_hash']
+        app_data_hex = announce.get('app_data_hex')
+        display_name = announce.get('display_name') or display_name_from_hex(app_data_hex) or dest_hash[:8]
+        try:
+            hops = int(announce.get('hops'))
+        except (TypeError, ValueError):
+            hops = None
+        self.announce_queue.put(
+            dest_hash, announce.get('identity_hash') or None, display_name, hops, app_data_hex,
+            timestamp=announce.get('timestamp'),
+            rssi=announce.get('rssi'), snr=announce.get('snr'), q=announce.get('q')
+        )
+
+    def import_peers_from_cache(self, full=False):
+        """Importa i peer da announces.db: solo gli announce nuovi, tutto con full=True"""
         if not os.path.exists(self.announces_cache_db):
             print("📢 Database announces.db non trovato.")
             return 0
 
         try:
-            with self.db_lock:
-                src_conn = sqlite3.connect(self.announces_cache_db, timeout=10)
-                src_c = src_conn.cursor()
-                src_c.execute("SELECT COUNT(*) FROM announces WHERE aspect = 'lxmf.delivery'")
-                total = src_c.fetchone()[0]
-                print(f"📢 Trovati {total} annunci lxmf.delivery in announces.db")
-
-                src_c.execute('''
-                    SELECT a.dest_hash, a.timestamp, a.hops, a.data, a.identity_hash,
-                           a.rssi, a.snr, a.q
-                    FROM announces a
-                    INNER JOIN (
-                        SELECT dest_hash, MAX(timestamp) as max_ts
-                        FROM announces
-                        WHERE aspect = 'lxmf.delivery'
-                        GROUP BY dest_hash
-                    ) b ON a.dest_hash = b.dest_hash AND a.timestamp = b.max_ts
-                    WHERE a.aspect = 'lxmf.delivery'
-                ''')
-                rows = src_c.fetchall()
-                src_conn.close()
-                print(f"📢 Selezionati {len(rows)} peer unici da announces.db")
-
-                if not rows:
-                    print("📢 Nessun peer da importare.")
-                    return 0
-
-                dst_conn = sqlite3.connect(self.peers_db, timeout=10)
-                dst_c = dst_conn.cursor()
-                imported = 0
-                for row in rows:
-                    dest_hash, ts, hops, data_hex, identity_hash, rssi, snr, q = row
-                    display_name = None
-                    if data_hex and len(data_hex) > 0:
-                        try:
-                            if all(c in '0123456789abcdefABCDEF' for c in data_hex) and len(data_hex) % 2 == 0:
-                                app_data = bytes.fromhex(data_hex)
-                                display_name = LXMF.display_name_from_app_data(app_data)
-                            else:
-                                app_data = data_hex.encode('utf-8')
-                                display_name = LXMF.display_name_from_app_data(app_data)
-                        except Exception as e:
-                            RNS.log(f"Errore decoding app_data per {dest_hash}: {e}", RNS.LOG_WARNING)
-                    if not display_name:
-                        display_name = dest_hash[:8]
-
-                    if identity_hash:
-                        dst_c.execute('''
-                            INSERT INTO identities (identity_hash, display_name, first_seen, last_seen)
-                            VALUES (?, ?, ?, ?)
-                            ON CONFLICT(identity_hash) DO UPDATE SET
-                                display_name = excluded.display_name,
-                                last_seen = excluded.last_seen
-                        ''', (identity_hash, display_name, ts, ts))
-
-                    dst_c.execute('''
-                        INSERT INTO destinations (destination_hash, identity_hash, aspect, last_seen, hops, rssi, snr, q, app_data)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                        ON CONFLICT(destination_hash) DO UPDATE SET
-                            identity_hash = excluded.identity_hash,
-                            last_seen = excluded.last_seen,
-                            hops = excluded.hops,
-                            rssi = excluded.rssi,
-                            snr = excluded.snr,
-                            q = excluded.q,
-                            app_data = excluded.app_data
-                    ''', (dest_hash, identity_hash, 'lxmf.delivery', ts, hops, rssi, snr, q, data_hex))
-                    imported += 1
-
-                dst_conn.commit()
-                dst_conn.close()
-                print(f"📢 Importati {imported} peer da announces.db.")
-                return imported
+            imported = self.announce_importer.run(full=full)
+            print(f"📢 Importati {imported} peer da announces.db.")
+            return imported
 
         except Exception as e:
             print(f"❌ Errore durante l'importazione: {e}")
@@ -2546,14 +2675,12 @@ class Messenger:
     def _delivery_callback(self, message):
         if message.hash:
             msg_hash = message.hash.hex()
-            with self.db_lock:
-                conn = sqlite3.connect(self.peers_db, timeout=10)
+            with self.db.write() as conn:
                 c = conn.cursor()
                 c.execute('''
                     UPDATE sent_messages SET status = ?, delivered_at = ? WHERE hash = ?
                 ''', ('delivered', time.time(), msg_hash))
-                conn.commit()
-                conn.close()
+                self.conversations.set_status(conn, msg_hash, 'delivered')
             RNS.log(f"✅ Delivery callback per {msg_hash}", RNS.LOG_INFO)
             if msg_hash in self.delivery_callbacks:
                 self.delivery_callbacks[msg_hash]({
@@ -2564,8 +2691,8 @@ class Messenger:
                 del self.delivery_callbacks[msg_hash]
             
             # Rimuovi dal monitoraggio
-            if msg_hash in self.sent_messages:
-                del self.sent_messages[msg_hash]
+            self.transfers.finish(msg_hash, 'delivered')
+            self.progress_callbacks.pop(msg_hash, None)
 
     def _failed_callback(self, message):
         if hasattr(message, 'try_propagation_on_fail') and message.try_propagation_on_fail:
@@ -2579,14 +2706,12 @@ class Messenger:
 
         if message.hash:
             msg_hash = message.hash.hex()
-            with self.db_lock:
-                conn = sqlite3.connect(self.peers_db, timeout=10)
+            with self.db.write() as conn:
                 c = conn.cursor()
                 c.execute('''
                     UPDATE sent_messages SET status = ?, failed_at = ?, attempts = ? WHERE hash = ?
                 ''', ('failed', time.time(), message.delivery_attempts, msg_hash))
-                conn.commit()
-                conn.close()
+                self.conversations.set_status(conn, msg_hash, 'failed')
             RNS.log(f"❌ Failed callback per {msg_hash}", RNS.LOG_INFO)
             if msg_hash in self.failed_callbacks:
                 self.failed_callbacks[msg_hash]({
@@ -2598,8 +2723,8 @@ class Messenger:
                 del self.failed_callbacks[msg_hash]
             
             # Rimuovi dal monitoraggio
-            if msg_hash in self.sent_messages:
-                del self.sent_messages[msg_hash]
+            self.transfers.finish(msg_hash, 'failed')
+            self.progress_callbacks.pop(msg_hash, None)
 
 class AnnounceHandler:
     def __init__(self, messenger):
@@ -2607,6 +2732,10 @@ class AnnounceHandler:
         self.aspect_filter = "lxmf.delivery"
 
     def received_announce(self, destination_hash, announced_identity, app_data):
+        # Con il monitor collegato lo stesso announce arriva già risolto dal ponte
+        if self.messenger.announce_bridge.connected:
+            return
+
         peer_hash = destination_hash.hex()
         RNS.log(f"📢 Annuncio ricevuto da {peer_hash}", RNS.LOG_INFO)
         display_name = None
@@ -2623,29 +2752,8 @@ class AnnounceHandler:
         hops = RNS.Transport.hops_to(destination_hash)
         identity_hash = announced_identity.hash.hex() if announced_identity else None
 
-        with self.messenger.db_lock:
-            conn = sqlite3.connect(self.messenger.peers_db, timeout=10)
-            c = conn.cursor()
-            now = time.time()
-
-            if identity_hash:
-                c.execute('''
-                    INSERT INTO identities (identity_hash, display_name, first_seen, last_seen)
-                    VALUES (?, ?, ?, ?)
-                    ON CONFLICT(identity_hash) DO UPDATE SET
-                        display_name = excluded.display_name,
-                        last_seen = excluded.last_seen
-                ''', (identity_hash, display_name, now, now))
-
-            c.execute('''
-                INSERT INTO destinations (destination_hash, identity_hash, aspect, last_seen, hops, app_data)
-                VALUES (?, ?, ?, ?, ?, ?)
-                ON CONFLICT(destination_hash) DO UPDATE SET
-                    identity_hash = excluded.identity_hash,
-                    last_seen = excluded.last_seen,
-                    hops = excluded.hops,
-                    app_data = excluded.app_data
-            ''', (peer_hash, identity_hash, 'lxmf.delivery', now, hops, app_data.hex() if app_data else None))
-
-            conn.commit()
-            conn.close()
\ No newline at end of file
+        # Solo memoria sul thread di Reticulum: la scrittura la fa AnnounceQueue
+        self.messenger.announce_queue.put(
+            peer_hash, identity_hash, display_name, hops,
+            app_data.hex() if app_data else None
+        )
@@ -19,6 +19,8 @@ import wave
 import json
 import re
 
+from core.transfers import TransferTracker
+
 # Import per Codec2
 try:
     from modules.audioproc import decode_codec2, samples_to_wav, encode_codec2
@@ -81,6 +83,8 @@ class LXMFMessageSender:
         self.conversations_dir = conversations_dir
         self.downloads_dir = downloads_dir
         self.config = load_config()
+        # Avanzamento dei file: un solo scheduler per tutti i trasferimenti
+        self.transfers = TransferTracker()
         
         self._processed_messages = set()
         self._processed_lock = threading.Lock()
@@ -1152,63 +1156,30 @@ class LXMFMessageSender:
     # ========== MONITORAGGIO PROGRESSO ==========
     
     def _start_progress_monitor(self, message, dest_hash, file_path, file_size, msg_data, msg_id):
-        """Avvia monitoraggio progresso in thread separato"""
-        
-        def monitor_progress():
-            last_progress = 0
-            last_bytes = 0
-            last_time = time.time()
-            update_count = 0
-            start_time = msg_data.get('transfer_start', time.time())
-            
-            while True:
-                time.sleep(0.5)
-                try:
-                    if hasattr(message, 'progress'):
-                        current_progress = message.progress * 100
-                        current_bytes = file_size * (current_progress / 100)
-                        current_time = time.time()
-                        
-                        elapsed_instant = current_time - last_time
-                        if elapsed_instant > 0 and current_bytes > last_bytes:
-                            instant_speed = (current_bytes - last_bytes) / elapsed_instant
-                        else:
-                            instant_speed = 0
-                        
-                        elapsed_total = current_time - start_time
-                        avg_speed = current_bytes / elapsed_total if elapsed_total > 0 else 0
-                        
-                        if abs(current_progress - last_progress) > 0.5 or update_count % 10 == 0:
-                            last_progress = current_progress
-                            last_bytes = current_bytes
-                            last_time = current_time
-                            update_count += 1
-                            
-                            with self.messages_lock:
-                                for m in self.messages_buffer:
-                                    if m.get('message_id') == msg_id:
-                                        m['progress'] = current_progress
-                                        m['speed'] = instant_speed
-                                        m['avg_speed'] = avg_speed
-                                        m['elapsed'] = elapsed_total
-                                        m['bytes_sent'] = current_bytes
-                                        m['eta'] = (file_size - current_bytes) / instant_speed if instant_speed > 0 else 0
-                                        m['last_update'] = current_time
-                                        break
-                            
-                            if int(current_progress) % 10 == 0 and int(current_progress) > 0:
-                                print(f"📊 Progresso: {current_progress:.1f}% - "
-                                      f"⚡ {self._format_speed(instant_speed)} - "
-                                      f"📈 Media {self._format_speed(avg_speed)}")
-                    
-                    if message.state in [LXMF.LXMessage.DELIVERED, LXMF.LXMessage.FAILED]:
+        """Registra il trasferimento nel TransferTracker (nessun thread dedicato)"""
+        last_logged = [0]
+        
+        def on_update(info):
+            with self.messages_lock:
+                for m in self.messages_buffer:
+                    if m.get('message_id') == msg_id:
+                        m['progress'] = info['progress']
+                        m['speed'] = info['speed']
+                        m['avg_speed'] = info['avg_speed']
+                        m['elapsed'] = info['elapsed']
+                        m['bytes_sent'] = info['bytes_sent']
+                        m['eta'] = info['eta'] or 0
+                        m['last_update'] = time.time()
                         break
-                        
-                except Exception as e:
-                    print(f"Errore monitor progresso: {e}")
-                    break
+            
+            step = int(info['progress']) // 10 * 10
+            if step > last_logged[0]:
+                last_logged[0] = step
+                print(f"📊 Progresso: {info['progress']:.1f}% - "
+                      f"⚡ {self._format_speed(info['speed'])} - "
+                      f"📈 Media {self._format_speed(info['avg_speed'])}")
         
-        threading.Thread(target=monitor_progress, daemon=True).start()
+        self.transfers.track(msg_id, message, total_bytes=file_size, on_update=on_update)
     
     # ========== SALVATAGGIO MESSAGGI ==========
     
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Modulo per il calcolo degli hash di destinazione RNS
+Calcola in un'unica passata la matrice identità × aspect senza invocare rnid
+per ogni aspect: hash destinazione = SHA256(name_hash + identity_hash)[:16]
+"""
+
+import os
+import re
+import hashlib
+import threading
+import subprocess
+from functools import lru_cache
+
+# Lunghezze come in RNS.Identity / RNS.Destination
+NAME_HASH_LENGTH = 80 // 8
+TRUNCATED_HASH_LENGTH = 128 // 8
+
+# app.aspect1.aspect2 (niente spazi, niente punti vuoti)
+ASPECT_PATTERN = re.compile(r'^[A-Za-z0-9_\-]+(\.[A-Za-z0-9_\-]+)+$')
+HASH_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+# Limiti per singola richiesta
+MAX_IDENTITIES = 200
+MAX_ASPECTS = 200
+
+
+@lru_cache(maxsize=4096)
+def name_hash(aspect):
+    """Name hash (10 byte) di un aspect completo 'app.aspect...' - calcolato una sola volta"""
+    return hashlib.sha256(aspect.encode('utf-8')).digest()[:NAME_HASH_LENGTH]
+
+
+def is_valid_aspect(aspect):
+    return isinstance(aspect, str) and bool(ASPECT_PATTERN.match(aspect))
+
+
+def destination_hash(identity_hash, aspect):
+    """Hash di destinazione (hex) per un identity hash in bytes e un aspect"""
+    material = name_hash(aspect) + identity_hash
+    return hashlib.sha256(material).digest()[:TRUNCATED_HASH_LENGTH].hex()
+
+
+def compute_matrix(identity_hashes, aspects):
+    """
+    Matrice identità × aspect: una riga per identity hash (hex o None),
+    una colonna per aspect. I name hash sono precalcolati una sola volta.
+    """
+    name_hashes = [name_hash(aspect) for aspect in aspects]
+    matrix = []
+    for identity_hex in identity_hashes:
+        if not identity_hex:
+            matrix.append([None] * len(aspects))
+            continue
+        identity_bytes = bytes.fromhex(identity_hex)
+        matrix.append([
+            hashlib.sha256(nh + identity_bytes).digest()[:TRUNCATED_HASH_LENGTH].hex()
+            for nh in name_hashes
+        ])
+    return matrix
+
+
+# ============================================
+# === RISOLUZIONE IDENTITY HASH ===
+# ============================================
+
+class IdentityHashResolver:
+    """
+    Ricava l'identity hash da un file identità.
+    Usa RNS.Identity se disponibile, altrimenti una sola chiamata rnid --print-identity.
+    Il risultato è in cache per (path, mtime, size).
+    """
+
+    def __init__(self, rnid_path):
+        self.rnid_path = rnid_path
+        self.cache = {}
+        self.lock = threading.Lock()
+        self._rns = None
+        self._rns_checked = False
+
+    def _get_rns(self):
+        if not self._rns_checked:
+            self._rns_checked = True
+            try:
+                import RNS
+                self._rns = RNS
+            except ImportError:
+                self._rns = None
+        return self._rns
+
+    def _load_hash(self, path):
+        RNS = self._get_rns()
+        if RNS is not None:
+            try:
+                identity = RNS.Identity.from_file(path)
+                if identity is not None:
+                    return identity.hash.hex()
+            except Exception:
+                pass
+
+        result = subprocess.run(
+            [self.rnid_path, '-i', path, '--print-identity'],
+            capture_output=True,
+            text=True,
+            timeout=3
+        )
+        if result.returncode == 0:
+            match = re.search(r'Loaded Identity <([0-9a-f]+)>', result.stdout)
+            if match:
+                return match.group(1)
+        return None
+
+    def resolve(self, identity):
+        """
+        Accetta un path di file identità, 'public:<hash>' o un identity hash hex.
+        Restituisce l'identity hash hex oppure None.
+        """
+        identity = (identity or '').strip()
+        if identity.startswith('public:'):
+            identity = identity.replace('public:', '')
+        candidate = identity.strip('<>').lower()
+        if HASH_PATTERN.match(candidate):
+            return candidate
+
+        if not os.path.isfile(identity):
+            return None
+
+        stat = os.stat(identity)
+        key = (identity, stat.st_mtime, stat.st_size)
+        with self.lock:
+            if key in self.cache:
+                return self.cache[key]
+
+        try:
+            identity_hash = self._load_hash(identity)
+        except Exception:
+            identity_hash = None
+
+        with self.lock:
+            self.cache[key] = identity_hash
+        return identity_hash
+
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
+
+
+# ============================================
+# === BLUEPRINT FLASK ===
+# ============================================
+
+def create_aspects_blueprint(resolver, default_aspects):
+    """Crea un blueprint Flask con la route per la matrice degli aspect"""
+    from flask import Blueprint, request, jsonify
+
+    aspects_bp = Blueprint('aspects', __name__, url_prefix='/api/identities/aspects')
+
+    @aspects_bp.route('', methods=['POST'])
+    def aspects_matrix():
+        """
+        Body: {"identities": ["/path/identity", "public:<hash>", ...],
+               "aspects": [...] (opzionale, default RNS_ASPECTS),
+               "custom_aspects": [...] (opzionale)}
+        """
+        try:
+            data = request.json or {}
+            identities = data.get('identities', [])
+            aspects = data.get('aspects') or list(default_aspects)
+            custom = data.get('custom_aspects') or []
+
+            if not isinstance(identities, list) or not identities:
+                return jsonify({'success': False, 'error': 'Nessuna identità specificata'})
+            if len(identities) > MAX_IDENTITIES:
+                return jsonify({'success': False, 'error': f'Troppe identità (max {MAX_IDENTITIES})'})
+
+            # Unisce aspect standard e personalizzati mantenendo l'ordine
+            all_aspects = []
+            for aspect in list(aspects) + list(custom):
+                aspect = str(aspect).strip()
+                if not is_valid_aspect(aspect):
+                    return jsonify({'success': False, 'error': f'Aspect non valido: {aspect}'})
+                if aspect not in all_aspects:
+                    all_aspects.append(aspect)
+            if len(all_aspects) > MAX_ASPECTS:
+                return jsonify({'success': False, 'error': f'Troppi aspect (max {MAX_ASPECTS})'})
+
+            identity_hashes = [resolver.resolve(identity) for identity in identities]
+            matrix = compute_matrix(identity_hashes, all_aspects)
+
+            rows = []
+            for identity, identity_hash, hashes in zip(identities, identity_hashes, matrix):
+                rows.append({
+                    'identity': identity,
+                    'rns_hash': identity_hash,
+                    'valid': identity_hash is not None,
+                    'aspect_hashes': dict(zip(all_aspects, hashes)) if identity_hash else {}
+                })
+
+            return jsonify({
+                'success': True,
+                'aspects': all_aspects,
+                'identities': rows,
+                'matrix': matrix
+            })
+
+        except Exception as e:
+            return jsonify({'success': False, 'error': str(e)})
+
+    return aspects_bp
@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+"""
+Modulo per le operazioni crittografiche BATCH con rnid
+Firma, verifica, cifratura e decifratura di molti elementi in parallelo
+su un pool di processi dimensionato sui core, con risultati in streaming SSE
+"""
+
+import os
+import re
+import json
+import time
+import base64
+import shutil
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Operazioni supportate
+BATCH_OPERATIONS = ('sign', 'verify', 'encrypt', 'decrypt')
+
+# Limite elementi per singola richiesta
+MAX_BATCH_SIZE = 500
+
+# Timeout per singola invocazione di rnid (secondi)
+RNID_TIMEOUT = 30
+
+
+# ============================================
+# === WORKER (eseguito nei processi del pool) ===
+# ============================================
+
+def _identity_args(identity):
+    """Argomenti rnid per l'identità: file privato o 'public:<hash>'"""
+    if identity.startswith('public:'):
+        return ['-R', '-i', identity.replace('public:', '')]
+    return ['-i', identity]
+
+
+def _read_input(op, dest_path):
+    """Scrive nel file di lavoro l'input dell'operazione (testo, base64 o file)"""
+    if op.get('file'):
+        src = op['file']
+        if not os.path.exists(src):
+            raise ValueError(f"File non trovato: {src}")
+        shutil.copyfile(src, dest_path)
+    elif op.get('data_b64'):
+        with open(dest_path, 'wb') as f:
+            f.write(base64.b64decode(op['data_b64']))
+    elif op.get('text') is not None and op.get('text') != '':
+        with open(dest_path, 'w') as f:
+            f.write(op['text'])
+    else:
+        raise ValueError("Nessun dato in input")
+
+
+def _output_payload(path, as_text):
+    """Legge il file prodotto da rnid e lo restituisce come testo o base64"""
+    with open(path, 'rb') as f:
+        raw = f.read()
+    if as_text:
+        try:
+            return {'text': raw.decode('utf-8').strip()}
+        except UnicodeDecodeError:
+            pass
+    return {'data_b64': base64.b64encode(raw).decode('ascii')}
+
+
+def _save_output(src_path, output_dir, filename):
+    """Copia il risultato di un'operazione su file nella cartella download"""
+    os.makedirs(output_dir, exist_ok=True)
+    dest = os.path.join(output_dir, filename)
+    if os.path.exists(dest):
+        base, ext = os.path.splitext(filename)
+        dest = os.path.join(output_dir, f"{base}_{int(time.time() * 1000)}{ext}")
+    shutil.copyfile(src_path, dest)
+    return dest
+
+
+def run_crypto_operation(rnid_cmd, tmp_root, output_dir, index, op):
+    """
+    Esegue UNA operazione rnid in una cartella temporanea dedicata.
+    Funzione top-level per essere serializzabile verso i processi del pool.
+    """
+    kind = op.get('op', '')
+    identity = op.get('identity', '')
+    result = {'index': index, 'id': op.get('id'), 'op': kind, 'identity': identity}
+    start = time.time()
+
+    workdir = tempfile.mkdtemp(prefix='batch_', dir=tmp_root)
+    try:
+        file_name = os.path.basename(op['file']) if op.get('file') else None
+        args = _identity_args(identity)
+
+        if kind == 'encrypt':
+            payload = os.path.join(workdir, 'payload')
+            _read_input(op, payload)
+            cmd = [rnid_cmd] + args + ['-e', payload]
+            proc = subprocess.run(cmd, capture_output=True, text=True, timeout=RNID_TIMEOUT)
+            out_path = payload + '.rfe'
+            if proc.returncode != 0 or not os.path.exists(out_path):
+                raise RuntimeError(f"Errore cifratura: {(proc.stderr or proc.stdout)[:200]}")
+            if file_name:
+                result['output_path'] = _save_output(out_path, output_dir, file_name + '.rfe')
+            else:
+                result['encrypted'] = _output_payload(out_path, as_text=False)['data_b64']
+
+        elif kind == 'decrypt':
+            payload = os.path.join(workdir, 'payload.rfe')
+            out_path = os.path.join(workdir, 'payload.out')
+            if op.get('encrypted'):
+                with open(payload, 'wb') as f:
+                    f.write(base64.b64decode(op['encrypted'].strip()))
+            else:
+                _read_input(op, payload)
+            cmd = [rnid_cmd] + args + ['-d', payload, '-w', out_path, '-f']
+            proc = subprocess.run(cmd, capture_output=True, text=True, timeout=RNID_TIMEOUT)
+            if proc.returncode != 0 or not os.path.exists(out_path):
+                raise RuntimeError(f"Errore decifratura: {(proc.stderr or proc.stdout)[:200]}")
+            if file_name:
+                plain_name = file_name[:-4] if file_name.lower().endswith('.rfe') else file_name + '.dec'
+                result['output_path'] = _save_output(out_path, output_dir, plain_name)
+            else:
+                decoded = _output_payload(out_path, as_text=True)
+                if 'text' in decoded:
+                    result['decrypted'] = decoded['text']
+                else:
+                    result['decrypted_b64'] = decoded['data_b64']
+
+        elif kind == 'sign':
+            payload = os.path.join(workdir, 'payload')
+            _read_input(op, payload)
+            cmd = [rnid_cmd] + args + ['-s', payload, '-f']
+            proc = subprocess.run(cmd, capture_output=True, text=True, timeout=RNID_TIMEOUT)
+            sig_path = payload + '.rsg'
+            if proc.returncode != 0 or not os.path.exists(sig_path):
+                raise RuntimeError(f"Errore firma: {(proc.stderr or proc.stdout)[:200]}")
+            if file_name:
+                result['output_path'] = _save_output(sig_path, output_dir, file_name + '.rsg')
+            else:
+                result['signature'] = _output_payload(sig_path, as_text=False)['data_b64']
+
+        elif kind == 'verify':
+            payload = os.path.join(workdir, 'payload')
+            sig_path = payload + '.rsg'
+            _read_input(op, payload)
+            if op.get('signature'):
+                with open(sig_path, 'wb') as f:
+                    f.write(base64.b64decode(op['signature']))
+            elif op.get('signature_file') and os.path.exists(op['signature_file']):
+                shutil.copyfile(op['signature_file'], sig_path)
+            else:
+                raise ValueError("Nessuna firma da verificare")
+            cmd = [rnid_cmd] + args + ['-V', sig_path]
+            proc = subprocess.run(cmd, capture_output=True, text=True, timeout=RNID_TIMEOUT)
+            if proc.returncode != 0 and 'invalid' not in proc.stdout.lower():
+                raise RuntimeError(f"Errore verifica: {(proc.stderr or proc.stdout)[:200]}")
+            stdout = proc.stdout.lower()
+            if 'is invalid' in stdout:
+                result['valid'] = False
+            elif 'is valid' in stdout:
+                result['valid'] = True
+            else:
+                result['valid'] = None
+            result['output'] = re.sub(r'\x1b\[[0-9;]*m', '', proc.stdout).strip()
+
+        else:
+            raise ValueError(f"Operazione non supportata: {kind}")
+
+        result['success'] = True
+
+    except subprocess.TimeoutExpired:
+        result['success'] = False
+        result['error'] = f"Timeout rnid ({RNID_TIMEOUT}s)"
+    except Exception as e:
+        result['success'] = False
+        result['error'] = str(e)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    result['elapsed'] = round(time.time() - start, 3)
+    return result
+
+
+# ============================================
+# === MANAGER DEL POOL ===
+# ============================================
+
+class CryptoBatchManager:
+    """Gestisce il pool di processi per le operazioni crittografiche batch"""
+
+    def __init__(self, rnid_path, tmp_dir, output_dir, max_workers=None):
+        self.rnid_path = rnid_path
+        self.tmp_dir = os.path.join(tmp_dir, 'batch')
+        self.output_dir = output_dir
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.executor = None
+        self.lock = threading.Lock()
+        self.stats = {'batches': 0, 'operations': 0, 'failed': 0}
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        print(f"[✓] Crypto batch: {self.max_workers} worker")
+
+    def _get_executor(self):
+        """Crea il pool alla prima richiesta (i processi restano caldi)"""
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            return self.executor
+
+    def validate(self, operations):
+        """Controlla la lista di operazioni, restituisce un messaggio d'errore o None"""
+        if not isinstance(operations, list) or not operations:
+            return "Nessuna operazione specificata"
+        if len(operations) > MAX_BATCH_SIZE:
+            return f"Troppe operazioni (max {MAX_BATCH_SIZE})"
+
+        for i, op in enumerate(operations):
+            if not isinstance(op, dict):
+                return f"Operazione {i}: formato non valido"
+            kind = op.get('op')
+            identity = op.get('identity', '')
+            if kind not in BATCH_OPERATIONS:
+                return f"Operazione {i}: tipo '{kind}' non supportato"
+            if not identity:
+                return f"Operazione {i}: identità non specificata"
+            if identity.startswith('public:'):
+                if kind in ('sign', 'decrypt'):
+                    return f"Operazione {i}: per {kind} serve un'identità PRIVATA!"
+            elif not os.path.exists(identity):
+                return f"Operazione {i}: identità non trovata"
+        return None
+
+    def run(self, operations):
+        """Generatore: invia tutte le operazioni al pool e restituisce i risultati appena pronti"""
+        executor = self._get_executor()
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+        futures = {
+            executor.submit(run_crypto_operation, self.rnid_path, self.tmp_dir,
+                            self.output_dir, i, op): i
+            for i, op in enumerate(operations)
+        }
+
+        failed = 0
+        try:
+            for future in as_completed(futures):
+                try:
+                    item = future.result()
+                except Exception as e:
+                    op = operations[futures[future]]
+                    item = {'index': futures[future], 'id': op.get('id'), 'op': op.get('op'),
+                            'success': False, 'error': str(e)}
+                if not item.get('success'):
+                    failed += 1
+                yield item
+        finally:
+            # Client disconnesso: annulla quello che non è ancora partito
+            for future in futures:
+                future.cancel()
+            with self.lock:
+                self.stats['batches'] += 1
+                self.stats['operations'] += len(operations)
+                self.stats['failed'] += failed
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'workers': self.max_workers,
+                'pool_active': self.executor is not None,
+                'max_batch_size': MAX_BATCH_SIZE,
+                'operations': list(BATCH_OPERATIONS),
+                **self.stats
+            }
+
+    def stop(self):
+        """Ferma il pool di processi"""
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=False, cancel_futures=True)
+                self.executor = None
+
+
+# ============================================
+# === BLUEPRINT FLASK ===
+# ============================================
+
+def create_crypto_blueprint(crypto_manager):
+    """Crea un blueprint Flask con le route per le operazioni batch"""
+    from flask import Blueprint, request, jsonify, Response, stream_with_context
+
+    crypto_bp = Blueprint('crypto_batch', __name__, url_prefix='/api/identities/batch')
+
+    @crypto_bp.route('', methods=['POST'])
+    def batch_run():
+        """
+        Esegue una lista di operazioni e restituisce i risultati in SSE.
+        Body: {"operations": [{"op": "verify", "identity": "...", "text": "...", "signature": "..."}, ...]}
+        """
+        try:
+            data = request.json or {}
+            operations = data.get('operations', [])
+
+            error = crypto_manager.validate(operations)
+            if error:
+                return jsonify({'success': False, 'error': error})
+
+            def generate():
+                start = time.time()
+                ok = 0
+                failed = 0
+                yield f"data: {json.dumps({'type': 'start', 'total': len(operations), 'workers': crypto_manager.max_workers})}\n\n"
+
+                for item in crypto_manager.run(operations):
+                    if item.get('success'):
+                        ok += 1
+                    else:
+                        failed += 1
+                    yield f"data: {json.dumps({'type': 'result', **item})}\n\n"
+
+                yield f"data: {json.dumps({'type': 'done', 'ok': ok, 'failed': failed, 'elapsed': round(time.time() - start, 3)})}\n\n"
+
+            return Response(
+                stream_with_context(generate()),
+                mimetype="text/event-stream",
+                headers={
+                    'Cache-Control': 'no-cache',
+                    'X-Accel-Buffering': 'no'
+                }
+            )
+
+        except Exception as e:
+            return jsonify({'success': False, 'error': str(e)})
+
+    @crypto_bp.route('/stats')
+    def batch_stats():
+        return jsonify({
+            'success': True,
+            **crypto_manager.get_stats()
+        })
+
+    return crypto_bp
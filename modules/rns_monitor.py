@@ -15,6 +15,8 @@ import sqlite3
 import sys
 from datetime import datetime, timedelta
 
+from core.announce_bridge import AnnouncePublisher
+
 try:
     multiprocessing.set_start_method('fork', force=True)
 except RuntimeError:
@@ -522,6 +524,18 @@ class SQLiteAnnounceCache:
 # ============================================
 # === PROCESSO MONITOR ===
 # ============================================
+def _rpc_serialize(obj):
+    """Converte ricorsivamente bytes in hex per la serializzazione JSON"""
+    if isinstance(obj, (bytes, bytearray)):
+        return obj.hex()
+    if isinstance(obj, dict):
+        return {str(k): _rpc_serialize(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_rpc_serialize(v) for v in obj]
+    if obj is None or isinstance(obj, (str, int, float, bool)):
+        return obj
+    return str(obj)
+
 def run_rns_monitor(socket_path, aspects, host=None, port=None):
     """Processo separato con il monitor RNS - ORA CON DATI RADIO COMPLETI"""
     import RNS
@@ -531,6 +545,10 @@ def run_rns_monitor(socket_path, aspects, host=None, port=None):
     import os
     import traceback
     from datetime import datetime
+    try:
+        import LXMF
+    except ImportError:
+        LXMF = None
     
     class AnnounceMonitor:
         aspect_filter = None
@@ -541,15 +559,48 @@ def run_rns_monitor(socket_path, aspects, host=None, port=None):
             self.cache = {}
             self.seen_packets = set()
             self.socket = sock
+            self.send_lock = threading.Lock()
             self.ASPECTS = aspects
         
         def send_announce(self, data):
             try:
                 message = json.dumps(data) + "\n"
-                self.socket.send(message.encode('utf-8'))
+                with self.send_lock:
+                    self.socket.sendall(message.encode('utf-8'))
             except:
                 pass
         
+        def handle_rpc(self, reticulum, line):
+            """Esegue una richiesta di controllo arrivata da Flask e invia la risposta"""
+            try:
+                req = json.loads(line)
+            except json.JSONDecodeError:
+                return
+            
+            response = {'type': 'rpc_response', 'rpc_id': req.get('rpc_id')}
+            method = req.get('method')
+            params = req.get('params') or {}
+            
+            try:
+                if method == 'interface_stats':
+                    result = reticulum.get_interface_stats()
+                elif method == 'path_table':
+                    result = reticulum.get_path_table(max_hops=params.get('max_hops'))
+                elif method == 'probe':
+                    result = self.probe_runner.submit(params)
+                elif method == 'ping':
+                    result = {'pid': os.getpid(), 'time': time.time()}
+                else:
+                    raise ValueError(f"Metodo RPC sconosciuto: {method}")
+                response['success'] = True
+                response['result'] = _rpc_serialize(result)
+            except Exception as e:
+                response['success'] = False
+                response['error'] = str(e)
+            
+            if req.get('rpc_id') is not None:
+                self.send_announce(response)
+        
         def get_packet_metadata(self, packet_hash):
             """Ottiene metadati dal pacchetto incluso RSSI/SNR/Q"""
             try:
@@ -615,6 +666,14 @@ def run_rns_monitor(socket_path, aspects, host=None, port=None):
                             if len(entry) > 1 and entry[1]:
                                 via = entry[1].hex()[:16] + "..."
                 
+                # Nome LXMF risolto qui, una volta sola per tutti (messenger compreso)
+                display_name = None
+                if aspect == "lxmf.delivery" and app_data and LXMF:
+                    try:
+                        display_name = LXMF.display_name_from_app_data(app_data)
+                    except Exception:
+                        display_name = None
+                
                 print(f"[{ts}] #{self.count:04d} id: {identity_hash[:32] if identity_hash else '?'*32} dest: {dest_hex[:32]}... hops: {hops} aspect: {aspect} iface: {interface} data: '{app_text[:50]}' RSSI:{rssi} SNR:{snr} Q:{q}")
                 
                 announce_data = {
@@ -636,6 +695,8 @@ def run_rns_monitor(socket_path, aspects, host=None, port=None):
                     'ip': ip,
                     'port': port,
                     'data': app_text,
+                    'app_data_hex': app_data.hex() if app_data else None,
+                    'display_name': display_name,
                     'data_length': len(app_data) if app_data else 0,
                     'has_identity': announced_identity is not None,
                     'rssi': rssi,
@@ -690,6 +751,130 @@ def run_rns_monitor(socket_path, aspects, host=None, port=None):
             
             return "unknown"
     
+    class ProbeRunner:
+        """
+        Esegue i probe senza bloccare: ogni probe è una piccola macchina a stati
+        (attesa percorso -> inviato -> concluso) avanzata da un solo thread
+        """
+        
+        def __init__(self, monitor):
+            self.monitor = monitor
+            self.active = []
+            self.lock = threading.Lock()
+            threading.Thread(target=self._loop, daemon=True).start()
+        
+        def submit(self, params):
+            dest_hex = params.get('destination', '').strip().strip('<>').lower()
+            probe = {
+                'probe_id': params.get('probe_id'),
+                'destination': dest_hex,
+                'aspect': params.get('aspect', 'rnstransport.probe'),
+                'size': int(params.get('size', 16)),
+                'timeout': float(params.get('timeout', 15)),
+                'started': time.time(),
+                'state': 'path',
+                'receipt': None
+            }
+            
+            try:
+                dest = bytes.fromhex(dest_hex)
+                if len(dest) != RNS.Reticulum.TRUNCATED_HASHLENGTH // 8:
+                    raise ValueError()
+            except ValueError:
+                self._finish(probe, False, error='Hash destinazione non valido')
+                return {'queued': False}
+            
+            probe['dest'] = dest
+            if not RNS.Transport.has_path(dest):
+                RNS.Transport.request_path(dest)
+            
+            with self.lock:
+                self.active.append(probe)
+            return {'queued': True, 'active': len(self.active)}
+        
+        def _loop(self):
+            while True:
+                time.sleep(0.1)
+                with self.lock:
+                    probes = list(self.active)
+                
+                for probe in probes:
+                    try:
+                        done = self._step(probe)
+                    except Exception as e:
+                        self._finish(probe, False, error=str(e))
+                        done = True
+                    
+                    if done:
+                        with self.lock:
+                            if probe in self.active:
+                                self.active.remove(probe)
+        
+        def _step(self, probe):
+            elapsed = time.time() - probe['started']
+            
+            if probe['state'] == 'path':
+                if RNS.Transport.has_path(probe['dest']):
+                    self._send(probe, probe['timeout'] - elapsed)
+                    probe['state'] = 'sent'
+                    return False
+                if elapsed > probe['timeout']:
+                    self._finish(probe, False, error='Percorso non trovato')
+                    return True
+                return False
+            
+            receipt = probe['receipt']
+            if receipt.status == RNS.PacketReceipt.DELIVERED:
+                rtt = receipt.get_rtt()
+                rssi = snr = q = None
+                if receipt.proof_packet is not None:
+                    rssi, snr, q = self.monitor.get_packet_metadata(receipt.proof_packet.packet_hash)
+                self._finish(probe, True, rtt=rtt, rssi=rssi, snr=snr, q=q)
+                return True
+            
+            if receipt.status == RNS.PacketReceipt.FAILED or elapsed > probe['timeout'] + 1:
+                self._finish(probe, False, error='Timeout')
+                return True
+            
+            return False
+        
+        def _send(self, probe, timeout):
+            identity = RNS.Identity.recall(probe['dest'])
+            if identity is None:
+                raise ValueError('Identità destinazione sconosciuta')
+            
+            parts = probe['aspect'].split('.')
+            destination = RNS.Destination(identity, RNS.Destination.OUT, RNS.Destination.SINGLE, parts[0], *parts[1:])
+            if destination.hash != probe['dest']:
+                raise ValueError(f"La destinazione non corrisponde all'aspect {probe['aspect']}")
+            
+            packet = RNS.Packet(destination, os.urandom(probe['size']))
+            receipt = packet.send()
+            if not receipt:
+                raise RuntimeError('Invio probe fallito')
+            receipt.set_timeout(max(timeout, 1))
+            probe['receipt'] = receipt
+        
+        def _finish(self, probe, success, rtt=None, rssi=None, snr=None, q=None, error=None):
+            hops = None
+            if probe.get('dest') and RNS.Transport.has_path(probe['dest']):
+                hops = RNS.Transport.hops_to(probe['dest'])
+            
+            self.monitor.send_announce({
+                'type': 'probe_result',
+                'probe_id': probe['probe_id'],
+                'destination': probe['destination'],
+                'aspect': probe['aspect'],
+                'timestamp': time.time(),
+                'success': success,
+                'rtt': round(rtt * 1000, 3) if rtt is not None else None,
+                'hops': hops,
+                'rssi': rssi,
+                'snr': snr,
+                'q': q,
+                'error': error
+            })
+    
     try:
         if not IS_WINDOWS and socket_path and os.path.exists(socket_path):
             os.unlink(socket_path)
@@ -734,13 +919,32 @@ def run_rns_monitor(socket_path, aspects, host=None, port=None):
         
         reticulum = RNS.Reticulum()
         monitor = AnnounceMonitor(client_socket)
+        monitor.probe_runner = ProbeRunner(monitor)
         RNS.Transport.register_announce_handler(monitor)
         
         print("[MONITOR] ✅ In ascolto annunci...")
         print("[MONITOR] " + "="*80)
         
+        # Canale di controllo: richieste RPC (JSON per riga) da Flask sullo stesso socket
+        rpc_buffer = ""
         while True:
-            time.sleep(1)
+            try:
+                data = client_socket.recv(16384)
+            except OSError:
+                data = b''
+            
+            if not data:
+                # Flask disconnesso: continua solo a ricevere annunci
+                while True:
+                    time.sleep(1)
+            
+            rpc_buffer += data.decode('utf-8', errors='ignore')
+            lines = rpc_buffer.split('\n')
+            rpc_buffer = lines[-1]
+            
+            for line in lines[:-1]:
+                if line.strip():
+                    monitor.handle_rpc(reticulum, line)
             
     except Exception as e:
         print(f"[MONITOR] ❌ Errore: {e}")
@@ -773,6 +977,17 @@ class RNSMonitorManager:
         self.history_lock = threading.Lock()
         self.announce_queue = queue.Queue(maxsize=1000)
         
+        # Canale RPC verso il processo monitor (stesso socket degli annunci)
+        self.sock = None
+        self.send_lock = threading.Lock()
+        self.rpc_pending = {}
+        self.rpc_lock = threading.Lock()
+        self.rpc_counter = 0
+        self.message_handlers = {}
+        
+        # Ponte verso il messenger di lxmf_chat.py (announce lxmf.delivery già risolti)
+        self.bridge = AnnouncePublisher()
+        
         # Cache SQLite
         self.announce_cache = SQLiteAnnounceCache(cache_dir) if cache_dir else None
         
@@ -802,6 +1017,7 @@ class RNSMonitorManager:
     def start_listener(self):
         """Avvia il thread listener per il socket"""
         self.running = True
+        self.bridge.start()
         self.listener_thread = threading.Thread(target=self._socket_listener, daemon=True)
         self.listener_thread.start()
         time.sleep(1)
@@ -831,11 +1047,14 @@ class RNSMonitorManager:
                         sock.connect(self.socket_path)
                         sock.settimeout(None)
                         print("[MonitorManager] ✅ Connesso al monitor socket")
+                    
+                    self.sock = sock
                 
                 data = sock.recv(16384).decode('utf-8')
                 if not data:
                     sock.close()
                     sock = None
+                    self.sock = None
                     time.sleep(2)
                     continue
                 
@@ -848,6 +1067,20 @@ class RNSMonitorManager:
                         try:
                             announce = json.loads(line)
                             
+                            # Risposta a una richiesta RPC
+                            if announce.get('type') == 'rpc_response':
+                                self._resolve_rpc(announce)
+                                continue
+                            
+                            # Altri messaggi di controllo (es. risultati probe)
+                            handler = self.message_handlers.get(announce.get('type'))
+                            if handler:
+                                try:
+                                    handler(announce)
+                                except Exception as e:
+                                    print(f"[MonitorManager] Errore handler {announce.get('type')}: {e}")
+                                continue
+                            
                             with self.history_lock:
                                 # INCREMENTA IL CONTATORE UNICO
                                 self.announce_counter += 1
@@ -868,6 +1101,9 @@ class RNSMonitorManager:
                             except queue.Full:
                                 pass
                             
+                            if announce.get('aspect') == 'lxmf.delivery':
+                                self.bridge.publish(announce)
+                            
                             rssi = announce.get('rssi')
                             snr = announce.get('snr')
                             q = announce.get('q')
@@ -882,14 +1118,55 @@ class RNSMonitorManager:
                 if sock:
                     sock.close()
                     sock = None
+                    self.sock = None
                 time.sleep(2)
             except Exception as e:
                 print(f"[MonitorManager] Errore socket: {e}")
                 if sock:
                     sock.close()
                     sock = None
+                    self.sock = None
                 time.sleep(2)
     
+    def register_handler(self, message_type, handler):
+        """Registra una callback per i messaggi di controllo di un certo tipo"""
+        self.message_handlers[message_type] = handler
+    
+    def rpc_call(self, method, params=None, timeout=5):
+        """Invia una richiesta RPC al processo monitor e attende la risposta"""
+        sock = self.sock
+        if sock is None:
+            raise ConnectionError("Monitor non connesso")
+        
+        with self.rpc_lock:
+            self.rpc_counter += 1
+            rpc_id = self.rpc_counter
+            pending = {'event': threading.Event(), 'response': None}
+            self.rpc_pending[rpc_id] = pending
+        
+        try:
+            message = json.dumps({'rpc_id': rpc_id, 'method': method, 'params': params or {}}) + "\n"
+            with self.send_lock:
+                sock.sendall(message.encode('utf-8'))
+            
+            if not pending['event'].wait(timeout):
+                raise TimeoutError(f"Timeout RPC {method}")
+            
+            response = pending['response']
+            if not response.get('success'):
+                raise RuntimeError(response.get('error', 'Errore RPC'))
+            return response.get('result')
+        finally:
+            with self.rpc_lock:
+                self.rpc_pending.pop(rpc_id, None)
+    
+    def _resolve_rpc(self, response):
+        with self.rpc_lock:
+            pending = self.rpc_pending.get(response.get('rpc_id'))
+        if pending:
+            pending['response'] = response
+            pending['event'].set()
+    
     def get_stats(self):
         """Restituisce statistiche unificate - ORA CON DATI SQLITE"""
         with self.history_lock:
@@ -920,6 +1197,7 @@ class RNSMonitorManager:
                 'monitor_alive': self.monitor_process.is_alive() if self.monitor_process else False,
                 'unique_sources': unique_sources,
                 'radio_stats': radio_stats,
+                'bridge': self.bridge.get_stats(),
                 'sqlite': sqlite_stats  # Statistiche complete da SQLite
             }
     
@@ -1110,6 +1388,8 @@ class RNSMonitorManager:
         if self.announce_cache:
             self.announce_cache.stop()
         
+        self.bridge.stop()
+        
         # Ferma processo monitor
         if self.monitor_process and self.monitor_process.is_alive():
             self.monitor_process.terminate()
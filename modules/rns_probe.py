@@ -0,0 +1,579 @@
+#!/usr/bin/env python3
+"""
+Modulo per i probe RNS
+Molti probe in parallelo (con limite) eseguiti dal processo monitor senza
+rnprobe, watchlist di destinazioni con probe ricorrenti e storico
+RTT/hops/successo su SQLite con percentili nel tempo
+"""
+
+import os
+import math
+import time
+import uuid
+import heapq
+import sqlite3
+import threading
+from collections import deque, OrderedDict
+
+
+def percentile(sorted_values, pct):
+    """Percentile nearest-rank su una lista già ordinata"""
+    if not sorted_values:
+        return None
+    k = max(0, min(len(sorted_values) - 1, math.ceil(pct / 100.0 * len(sorted_values)) - 1))
+    return sorted_values[k]
+
+
+# ============================================
+# === STORICO PROBE (SQLite) ===
+# ============================================
+
+class ProbeHistory:
+    """Serie temporale dei risultati dei probe e watchlist persistente"""
+
+    def __init__(self, cache_dir, max_age_days=30):
+        self.db_path = os.path.join(cache_dir, 'probes.db')
+        self.max_age_days = max_age_days
+        self.lock = threading.Lock()
+        self._init_db()
+        print(f"📦 SQLite Probe: {self.db_path}")
+
+    def _init_db(self):
+        conn = sqlite3.connect(self.db_path)
+        c = conn.cursor()
+
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS probe_results (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                timestamp REAL NOT NULL,
+                destination TEXT NOT NULL,
+                aspect TEXT,
+                success INTEGER,
+                rtt REAL,                               -- millisecondi
+                hops INTEGER,
+                rssi REAL,
+                snr REAL,
+                q REAL,
+                error TEXT,
+                job_id TEXT
+            )
+        ''')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_probe_dest_time ON probe_results(destination, timestamp)')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_probe_time ON probe_results(timestamp)')
+
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS probe_watchlist (
+                job_id TEXT PRIMARY KEY,
+                destination TEXT NOT NULL,
+                aspect TEXT,
+                interval INTEGER,
+                timeout REAL,
+                name TEXT,
+                enabled INTEGER DEFAULT 1,
+                created REAL
+            )
+        ''')
+
+        conn.commit()
+        conn.close()
+
+    def add_results(self, results):
+        """Salva più risultati in una sola transazione"""
+        if not results:
+            return
+        with self.lock:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.executemany('''
+                INSERT INTO probe_results
+                (timestamp, destination, aspect, success, rtt, hops, rssi, snr, q, error, job_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', [(
+                result.get('timestamp', time.time()),
+                result.get('destination'),
+                result.get('aspect'),
+                1 if result.get('success') else 0,
+                result.get('rtt'),
+                result.get('hops'),
+                result.get('rssi'),
+                result.get('snr'),
+                result.get('q'),
+                result.get('error'),
+                result.get('job_id')
+            ) for result in results])
+            conn.commit()
+            conn.close()
+
+    def get_series(self, destination, since, until=None, bucket=3600):
+        """Aggrega per intervallo: percentili RTT, tasso di successo, hops medi"""
+        until = until or time.time()
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        rows = conn.execute('''
+            SELECT timestamp, success, rtt, hops FROM probe_results
+            WHERE destination = ? AND timestamp >= ? AND timestamp <= ?
+            ORDER BY timestamp
+        ''', (destination, since, until)).fetchall()
+        conn.close()
+
+        buckets = OrderedDict()
+        for ts, success, rtt, hops in rows:
+            key = int(ts // bucket) * bucket
+            b = buckets.setdefault(key, {'count': 0, 'ok': 0, 'rtts': [], 'hops': []})
+            b['count'] += 1
+            if success:
+                b['ok'] += 1
+                if rtt is not None:
+                    b['rtts'].append(rtt)
+            if hops is not None:
+                b['hops'].append(hops)
+
+        series = []
+        all_rtts = []
+        for key, b in buckets.items():
+            rtts = sorted(b['rtts'])
+            all_rtts.extend(rtts)
+            series.append({
+                'time': key,
+                'count': b['count'],
+                'success_rate': round(b['ok'] / b['count'], 3),
+                'rtt_min': rtts[0] if rtts else None,
+                'rtt_p50': percentile(rtts, 50),
+                'rtt_p90': percentile(rtts, 90),
+                'rtt_p99': percentile(rtts, 99),
+                'rtt_max': rtts[-1] if rtts else None,
+                'hops_avg': round(sum(b['hops']) / len(b['hops']), 2) if b['hops'] else None
+            })
+
+        all_rtts.sort()
+        total = len(rows)
+        ok = sum(1 for r in rows if r[1])
+        summary = {
+            'count': total,
+            'success_rate': round(ok / total, 3) if total else None,
+            'rtt_p50': percentile(all_rtts, 50),
+            'rtt_p90': percentile(all_rtts, 90),
+            'rtt_p99': percentile(all_rtts, 99)
+        }
+        return series, summary
+
+    def get_recent(self, destination=None, limit=100):
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        if destination:
+            rows = conn.execute('''
+                SELECT * FROM probe_results WHERE destination = ?
+                ORDER BY timestamp DESC LIMIT ?
+            ''', (destination, limit)).fetchall()
+        else:
+            rows = conn.execute('SELECT * FROM probe_results ORDER BY timestamp DESC LIMIT ?', (limit,)).fetchall()
+        conn.close()
+        return [dict(r) for r in rows]
+
+    def load_watchlist(self):
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        rows = conn.execute('SELECT * FROM probe_watchlist ORDER BY created').fetchall()
+        conn.close()
+        return [dict(r) for r in rows]
+
+    def save_watch(self, job):
+        with self.lock:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute('''
+                INSERT OR REPLACE INTO probe_watchlist
+                (job_id, destination, aspect, interval, timeout, name, enabled, created)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (job['job_id'], job['destination'], job['aspect'], job['interval'],
+                  job['timeout'], job.get('name'), 1 if job.get('enabled', True) else 0, job['created']))
+            conn.commit()
+            conn.close()
+
+    def delete_watch(self, job_id):
+        with self.lock:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute('DELETE FROM probe_watchlist WHERE job_id = ?', (job_id,))
+            conn.commit()
+            conn.close()
+
+    def cleanup_old(self):
+        cutoff = time.time() - self.max_age_days * 86400
+        with self.lock:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute('DELETE FROM probe_results WHERE timestamp < ?', (cutoff,))
+            conn.commit()
+            conn.close()
+
+
+# ============================================
+# === MOTORE PROBE ===
+# ============================================
+
+class ProbeEngine:
+    """
+    Coda di probe con parallelismo limitato. I probe vengono eseguiti
+    nel processo monitor; i risultati tornano come messaggi 'probe_result'.
+    Un solo thread gestisce coda, watchlist e scadenze e scrive lo storico
+    fuori dal lock, così il listener del monitor non tocca mai SQLite.
+    """
+
+    def __init__(self, monitor_manager, cache_dir, max_concurrent=16, default_timeout=15):
+        self.monitor_manager = monitor_manager
+        self.history = ProbeHistory(cache_dir)
+        self.max_concurrent = max_concurrent
+        self.default_timeout = default_timeout
+
+        self.cond = threading.Condition()
+        self.pending = deque()
+        self.inflight = {}
+        self.results = OrderedDict()
+        self.waiters = {}
+        self.max_results = 2000
+        # Risultati chiusi ma non ancora scritti nello storico
+        self.unsaved = []
+
+        self.watchlist = {}
+        self.schedule = []
+        self.stats = {'submitted': 0, 'completed': 0, 'failed': 0}
+
+        for job in self.history.load_watchlist():
+            self.watchlist[job['job_id']] = job
+            if job.get('enabled'):
+                heapq.heappush(self.schedule, (time.time() + 5, job['job_id']))
+
+        monitor_manager.register_handler('probe_result', self._on_result)
+
+        self.running = True
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+        print(f"[Probe] Motore avviato (max {max_concurrent} in parallelo, {len(self.watchlist)} in watchlist)")
+
+    # === API ===
+
+    def submit(self, destination, aspect='rnstransport.probe', timeout=None, job_id=None):
+        """Accoda un probe e restituisce subito il suo id"""
+        probe_id = str(uuid.uuid4())[:12]
+        probe = {
+            'probe_id': probe_id,
+            'destination': destination.strip().strip('<>').lower(),
+            'aspect': aspect,
+            'timeout': float(timeout or self.default_timeout),
+            'job_id': job_id,
+            'queued': time.time()
+        }
+        with self.cond:
+            self.pending.append(probe)
+            self.waiters[probe_id] = threading.Event()
+            self.stats['submitted'] += 1
+            self.cond.notify()
+        return probe_id
+
+    def wait(self, probe_id, timeout):
+        """Attende il risultato di un probe (usato dalla route compatibile)"""
+        event = self.waiters.get(probe_id)
+        if event:
+            event.wait(timeout)
+        return self.get_result(probe_id)
+
+    def get_result(self, probe_id):
+        with self.cond:
+            if probe_id in self.results:
+                return self.results[probe_id]
+            if probe_id in self.inflight:
+                return {'probe_id': probe_id, 'status': 'running'}
+            if any(p['probe_id'] == probe_id for p in self.pending):
+                return {'probe_id': probe_id, 'status': 'queued'}
+        return None
+
+    def add_watch(self, destination, aspect='rnstransport.probe', interval=300, timeout=None, name=None):
+        job = {
+            'job_id': str(uuid.uuid4())[:8],
+            'destination': destination.strip().strip('<>').lower(),
+            'aspect': aspect,
+            'interval': max(int(interval), 10),
+            'timeout': float(timeout or self.default_timeout),
+            'name': name,
+            'enabled': 1,
+            'created': time.time()
+        }
+        self.history.save_watch(job)
+        with self.cond:
+            self.watchlist[job['job_id']] = job
+            heapq.heappush(self.schedule, (time.time(), job['job_id']))
+            self.cond.notify()
+        return job
+
+    def remove_watch(self, job_id):
+        with self.cond:
+            job = self.watchlist.pop(job_id, None)
+        if job:
+            self.history.delete_watch(job_id)
+        return job is not None
+
+    def get_watchlist(self):
+        with self.cond:
+            jobs = [dict(j) for j in self.watchlist.values()]
+            next_runs = {job_id: ts for ts, job_id in self.schedule}
+        for job in jobs:
+            job['next_run'] = next_runs.get(job['job_id'])
+        return jobs
+
+    def get_stats(self):
+        with self.cond:
+            return {
+                'pending': len(self.pending),
+                'inflight': len(self.inflight),
+                'max_concurrent': self.max_concurrent,
+                'watchlist': len(self.watchlist),
+                **self.stats
+            }
+
+    def stop(self):
+        self.running = False
+        with self.cond:
+            self.cond.notify()
+
+    # === INTERNI ===
+
+    def _loop(self):
+        last_cleanup = time.time()
+        while self.running:
+            to_send = []
+            with self.cond:
+                now = time.time()
+
+                # Watchlist: accoda i job scaduti e li ripianifica
+                while self.schedule and self.schedule[0][0] <= now:
+                    _, job_id = heapq.heappop(self.schedule)
+                    job = self.watchlist.get(job_id)
+                    if not job or not job.get('enabled'):
+                        continue
+                    probe_id = str(uuid.uuid4())[:12]
+                    self.pending.append({
+                        'probe_id': probe_id,
+                        'destination': job['destination'],
+                        'aspect': job['aspect'],
+                        'timeout': job['timeout'],
+                        'job_id': job_id,
+                        'queued': now
+                    })
+                    self.waiters[probe_id] = threading.Event()
+                    self.stats['submitted'] += 1
+                    heapq.heappush(self.schedule, (now + job['interval'], job_id))
+
+                # Probe senza risposta (es. monitor riavviato)
+                for probe_id, probe in list(self.inflight.items()):
+                    if now - probe['sent'] > probe['timeout'] + 15:
+                        self._complete_locked(probe, {
+                            'success': False, 'error': 'Nessuna risposta dal monitor',
+                            'timestamp': now, 'rtt': None, 'hops': None
+                        })
+
+                # Parallelismo limitato
+                while self.pending and len(self.inflight) < self.max_concurrent:
+                    probe = self.pending.popleft()
+                    probe['sent'] = now
+                    self.inflight[probe['probe_id']] = probe
+                    to_send.append(probe)
+
+                if not to_send:
+                    wait = 1.0
+                    if self.schedule:
+                        wait = min(wait, max(self.schedule[0][0] - now, 0.05))
+                    self.cond.wait(wait)
+
+                unsaved, self.unsaved = self.unsaved, []
+
+            self._save(unsaved)
+
+            # Invio fuori dal lock: l'RPC risponde subito, il probe prosegue nel monitor
+            for probe in to_send:
+                try:
+                    self.monitor_manager.rpc_call('probe', {
+                        'probe_id': probe['probe_id'],
+                        'destination': probe['destination'],
+                        'aspect': probe['aspect'],
+                        'timeout': probe['timeout']
+                    })
+                except Exception as e:
+                    with self.cond:
+                        self._complete_locked(probe, {
+                            'success': False, 'error': f'Monitor non disponibile: {e}',
+                            'timestamp': time.time(), 'rtt': None, 'hops': None
+                        })
+
+            if time.time() - last_cleanup > 3600:
+                last_cleanup = time.time()
+                try:
+                    self.history.cleanup_old()
+                except Exception as e:
+                    print(f"[Probe] Errore pulizia storico: {e}")
+
+        with self.cond:
+            unsaved, self.unsaved = self.unsaved, []
+        self._save(unsaved)
+
+    def _save(self, results):
+        try:
+            self.history.add_results(results)
+        except Exception as e:
+            print(f"[Probe] Errore salvataggio risultato: {e}")
+
+    def _on_result(self, message):
+        with self.cond:
+            probe = self.inflight.get(message.get('probe_id'))
+            if not probe:
+                return
+            self._complete_locked(probe, message)
+            self.cond.notify()
+
+    def _complete_locked(self, probe, message):
+        """Chiude un probe (chiamare con self.cond acquisito)"""
+        self.inflight.pop(probe['probe_id'], None)
+        result = {
+            'probe_id': probe['probe_id'],
+            'status': 'done',
+            'destination': probe['destination'],
+            'aspect': probe['aspect'],
+            'job_id': probe.get('job_id'),
+            'timestamp': message.get('timestamp', time.time()),
+            'success': bool(message.get('success')),
+            'rtt': message.get('rtt'),
+            'hops': message.get('hops'),
+            'rssi': message.get('rssi'),
+            'snr': message.get('snr'),
+            'q': message.get('q'),
+            'error': message.get('error')
+        }
+
+        self.results[probe['probe_id']] = result
+        while len(self.results) > self.max_results:
+            old_id, _ = self.results.popitem(last=False)
+            self.waiters.pop(old_id, None)
+
+        self.stats['completed'] += 1
+        if not result['success']:
+            self.stats['failed'] += 1
+
+        # Lo scrive il thread del motore, dopo aver rilasciato il lock
+        self.unsaved.append(result)
+
+        event = self.waiters.get(probe['probe_id'])
+        if event:
+            event.set()
+
+    @staticmethod
+    def format_output(result):
+        """Testo in stile rnprobe per le pagine esistenti"""
+        if result.get('success'):
+            hops = result.get('hops')
+            hop_word = 'hop' if hops == 1 else 'hops'
+            text = f"Valid reply from <{result['destination']}>\nRound-trip time is {result['rtt']:.3f} milliseconds over {hops} {hop_word}"
+            extras = []
+            if result.get('rssi') is not None:
+                extras.append(f"RSSI {result['rssi']} dBm")
+            if result.get('snr') is not None:
+                extras.append(f"SNR {result['snr']} dB")
+            if result.get('q') is not None:
+                extras.append(f"Link Quality {result['q']}%")
+            if extras:
+                text += "\n[" + ", ".join(extras) + "]"
+            return text
+        return f"Probe fallito: {result.get('error') or 'Timeout'}"
+
+
+# ============================================
+# === BLUEPRINT FLASK ===
+# ============================================
+
+def create_probe_blueprint(engine):
+    """Crea un blueprint Flask con le route del motore probe"""
+    from flask import Blueprint, request, jsonify
+
+    probe_bp = Blueprint('probe', __name__, url_prefix='/api/probe')
+
+    @probe_bp.route('/run', methods=['POST'])
+    def probe_run():
+        """Accoda uno o più probe, restituisce subito gli id"""
+        try:
+            data = request.json or {}
+            destinations = data.get('destinations') or ([data['destination']] if data.get('destination') else [])
+            aspect = data.get('aspect', 'rnstransport.probe')
+            timeout = data.get('timeout')
+
+            if not destinations:
+                return jsonify({'success': False, 'error': 'Nessuna destinazione specificata'})
+
+            probes = [{'destination': d, 'probe_id': engine.submit(d, aspect, timeout)} for d in destinations]
+            return jsonify({'success': True, 'probes': probes})
+
+        except Exception as e:
+            return jsonify({'success': False, 'error': str(e)})
+
+    @probe_bp.route('/result/<probe_id>')
+    def probe_result(probe_id):
+        result = engine.get_result(probe_id)
+        if not result:
+            return jsonify({'success': False, 'error': 'Probe non trovato'})
+        return jsonify({'success': True, **result})
+
+    @probe_bp.route('/watchlist', methods=['GET'])
+    def watchlist_get():
+        return jsonify({'success': True, 'jobs': engine.get_watchlist()})
+
+    @probe_bp.route('/watchlist', methods=['POST'])
+    def watchlist_add():
+        try:
+            data = request.json or {}
+            destination = data.get('destination', '')
+            if not destination:
+                return jsonify({'success': False, 'error': 'Nessuna destinazione specificata'})
+
+            job = engine.add_watch(
+                destination,
+                aspect=data.get('aspect', 'rnstransport.probe'),
+                interval=data.get('interval', 300),
+                timeout=data.get('timeout'),
+                name=data.get('name')
+            )
+            return jsonify({'success': True, 'job': job})
+
+        except Exception as e:
+            return jsonify({'success': False, 'error': str(e)})
+
+    @probe_bp.route('/watchlist/<job_id>', methods=['DELETE'])
+    def watchlist_remove(job_id):
+        if not engine.remove_watch(job_id):
+            return jsonify({'success': False, 'error': 'Job non trovato'})
+        return jsonify({'success': True})
+
+    @probe_bp.route('/history/<destination>')
+    def probe_history(destination):
+        """Percentili RTT e tasso di successo per intervallo di tempo"""
+        try:
+            hours = float(request.args.get('hours', 24))
+            bucket = int(request.args.get('bucket', 3600))
+            bucket = max(bucket, 60)
+            since = time.time() - hours * 3600
+
+            series, summary = engine.history.get_series(destination.lower(), since, bucket=bucket)
+            return jsonify({
+                'success': True,
+                'destination': destination,
+                'bucket': bucket,
+                'summary': summary,
+                'series': series
+            })
+
+        except Exception as e:
+            return jsonify({'success': False, 'error': str(e)})
+
+    @probe_bp.route('/recent')
+    def probe_recent():
+        destination = request.args.get('destination')
+        limit = int(request.args.get('limit', 100))
+        return jsonify({'success': True, 'results': engine.history.get_recent(destination, limit)})
+
+    @probe_bp.route('/stats')
+    def probe_stats():
+        return jsonify({'success': True, **engine.get_stats()})
+
+    return probe_bp
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Modulo per lo stato della rete RNS
+Interroga direttamente l'istanza Reticulum del processo monitor (via RPC sul
+socket esistente) invece di lanciare rnstatus/rnpath, con cache a TTL breve
+"""
+
+import time
+import threading
+from datetime import datetime
+
+# Modalità interfacce come in RNS.Interfaces.Interface
+INTERFACE_MODES = {
+    0x01: 'Full',
+    0x04: 'Point-to-Point',
+    0x08: 'Access Point',
+    0x10: 'Roaming',
+    0x20: 'Boundary',
+    0x40: 'Gateway'
+}
+
+
+def format_size(num_bytes):
+    """Dimensione leggibile come in rnstatus"""
+    if num_bytes is None:
+        return '?'
+    size = float(num_bytes)
+    for unit in ('B', 'KB', 'MB', 'GB', 'TB'):
+        if size < 1000 or unit == 'TB':
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.2f} {unit}"
+        size /= 1000
+
+
+def format_speed(bits_per_second):
+    if not bits_per_second:
+        return '0 bps'
+    speed = float(bits_per_second)
+    for unit in ('bps', 'kbps', 'Mbps', 'Gbps'):
+        if speed < 1000 or unit == 'Gbps':
+            return f"{speed:.2f} {unit}"
+        speed /= 1000
+
+
+class NetworkStatusService:
+    """Stato interfacce e tabella dei percorsi con cache a TTL"""
+
+    def __init__(self, monitor_manager, ttl=5, rpc_timeout=5):
+        self.monitor_manager = monitor_manager
+        self.ttl = ttl
+        self.rpc_timeout = rpc_timeout
+        self.cache = {}
+        self.timestamps = {}
+        # Un lock per chiave: richieste contemporanee attendono la stessa chiamata
+        self.locks = {'interface_stats': threading.Lock(), 'path_table': threading.Lock()}
+
+    def _cached_call(self, key, force=False):
+        with self.locks[key]:
+            age = time.time() - self.timestamps.get(key, 0)
+            if not force and key in self.cache and age < self.ttl:
+                return self.cache[key], True, age
+
+            result = self.monitor_manager.rpc_call(key, timeout=self.rpc_timeout)
+            self.cache[key] = result
+            self.timestamps[key] = time.time()
+            return result, False, 0.0
+
+    def get_interface_stats(self, force=False):
+        """Restituisce (stats, from_cache, age)"""
+        stats, cached, age = self._cached_call('interface_stats', force)
+        for iface in stats.get('interfaces', []):
+            iface['mode_name'] = INTERFACE_MODES.get(iface.get('mode'), str(iface.get('mode')))
+        return stats, cached, age
+
+    def get_path_table(self, force=False):
+        """Restituisce (paths, from_cache, age)"""
+        return self._cached_call('path_table', force)
+
+    def find_path(self, destination):
+        """Cerca una destinazione nella tabella dei percorsi (None se sconosciuta)"""
+        destination = destination.strip().strip('<>').lower()
+        paths, _, _ = self.get_path_table()
+        for entry in paths:
+            if entry.get('hash') == destination:
+                return entry
+        return None
+
+    def get_stats(self):
+        return {
+            'ttl': self.ttl,
+            'cached_keys': list(self.cache.keys()),
+            'ages': {k: round(time.time() - v, 1) for k, v in self.timestamps.items()}
+        }
+
+    # === OUTPUT TESTUALE (compatibile con le pagine esistenti) ===
+
+    @staticmethod
+    def format_status_text(stats):
+        lines = []
+        for iface in stats.get('interfaces', []):
+            lines.append(f" {iface.get('name', '?')}")
+            lines.append(f"    Status    : {'Up' if iface.get('status') else 'Down'}")
+            lines.append(f"    Mode      : {iface.get('mode_name', '?')}")
+            if iface.get('bitrate'):
+                lines.append(f"    Rate      : {format_speed(iface.get('bitrate'))}")
+            if iface.get('clients') is not None:
+                lines.append(f"    Clients   : {iface.get('clients')}")
+            lines.append(f"    Traffic   : ↑{format_size(iface.get('txb'))}  ↓{format_size(iface.get('rxb'))}")
+            lines.append("")
+
+        if stats.get('transport_id'):
+            uptime = stats.get('transport_uptime')
+            lines.append(f" Transport Instance <{stats['transport_id']}> running")
+            if uptime:
+                lines.append(f" Uptime is {int(uptime)}s")
+        lines.append(f" Totals    : ↑{format_size(stats.get('txb'))}  ↓{format_size(stats.get('rxb'))}")
+        return '\n'.join(lines)
+
+    @staticmethod
+    def format_path_text(entry):
+        hops = entry.get('hops')
+        hop_word = 'hop' if hops == 1 else 'hops'
+        return f"Path found, destination <{entry.get('hash')}> is {hops} {hop_word} away via <{entry.get('via')}> on {entry.get('interface')}"
+
+    @staticmethod
+    def format_path_table_text(paths):
+        lines = []
+        for entry in sorted(paths, key=lambda e: (e.get('interface') or '', e.get('hops') or 0)):
+            hops = entry.get('hops')
+            hop_word = 'hop ' if hops == 1 else 'hops'
+            expires = entry.get('expires')
+            expires_str = datetime.fromtimestamp(expires).strftime('%Y-%m-%d %H:%M:%S') if expires else '?'
+            lines.append(f"<{entry.get('hash')}> is {hops} {hop_word} away via <{entry.get('via')}> on {entry.get('interface')} expires {expires_str}")
+        return '\n'.join(lines)
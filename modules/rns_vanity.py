@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+Modulo per la generazione di identità "vanity"
+Cerca un'identità il cui hash di destinazione per un aspect scelto
+inizia con un prefisso esadecimale richiesto, usando un processo per core
+"""
+
+import os
+import re
+import time
+import uuid
+import queue
+import hashlib
+import threading
+import multiprocessing
+
+from modules.rns_aspects import name_hash, is_valid_aspect, TRUNCATED_HASH_LENGTH
+
+# Prefisso massimo: 16^8 tentativi attesi sono già ore anche su molti core
+MAX_PREFIX_LENGTH = 8
+
+# Tentativi tra un aggiornamento e l'altro del contatore condiviso
+COUNTER_BATCH = 256
+
+PREFIX_PATTERN = re.compile(r'^[0-9a-f]+$')
+
+
+# ============================================
+# === WORKER (processo separato) ===
+# ============================================
+
+def _vanity_worker(aspect_name_hash, prefix, counter, stop_event, result_queue):
+    """Genera identità a caso finché una destinazione non inizia con il prefisso"""
+    try:
+        import RNS
+    except ImportError:
+        result_queue.put(('error', 'RNS non installato'))
+        return
+
+    try:
+        while not stop_event.is_set():
+            for attempt in range(COUNTER_BATCH):
+                identity = RNS.Identity()
+                dest = hashlib.sha256(aspect_name_hash + identity.hash).digest()[:TRUNCATED_HASH_LENGTH]
+                if dest.hex().startswith(prefix):
+                    with counter.get_lock():
+                        counter.value += attempt + 1
+                    result_queue.put(('found', (identity.get_private_key().hex(), identity.hash.hex())))
+                    stop_event.set()
+                    return
+            with counter.get_lock():
+                counter.value += COUNTER_BATCH
+    except Exception as e:
+        result_queue.put(('error', str(e)))
+
+
+# ============================================
+# === GESTORE JOB ===
+# ============================================
+
+class VanityGenerator:
+    """Gestisce un job di ricerca vanity alla volta (usa tutti i core)"""
+
+    def __init__(self, on_saved=None, workers=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.on_saved = on_saved
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def expected_attempts(prefix):
+        return 16 ** len(prefix)
+
+    def validate(self, aspect, prefix):
+        if not is_valid_aspect(aspect):
+            return f"Aspect non valido: {aspect}"
+        if not prefix or not PREFIX_PATTERN.match(prefix):
+            return "Prefisso non valido (solo caratteri esadecimali)"
+        if len(prefix) > MAX_PREFIX_LENGTH:
+            return f"Prefisso troppo lungo (max {MAX_PREFIX_LENGTH} caratteri)"
+        return None
+
+    def start(self, name, aspect, prefix, storage_dir):
+        """Avvia la ricerca, restituisce il job id"""
+        with self.lock:
+            for job in self.jobs.values():
+                if job['status'] == 'running':
+                    raise RuntimeError(f"Ricerca già in corso ({job['id']})")
+
+            dest_path = os.path.join(storage_dir, name)
+            if os.path.exists(dest_path):
+                raise RuntimeError(f"File già esistente: {dest_path}")
+
+            job_id = str(uuid.uuid4())[:8]
+            job = {
+                'id': job_id,
+                'name': name,
+                'aspect': aspect,
+                'prefix': prefix,
+                'dest_path': dest_path,
+                'status': 'running',
+                'started': time.time(),
+                'finished': None,
+                'counter': multiprocessing.Value('Q', 0),
+                'stop_event': multiprocessing.Event(),
+                'result_queue': multiprocessing.Queue(),
+                'processes': [],
+                'result': None,
+                'error': None
+            }
+
+            aspect_name_hash = name_hash(aspect)
+            for _ in range(self.workers):
+                p = multiprocessing.Process(
+                    target=_vanity_worker,
+                    args=(aspect_name_hash, prefix, job['counter'], job['stop_event'], job['result_queue']),
+                    daemon=True
+                )
+                p.start()
+                job['processes'].append(p)
+
+            self.jobs[job_id] = job
+
+        threading.Thread(target=self._collector, args=(job,), daemon=True).start()
+        print(f"[Vanity] Job {job_id}: {aspect} prefisso '{prefix}' su {self.workers} processi")
+        return job_id
+
+    def _collector(self, job):
+        """Attende il risultato dei worker e salva l'identità trovata"""
+        while job['status'] == 'running':
+            try:
+                kind, value = job['result_queue'].get(timeout=0.5)
+            except queue.Empty:
+                if not any(p.is_alive() for p in job['processes']):
+                    job['status'] = 'error'
+                    job['error'] = 'Processi terminati senza risultato'
+                continue
+
+            if kind == 'found':
+                try:
+                    private_hex, identity_hex = value
+                    self._save(job, bytes.fromhex(private_hex), bytes.fromhex(identity_hex))
+                    job['status'] = 'found'
+                except Exception as e:
+                    job['status'] = 'error'
+                    job['error'] = f"Errore salvataggio: {e}"
+            else:
+                job['status'] = 'error'
+                job['error'] = value
+
+        self._stop_processes(job)
+        job['finished'] = time.time()
+        print(f"[Vanity] Job {job['id']} terminato: {job['status']}")
+
+    def _save(self, job, private_key, identity_hash):
+        """Salva la chiave privata (64 byte) come fa rnid -g / Identity.to_file"""
+        dest_path = job['dest_path']
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        with open(dest_path, 'wb') as f:
+            f.write(private_key)
+
+        job['result'] = {
+            'path': dest_path,
+            'size': len(private_key),
+            'rns_hash': identity_hash.hex(),
+            'destination_hash': hashlib.sha256(name_hash(job['aspect']) + identity_hash).digest()[:TRUNCATED_HASH_LENGTH].hex()
+        }
+
+        if self.on_saved:
+            self.on_saved(dest_path)
+
+    def _stop_processes(self, job):
+        job['stop_event'].set()
+        for p in job['processes']:
+            p.join(timeout=2)
+            if p.is_alive():
+                p.terminate()
+
+    def cancel(self, job_id):
+        job = self.jobs.get(job_id)
+        if not job:
+            return False
+        if job['status'] == 'running':
+            job['status'] = 'cancelled'
+            job['stop_event'].set()
+        return True
+
+    def status(self, job_id):
+        job = self.jobs.get(job_id)
+        if not job:
+            return None
+
+        end = job['finished'] or time.time()
+        elapsed = max(end - job['started'], 0.001)
+        attempts = job['counter'].value
+        rate = attempts / elapsed
+        expected = self.expected_attempts(job['prefix'])
+
+        # Ricerca senza memoria: il tempo atteso residuo è sempre expected / rate
+        eta = expected / rate if rate > 0 else None
+        probability = 1 - (1 - 1 / expected) ** attempts
+
+        return {
+            'id': job['id'],
+            'status': job['status'],
+            'aspect': job['aspect'],
+            'prefix': job['prefix'],
+            'workers': len(job['processes']),
+            'attempts': attempts,
+            'elapsed': round(elapsed, 1),
+            'rate': round(rate, 1),
+            'expected_attempts': expected,
+            'eta_seconds': round(eta, 1) if eta is not None else None,
+            'probability': round(probability, 4),
+            'result': job['result'],
+            'error': job['error']
+        }
+
+    def stop(self):
+        for job_id in list(self.jobs.keys()):
+            self.cancel(job_id)
+
+
+# ============================================
+# === BLUEPRINT FLASK ===
+# ============================================
+
+def create_vanity_blueprint(generator, storage_dirs):
+    """
+    Crea un blueprint Flask con le route del generatore vanity.
+    storage_dirs: dizionario nome -> cartella di salvataggio
+    """
+    from flask import Blueprint, request, jsonify
+
+    vanity_bp = Blueprint('vanity', __name__, url_prefix='/api/identities/vanity')
+
+    @vanity_bp.route('/start', methods=['POST'])
+    def vanity_start():
+        try:
+            data = request.json or {}
+            name = data.get('name', 'vanity_identity').strip()
+            aspect = data.get('aspect', 'lxmf.delivery').strip()
+            prefix = data.get('prefix', '').strip().lower()
+            storage = data.get('storage', 'rns_manager')
+
+            if '.' in name:
+                name = name.split('.')[0]
+            name = ''.join(c for c in name if c.isalnum() or c in '_-')
+            if not name:
+                return jsonify({'success': False, 'error': 'Nome non valido'})
+
+            error = generator.validate(aspect, prefix)
+            if error:
+                return jsonify({'success': False, 'error': error})
+
+            storage_dir = storage_dirs.get(storage)
+            if not storage_dir:
+                return jsonify({'success': False, 'error': f'Cartella non valida: {storage}'})
+
+            job_id = generator.start(name, aspect, prefix, storage_dir)
+
+            return jsonify({
+                'success': True,
+                'job_id': job_id,
+                'workers': generator.workers,
+                'expected_attempts': generator.expected_attempts(prefix)
+            })
+
+        except Exception as e:
+            return jsonify({'success': False, 'error': str(e)})
+
+    @vanity_bp.route('/status/<job_id>')
+    def vanity_status(job_id):
+        status = generator.status(job_id)
+        if not status:
+            return jsonify({'success': False, 'error': 'Job non trovato'})
+        return jsonify({'success': True, **status})
+
+    @vanity_bp.route('/cancel/<job_id>', methods=['POST'])
+    def vanity_cancel(job_id):
+        if not generator.cancel(job_id):
+            return jsonify({'success': False, 'error': 'Job non trovato'})
+        return jsonify({'success': True, 'message': 'Ricerca annullata'})
+
+    @vanity_bp.route('/storages')
+    def vanity_storages():
+        return jsonify({'success': True, 'storages': list(storage_dirs.keys())})
+
+    return vanity_bp
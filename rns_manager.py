@@ -22,6 +22,11 @@ from flask import Flask, request, jsonify, render_template, Response, stream_wit
 
 # Importa il modulo monitor
 import modules.rns_monitor as rns_monitor
+import modules.rns_crypto as rns_crypto
+import modules.rns_aspects as rns_aspects
+import modules.rns_vanity as rns_vanity
+import modules.rns_status as rns_status
+import modules.rns_probe as rns_probe
 
 # ============================================
 # === LEGGI VERSIONE DA version.py ===
@@ -191,6 +196,49 @@ monitor_manager.start_listener()
 # Registra blueprint del monitor
 app.register_blueprint(rns_monitor.create_monitor_blueprint(monitor_manager))
 
+# Stato rete via RPC al processo monitor (cache breve, niente rnstatus/rnpath)
+network_status = rns_status.NetworkStatusService(monitor_manager, ttl=5)
+
+# Motore probe (eseguiti dal processo monitor, storico in probes.db)
+probe_engine = rns_probe.ProbeEngine(monitor_manager, CACHE_DIR, max_concurrent=16)
+app.register_blueprint(rns_probe.create_probe_blueprint(probe_engine))
+
+# ============================================
+# === OPERAZIONI CRITTOGRAFICHE BATCH ===
+# ============================================
+
+crypto_batch_manager = rns_crypto.CryptoBatchManager(
+    rnid_path=get_rnid_path(),
+    tmp_dir=LOCAL_TMP,
+    output_dir=LOCAL_DOWNLOADS
+)
+app.register_blueprint(rns_crypto.create_crypto_blueprint(crypto_batch_manager))
+
+# ============================================
+# === HASH DESTINAZIONI (identità × aspect) ===
+# ============================================
+
+identity_resolver = rns_aspects.IdentityHashResolver(get_rnid_path())
+app.register_blueprint(rns_aspects.create_aspects_blueprint(identity_resolver, rns_monitor.RNS_ASPECTS))
+
+# ============================================
+# === GENERATORE IDENTITÀ VANITY ===
+# ============================================
+
+vanity_storage_dirs = {
+    'rns_manager': RNS_MANAGER_STORAGE,
+    'reticulum': RETICULUM_STORAGE,
+    'nomadnet': NOMADNET_STORAGE,
+    'lxmf': LXMF_STORAGE
+}
+vanity_generator = rns_vanity.VanityGenerator(
+    on_saved=lambda path: identity_cache.clear('all_identities')
+)
+app.register_blueprint(rns_vanity.create_vanity_blueprint(
+    vanity_generator,
+    {k: v for k, v in vanity_storage_dirs.items() if v}
+))
+
 # Route di redirect per compatibilità con /monitor
 @app.route('/monitor')
 def redirect_monitor():
@@ -430,58 +478,13 @@ def list_identities():
                             'valid': False
                         }
                         
-                        try:
-                            rnid_cmd = get_rnid_path()
-                            result = subprocess.run(
-                                [rnid_cmd, '-i', item_path, '--print-identity'],
-                                capture_output=True,
-                                text=True,
-                                timeout=3
-                            )
-                            
-                            if result.returncode == 0:
-                                identity['valid'] = True
-                                
-                                for line in result.stdout.split('\n'):
-                                    if 'Loaded Identity <' in line:
-                                        start = line.find('<') + 1
-                                        end = line.find('>', start)
-                                        if start > 0 and end > start:
-                                            identity['rns_hash'] = line[start:end]
-                                            break
-                            
-                            aspects_to_check = rns_monitor.RNS_ASPECTS[:5]
-                            for aspect in aspects_to_check:
-                                try:
-                                    hash_result = subprocess.run(
-                                        [rnid_cmd, '-i', item_path, '-H', aspect],
-                                        capture_output=True,
-                                        text=True,
-                                        timeout=2
-                                    )
-                                    
-                                    if hash_result.returncode == 0:
-                                        pattern = f"The {aspect} destination for this Identity is <"
-                                        for line in hash_result.stdout.split('\n'):
-                                            if pattern in line:
-                                                start = line.find('<') + 1
-                                                end = line.find('>', start)
-                                                if start > 0 and end > start:
-                                                    hash_value = line[start:end]
-                                                    identity['aspect_hashes'][aspect] = hash_value
-                                                    break
-                                        
-                                        if aspect not in identity['aspect_hashes']:
-                                            for line in hash_result.stdout.split('\n'):
-                                                if 'Destination hash:' in line:
-                                                    hash_value = line.split('Destination hash:')[-1].strip()
-                                                    identity['aspect_hashes'][aspect] = hash_value
-                                                    break
-                                except:
-                                    continue
-                            
-                        except Exception:
-                            continue
+                        # Identity hash (cache per mtime) + tutti gli aspect in un'unica passata
+                        rns_hash = identity_resolver.resolve(item_path)
+                        if rns_hash:
+                            identity['valid'] = True
+                            identity['rns_hash'] = rns_hash
+                            hashes = rns_aspects.compute_matrix([rns_hash], rns_monitor.RNS_ASPECTS)[0]
+                            identity['aspect_hashes'] = dict(zip(rns_monitor.RNS_ASPECTS, hashes))
                         
                         identities.append(identity)
     
@@ -1210,8 +1213,33 @@ def cleanup_temp_file():
 # === COMANDI RNS (rnstatus, rnpath, rnprobe) ===
 # ============================================
 
+def _clean_cli_output(text):
+    """Rimuove backspace, caratteri di controllo e codici ANSI dall'output CLI"""
+    text = re.sub(r'.\x08', '', text)
+    text = re.sub(r'[\x00-\x08\x0B\x0C\x0E-\x1F\x7F]', '', text)
+    text = re.sub(r'\x1B\[[0-9;]*[a-zA-Z]', '', text)
+    return text
+
 @app.route('/api/rns/status')
-def rns_status():
+def rns_status_route():
+    force = request.args.get('force', 'false').lower() == 'true'
+    
+    # Via RPC all'istanza Reticulum del monitor
+    try:
+        stats, from_cache, age = network_status.get_interface_stats(force=force)
+        return jsonify({
+            'success': True,
+            'source': 'rpc',
+            'from_cache': from_cache,
+            'cache_age': age,
+            'interfaces': stats.get('interfaces', []),
+            'stats': {k: v for k, v in stats.items() if k != 'interfaces'},
+            'output': network_status.format_status_text(stats),
+            'error': ''
+        })
+    except Exception as e:
+        print(f"[Status] RPC non disponibile, uso rnstatus: {e}")
+    
     try:
         rnstatus_cmd = get_rnstatus_path()
         result = subprocess.run(
@@ -1222,6 +1250,7 @@ def rns_status():
         )
         return jsonify({
             'success': result.returncode == 0,
+            'source': 'cli',
             'output': result.stdout,
             'error': result.stderr
         })
@@ -1230,18 +1259,50 @@ def rns_status():
 
 @app.route('/api/rns/paths')
 def rns_paths():
+    destination = request.args.get('dest', '').strip()
+    force = request.args.get('force', 'false').lower() == 'true'
+    
+    # Via RPC: tabella completa o percorso già noto
+    try:
+        if destination:
+            entry = network_status.find_path(destination)
+            if entry:
+                return jsonify({
+                    'success': True,
+                    'source': 'rpc',
+                    'path': entry,
+                    'output': network_status.format_path_text(entry),
+                    'error': '',
+                    'destination': destination,
+                    'cmd': f'rnpath {destination}'
+                })
+            # Percorso sconosciuto: serve una path request, ci pensa rnpath
+        else:
+            paths, from_cache, age = network_status.get_path_table(force=force)
+            return jsonify({
+                'success': True,
+                'source': 'rpc',
+                'from_cache': from_cache,
+                'cache_age': age,
+                'paths': paths,
+                'output': network_status.format_path_table_text(paths),
+                'error': '',
+                'destination': '',
+                'cmd': 'rnpath -t'
+            })
+    except Exception as e:
+        print(f"[Status] RPC non disponibile, uso rnpath: {e}")
+    
     try:
-        destination = request.args.get('dest', '')
-        
         print(f"[DEBUG] rnpath richiesto per destinazione: '{destination}'")
         
         rnpath_cmd = get_rnpath_path()
-        if destination and destination.strip():
-            cmd = [rnpath_cmd, destination.strip()]
+        if destination:
+            cmd = [rnpath_cmd, destination]
             print(f"[DEBUG] Esecuzione comando: {' '.join(cmd)}")
         else:
-            cmd = [rnpath_cmd]
-            print(f"[DEBUG] Esecuzione comando: rnpath (senza argomenti)")
+            cmd = [rnpath_cmd, '-t']
+            print(f"[DEBUG] Esecuzione comando: rnpath -t")
         
         result = subprocess.run(
             cmd,
@@ -1251,25 +1312,14 @@ def rns_paths():
         )
         
         print(f"[DEBUG] rnpath returncode: {result.returncode}")
-        print(f"[DEBUG] rnpath stdout: {result.stdout[:200]}...")
-        print(f"[DEBUG] rnpath stderr: {result.stderr[:200]}...")
-        
-        stdout = result.stdout
-        stderr = result.stderr
-        
-        stdout = re.sub(r'.\x08', '', stdout)
-        stdout = re.sub(r'[\x00-\x08\x0B\x0C\x0E-\x1F\x7F]', '', stdout)
-        stdout = re.sub(r'\x1B\[[0-9;]*[a-zA-Z]', '', stdout)
-        
-        stderr = re.sub(r'.\x08', '', stderr)
-        stderr = re.sub(r'[\x00-\x08\x0B\x0C\x0E-\x1F\x7F]', '', stderr)
         
         return jsonify({
             'success': result.returncode == 0,
-            'output': stdout,
-            'error': stderr,
+            'source': 'cli',
+            'output': _clean_cli_output(result.stdout),
+            'error': _clean_cli_output(result.stderr),
             'destination': destination,
-            'cmd': ' '.join(cmd) if destination else 'rnpath'
+            'cmd': ' '.join(cmd) if destination else 'rnpath -t'
         })
     except subprocess.TimeoutExpired:
         print("[DEBUG] rnpath timeout scaduto")
@@ -1278,16 +1328,48 @@ def rns_paths():
         print(f"[DEBUG] Errore rnpath: {str(e)}")
         return jsonify({'success': False, 'error': str(e)})
 
+def _run_probe(destination, aspect, timeout, run_async=False):
+    """Probe tramite il motore del monitor; None se il monitor non è raggiungibile"""
+    if monitor_manager.sock is None:
+        return None
+    
+    probe_id = probe_engine.submit(destination, aspect, timeout)
+    if run_async:
+        return {'success': True, 'probe_id': probe_id, 'status': 'queued',
+                'destination': destination, 'aspect': aspect}
+    
+    result = probe_engine.wait(probe_id, timeout + 5)
+    if not result or result.get('status') != 'done':
+        return {'success': False, 'probe_id': probe_id, 'error': 'Timeout del probe',
+                'destination': destination, 'aspect': aspect}
+    
+    return {
+        'success': result['success'],
+        'probe_id': probe_id,
+        'output': rns_probe.ProbeEngine.format_output(result),
+        'error': result.get('error') or '',
+        'result': result,
+        'destination': destination,
+        'aspect': aspect,
+        'cmd': f'rnprobe {aspect} {destination}'
+    }
+
 @app.route('/api/rns/probe', methods=['POST'])
-def rns_probe():
+def rns_probe_route():
     try:
         data = request.json
         destination = data.get('destination', '')
         aspect = data.get('aspect', 'rnstransport.probe')
+        timeout = float(data.get('timeout', 15))
         
         if not destination:
             return jsonify({'success': False, 'error': 'Nessuna destinazione specificata'})
         
+        response = _run_probe(destination, aspect, timeout, run_async=data.get('async', False))
+        if response is not None:
+            return jsonify(response)
+        
+        # Monitor non disponibile: rnprobe da riga di comando
         rnprobe_cmd = get_rnprobe_path()
         cmd = [rnprobe_cmd, aspect, destination]
         
@@ -1300,23 +1382,10 @@ def rns_probe():
             timeout=30
         )
         
-        print(f"[DEBUG] Probe returncode: {result.returncode}")
-        print(f"[DEBUG] Probe stdout: {result.stdout[:200]}")
-        
-        stdout = result.stdout
-        stderr = result.stderr
-        
-        stdout = re.sub(r'.\x08', '', stdout)
-        stdout = re.sub(r'[\x00-\x08\x0B\x0C\x0E-\x1F\x7F]', '', stdout)
-        stdout = re.sub(r'\x1B\[[0-9;]*[a-zA-Z]', '', stdout)
-        
-        stderr = re.sub(r'.\x08', '', stderr)
-        stderr = re.sub(r'[\x00-\x08\x0B\x0C\x0E-\x1F\x7F]', '', stderr)
-        
         return jsonify({
             'success': result.returncode == 0,
-            'output': stdout,
-            'error': stderr,
+            'output': _clean_cli_output(result.stdout),
+            'error': _clean_cli_output(result.stderr),
             'destination': destination,
             'aspect': aspect,
             'cmd': ' '.join(cmd)
@@ -1333,6 +1402,7 @@ def rns_probe_aspect():
         data = request.json
         identity_path = data.get('identity_path', '')
         aspect = data.get('aspect', 'rnstransport.probe')
+        timeout = float(data.get('timeout', 15))
         
         if not identity_path or not os.path.exists(identity_path):
             return jsonify({'success': False, 'error': 'Identità non trovata'})
@@ -1340,42 +1410,33 @@ def rns_probe_aspect():
         if aspect not in rns_monitor.RNS_ASPECTS:
             return jsonify({'success': False, 'error': f'Aspect non valido: {aspect}'})
         
-        rnid_cmd = get_rnid_path()
-        hash_result = subprocess.run(
-            [rnid_cmd, '-i', identity_path, '-H', aspect],
-            capture_output=True,
-            text=True,
-            timeout=5
-        )
-        
-        if hash_result.returncode != 0:
+        identity_hash = identity_resolver.resolve(identity_path)
+        if not identity_hash:
             return jsonify({'success': False, 'error': 'Impossibile calcolare hash aspect'})
         
-        dest_hash = None
-        for line in hash_result.stdout.split('\n'):
-            if 'Destination hash:' in line:
-                dest_hash = line.split('Destination hash:')[-1].strip()
-                break
-        
-        if not dest_hash:
-            return jsonify({'success': False, 'error': 'Hash non trovato'})
+        dest_hash = rns_aspects.destination_hash(bytes.fromhex(identity_hash), aspect)
         
-        rnprobe_cmd = get_rnprobe_path()
-        probe_result = subprocess.run(
-            [rnprobe_cmd, dest_hash],
-            capture_output=True,
-            text=True,
-            timeout=30
-        )
+        response = _run_probe(dest_hash, aspect, timeout, run_async=data.get('async', False))
+        if response is None:
+            rnprobe_cmd = get_rnprobe_path()
+            probe_result = subprocess.run(
+                [rnprobe_cmd, aspect, dest_hash],
+                capture_output=True,
+                text=True,
+                timeout=30
+            )
+            response = {
+                'success': probe_result.returncode == 0,
+                'output': probe_result.stdout,
+                'error': probe_result.stderr
+            }
         
-        return jsonify({
-            'success': probe_result.returncode == 0,
-            'output': probe_result.stdout,
-            'error': probe_result.stderr,
+        response.update({
             'dest_hash': dest_hash,
             'aspect': aspect,
             'identity_path': identity_path
         })
+        return jsonify(response)
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
@@ -1489,6 +1550,13 @@ def shutdown_server():
         except Exception as e:
             print(f"[!] Errore fermo monitor: {e}")
         
+        try:
+            crypto_batch_manager.stop()
+            vanity_generator.stop()
+            probe_engine.stop()
+        except Exception as e:
+            print(f"[!] Errore fermo worker: {e}")
+        
         # Pulisci file temporanei
         try:
             if os.path.exists(LOCAL_TMP):
@@ -1529,6 +1597,13 @@ def signal_handler(sig, frame):
     except Exception as e:
         print(f"[!] Errore fermo monitor: {e}")
     
+    try:
+        crypto_batch_manager.stop()
+        vanity_generator.stop()
+        probe_engine.stop()
+    except Exception as e:
+        print(f"[!] Errore fermo worker: {e}")
+    
     # Pulisci file temporanei
     try:
         if os.path.exists(LOCAL_TMP):
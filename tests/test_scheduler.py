@@ -0,0 +1,42 @@
+import time
+import unittest
+
+from core.scheduler import PeriodicScheduler
+
+
+class PeriodicSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = PeriodicScheduler()
+
+    def tearDown(self):
+        self.scheduler.stop()
+
+    def test_remove_then_add_runs_once_per_interval(self):
+        runs = []
+        self.scheduler.add('job', 0.2, lambda: runs.append(time.time()), jitter=0)
+        time.sleep(0.3)
+        self.assertTrue(self.scheduler.remove('job'))
+
+        runs.clear()
+        self.scheduler.add('job', 0.2, lambda: runs.append(time.time()), jitter=0)
+        time.sleep(1.1)
+
+        # Cinque giri in 1.1 s: con la voce vecchia ancora valida sarebbero il doppio
+        self.assertLessEqual(len(runs), 6)
+        self.assertGreaterEqual(len(runs), 4)
+        job = self.scheduler.get('job')
+        self.assertGreaterEqual(job['missed'], 0)
+        # Solo la voce corrente della generazione attiva nell'heap
+        live = [entry for entry in self.scheduler.heap if entry[3] == self.scheduler.jobs['job']['generation']]
+        self.assertEqual(len(live), 1)
+
+    def test_removed_job_does_not_run(self):
+        runs = []
+        self.scheduler.add('job', 0.1, lambda: runs.append(1), jitter=0)
+        self.scheduler.remove('job')
+        time.sleep(0.3)
+        self.assertEqual(runs, [])
+
+
+if __name__ == '__main__':
+    unittest.main()